@@ -3,14 +3,28 @@
 import numpy as np
 import inspect
 import tensorflow as tf
+import tensorflow_probability as tfp
 from scipy.stats import ttest_ind
 from sklearn.neighbors import KernelDensity
 from epi.error_formatters import format_type_err_msg
-from epi.normalizing_flows import NormalizingFlow
+from epi.normalizing_flows import (
+    NormalizingFlow,
+    ConditionedNormFlow,
+    PartitionedIntervalFlow,
+    SimplexFlow,
+    BlockSupportFlow,
+    population_call,
+)
 from epi.util import (
     gaussian_backward_mapping,
     aug_lag_vars,
     unbiased_aug_grad,
+    aug_lag_surrogate,
+    grad_snr,
+    adapt_batch_size,
+    chunked_R_stats,
+    tf_compile,
+    OptLog,
     AugLagHPs,
     array_str,
     np_column_vec,
@@ -23,8 +37,37 @@ import seaborn as sns
 import pickle
 import time
 import os
+import weakref
+import multiprocessing
 
 REAL_NUMERIC_TYPES = (int, float)
+# Number of emergent property statistics at which Model.epi defaults to the
+# single backward pass augmented Lagrangian gradient.
+SINGLE_PASS_GRAD_MIN_M = 5
+# Compiled Model.epi graphs shared across calls (see Model._epi_graphs), held
+# per model so that they are released along with it.
+_EPI_GRAPH_CACHE = weakref.WeakKeyDictionary()
+
+
+def clear_epi_graph_cache():
+    """Clears the flows and compiled graphs cached by :obj:`epi.models.Model.epi`."""
+    _EPI_GRAPH_CACHE.clear()
+
+
+def _support_key(support_mapping):
+    """Hashable structure of a support mapping, for keying cached graphs.
+
+    The bounds of interval flows are keyed separately by the flow bounds.
+    """
+    if support_mapping is None:
+        return None
+    if isinstance(support_mapping, BlockSupportFlow):
+        return (
+            type(support_mapping).__name__,
+            tuple(support_mapping.Ds),
+            tuple([_support_key(bijector) for bijector in support_mapping.bijectors]),
+        )
+    return type(support_mapping).__name__
 
 
 class Parameter(object):
@@ -100,6 +143,201 @@ class Parameter(object):
         self.ub = ub
 
 
+class StructuredParameter(Parameter):
+    """Parameter with structure, represented by its free degrees of freedom.
+
+    The normalizing flow only models the D free coordinates of a structured
+    parameter, which are mapped to their support by
+    :obj:`support_bijector`.  The emergent property statistics function
+    receives the parameter unpacked to its structured form by :obj:`unpack`
+    (see :obj:`epi.models.Model.set_eps`).
+
+    :param name: Parameter name.
+    :type name: str
+    :param D: Number of free dimensions of parameter.
+    :type D: int
+    :param lb: Lower bound of free coordinates, defaults to `np.NINF*np.ones(D)`.
+    :type lb: float or np.ndarray, optional
+    :param ub: Upper bound of free coordinates, defaults to `np.PINF*np.ones(D)`.
+    :type ub: float or np.ndarray, optional
+    """
+
+    def __init__(self, name, D, lb=None, ub=None):
+        """Constructor method."""
+        if isinstance(lb, REAL_NUMERIC_TYPES) and type(D) is int:
+            lb = lb * np.ones(D)
+        if isinstance(ub, REAL_NUMERIC_TYPES) and type(D) is int:
+            ub = ub * np.ones(D)
+        super().__init__(name, D, lb, ub)
+
+    def _set_n(self, n, n_min=1):
+        if type(n) is not int:
+            raise TypeError(format_type_err_msg(self, "n", n, int))
+        if n < n_min:
+            raise ValueError("Parameter size n must be at least %d." % n_min)
+        self.n = n
+
+    def support_bijector(self):
+        """Bijector mapping the free coordinates to their support.
+
+        :return: Interval flow of the bounds of the free coordinates.
+        :rtype: :obj:`epi.normalizing_flows.PartitionedIntervalFlow`
+        """
+        return PartitionedIntervalFlow(self.lb, self.ub)
+
+    def unpack(self, z):
+        """Structured form of batch free coordinates z (N, D).
+
+        Defaults to the free coordinates themselves.
+
+        :param z: Free coordinates.
+        :type z: tf.Tensor
+        :return: Structured parameter (N, ...).
+        :rtype: tf.Tensor
+        """
+        return z
+
+
+class SymmetricParameter(StructuredParameter):
+    """Symmetric n x n matrix parameter.
+
+    The free coordinates are the :math:`n(n+1)/2` elements of the lower
+    triangle in the order of :obj:`tfp.math.fill_triangular`.
+
+    :param name: Parameter name.
+    :type name: str
+    :param n: Number of rows and columns.
+    :type n: int
+    :param lb: Lower bound of the elements, defaults to no bound.
+    :type lb: float or np.ndarray, optional
+    :param ub: Upper bound of the elements, defaults to no bound.
+    :type ub: float or np.ndarray, optional
+    """
+
+    def __init__(self, name, n, lb=None, ub=None):
+        """Constructor method."""
+        self._set_n(n)
+        super().__init__(name, n * (n + 1) // 2, lb, ub)
+        self.shape = (n, n)
+
+    def unpack(self, z):
+        L = tfp.math.fill_triangular(z)
+        L_T = tf.linalg.matrix_transpose(L)
+        return L + L_T - tf.linalg.diag(tf.linalg.diag_part(L))
+
+
+class PSDParameter(StructuredParameter):
+    """Positive definite n x n matrix parameter :math:`LL^\\top`.
+
+    The free coordinates are the :math:`n(n+1)/2` elements of the Cholesky
+    factor :math:`L` in the order of :obj:`tfp.math.fill_triangular`, whose
+    diagonal elements are positive.
+
+    :param name: Parameter name.
+    :type name: str
+    :param n: Number of rows and columns.
+    :type n: int
+    """
+
+    def __init__(self, name, n):
+        """Constructor method."""
+        self._set_n(n)
+        D = n * (n + 1) // 2
+        diag_inds = np.diag(tfp.math.fill_triangular(np.arange(D)).numpy())
+        lb = np.NINF * np.ones(D)
+        lb[diag_inds] = 0.0
+        super().__init__(name, D, lb)
+        self.shape = (n, n)
+
+    def unpack(self, z):
+        L = tfp.math.fill_triangular(z)
+        return tf.matmul(L, L, transpose_b=True)
+
+
+class DiagonalParameter(StructuredParameter):
+    """Diagonal n x n matrix parameter.
+
+    :param name: Parameter name.
+    :type name: str
+    :param n: Number of rows and columns.
+    :type n: int
+    :param lb: Lower bound of the diagonal, defaults to no bound.
+    :type lb: float or np.ndarray, optional
+    :param ub: Upper bound of the diagonal, defaults to no bound.
+    :type ub: float or np.ndarray, optional
+    """
+
+    def __init__(self, name, n, lb=None, ub=None):
+        """Constructor method."""
+        self._set_n(n)
+        super().__init__(name, n, lb, ub)
+        self.shape = (n, n)
+
+    def unpack(self, z):
+        return tf.linalg.diag(z)
+
+
+class SimplexParameter(StructuredParameter):
+    """Parameter on the (n-1)-simplex, i.e. n positive elements summing to 1.
+
+    The free coordinates are the first n-1 elements.
+
+    :param name: Parameter name.
+    :type name: str
+    :param n: Number of elements.
+    :type n: int
+    """
+
+    def __init__(self, name, n):
+        """Constructor method."""
+        self._set_n(n, 2)
+        super().__init__(name, n - 1, 0.0, 1.0)
+        self.shape = (n,)
+
+    def support_bijector(self):
+        return SimplexFlow(self.D)
+
+    def unpack(self, z):
+        return tf.concat([z, 1.0 - tf.reduce_sum(z, 1, keepdims=True)], 1)
+
+
+class SparseMatrixParameter(StructuredParameter):
+    """Matrix parameter with fixed sparsity.
+
+    The free coordinates are the elements where mask is True in row major
+    order.  All other elements are zero.
+
+    :param name: Parameter name.
+    :type name: str
+    :param mask: Boolean matrix of the nonzero elements.
+    :type mask: np.ndarray
+    :param lb: Lower bound of the nonzero elements, defaults to no bound.
+    :type lb: float or np.ndarray, optional
+    :param ub: Upper bound of the nonzero elements, defaults to no bound.
+    :type ub: float or np.ndarray, optional
+    """
+
+    def __init__(self, name, mask, lb=None, ub=None):
+        """Constructor method."""
+        if type(mask) is not np.ndarray:
+            raise TypeError(format_type_err_msg(self, "mask", mask, np.ndarray))
+        if len(mask.shape) != 2:
+            raise ValueError("Parameter mask must be a matrix.")
+        mask = mask.astype(bool)
+        super().__init__(name, int(np.sum(mask)), lb, ub)
+        self.mask = mask
+        self.shape = mask.shape
+        # Index of each element in the free coordinates padded by a zero.
+        gather_inds = np.zeros((mask.size,), np.int32)
+        gather_inds[mask.flatten()] = np.arange(1, self.D + 1)
+        self.gather_inds = gather_inds
+
+    def unpack(self, z):
+        z_pad = tf.concat([tf.zeros_like(z[:, :1]), z], 1)
+        z_mat = tf.gather(z_pad, self.gather_inds, axis=1)
+        return tf.reshape(z_mat, (-1,) + self.shape)
+
+
 class Model(object):
     """Model to run emergent property inference on.  To run EPI on a model:
 
@@ -127,7 +365,7 @@ class Model(object):
         if type(parameters) is not list:
             raise TypeError(format_type_err_msg(self, parameters, "parameters", list))
         for parameter in parameters:
-            if not parameter.__class__.__name__ == "Parameter":
+            if not isinstance(parameter, Parameter):
                 raise TypeError(
                     format_type_err_msg(self, "parameter", parameter, Parameter)
                 )
@@ -141,6 +379,8 @@ class Model(object):
 
         The arguments of eps should be batch vectors of univariate parameter
         tensors following the naming convention in :obj:`self.Parameters`.
+        Structured parameters (see :obj:`epi.models.StructuredParameter`) are
+        passed unpacked, e.g. as batches of matrices.
 
         :param eps: Emergent property statistics function.
         :type eps: function
@@ -148,14 +388,12 @@ class Model(object):
         fullargspec = inspect.getfullargspec(eps)
         args = fullargspec.args
         _parameters = []
-        Ds = []
         for arg in args:
             found = False
             for param in self.parameters:
                 if param.name == arg:
                     found = True
                     _parameters.append(param)
-                    Ds.append(param.D)
                     self.parameters.remove(param)
                     break
             if not found:
@@ -164,13 +402,17 @@ class Model(object):
                 )
 
         self.parameters = _parameters
+        self._eps_fn = eps
 
         def _eps(z):
             ind = 0
             zs = []
-            for D in Ds:
-                zs.append(z[:, ind : (ind + D)])
-                ind += D
+            for param in _parameters:
+                z_param = z[:, ind : (ind + param.D)]
+                if isinstance(param, StructuredParameter):
+                    z_param = param.unpack(z_param)
+                zs.append(z_param)
+                ind += param.D
             return eps(*zs)
 
         self.eps = _eps
@@ -195,6 +437,57 @@ class Model(object):
             ind += param.D
         return (lb, ub)
 
+    def _support_mapping(self,):
+        """Bijector to the support of the structured parameters.
+
+        Consecutive unstructured parameters share an interval flow block.
+
+        :return: Block support flow, or None if no parameter is structured.
+        :rtype: :obj:`epi.normalizing_flows.BlockSupportFlow`
+        """
+        if not any([isinstance(p, StructuredParameter) for p in self.parameters]):
+            return None
+        bijectors, Ds = [], []
+        lbs, ubs = [], []
+
+        def _interval_block():
+            if lbs:
+                lb, ub = np.concatenate(lbs), np.concatenate(ubs)
+                bijectors.append(PartitionedIntervalFlow(lb, ub))
+                Ds.append(lb.shape[0])
+                lbs.clear()
+                ubs.clear()
+
+        for param in self.parameters:
+            if isinstance(param, StructuredParameter):
+                _interval_block()
+                bijectors.append(param.support_bijector())
+                Ds.append(param.D)
+            else:
+                lbs.append(param.lb)
+                ubs.append(param.ub)
+        _interval_block()
+        return BlockSupportFlow(bijectors, Ds)
+
+    def _matrix_shape(self, arch_type, matrix_shape):
+        """Matrix shape of Kronecker coupling flows.
+
+        Defaults to the shape of a model with a single matrix parameter.
+
+        :return: Rows and columns (R, C), or None for other architectures.
+        :rtype: tuple
+        """
+        if arch_type != "kronecker_coupling" or matrix_shape is not None:
+            return matrix_shape
+        if len(self.parameters) == 1:
+            shape = getattr(self.parameters[0], "shape", None)
+            if shape is not None and len(shape) == 2 and shape[0] * shape[1] == self.D:
+                return tuple(shape)
+        raise ValueError(
+            "Kronecker coupling requires a matrix_shape unless the model has a "
+            "single matrix parameter of D elements."
+        )
+
     def epi(
         self,
         mu,
@@ -221,13 +514,34 @@ class Model(object):
         log_rate=50,
         verbose=False,
         save_movie_data=False,
+        single_pass_grad=None,
+        device_loop=False,
+        jit_compile=False,
+        cache_graphs=True,
+        save_path=None,
+        eval_chunk_size=10000,
+        probe_rate=None,
+        remat=None,
+        resume=False,
+        warm_start=None,
+        eta0=None,
+        stl=False,
+        aug_estimator="split",
+        grad_var_samples=None,
+        base_sampling="iid",
+        adaptive_N=None,
+        target_snr=1.0,
+        num_bins=8,
+        matrix_shape=None,
+        init_method="reverse_KL",
+        init_tol=None,
     ):
         """Runs emergent property inference for this model with mean parameter :math:`\\mu`.
 
 
         :param mu: Mean parameter of the emergent property.
         :type mu: np.ndarray
-        :param arch_type: :math:`\\in` :obj:`['autoregressive', 'coupling']`, defaults to :obj:`'coupling'`.
+        :param arch_type: :math:`\\in` :obj:`['autoregressive', 'inverse_autoregressive', 'coupling', 'spline']`, defaults to :obj:`'coupling'`.
         :type arch_type: str, optional
         :param num_stages: Number of coupling or autoregressive stages, defaults to 3.
         :type num_stages: int, optional
@@ -247,6 +561,10 @@ class Model(object):
         :type init_type: str, optional
         :param init_params: Parameters according to :obj:`init_type`.
         :type init_params: dict, optional
+        :param init_method: :math:`\\in` :obj:`['reverse_KL', 'forward_KL']` objective of the gaussian initialization (see :obj:`epi.normalizing_flows.NormalizingFlow.initialize`), defaults to :obj:`'reverse_KL'`.
+        :type init_method: str, optional
+        :param init_tol: Early stopping tolerance of the gaussian initialization, defaults to None.
+        :type init_tol: float, optional
         :param K: Number of augmented Lagrangian iterations, defaults to 10.
         :type K: int, float, optional
         :param num_iters: Number of optimization iterations, defaults to 1000.
@@ -273,110 +591,297 @@ class Model(object):
         :type verbose: bool, optional
         :param save_movie_data: Save data for making optimization movie, defaults to False.
         :type save_movie_data: bool, optional
-        :returns: q_theta, opt_df, save_path
-        :rtype: epi.models.Distribution, pandas.DataFrame, str
+        :param single_pass_grad: Compute the augmented Lagrangian gradient with one backward pass of :obj:`epi.util.aug_lag_surrogate` rather than :math:`m+2` passes, defaults to True if :math:`m \\geq 5`.
+        :type single_pass_grad: bool, optional
+        :param device_loop: Run the iterations between logs in one compiled :obj:`tf.while_loop` with on-device nan detection, defaults to False.
+        :type device_loop: bool, optional
+        :param jit_compile: Compile the training and evaluation graphs with XLA, falling back to uncompiled graphs for unsupported ops, defaults to False.
+        :type jit_compile: bool, optional
+        :param cache_graphs: Reuse the flow, optimizer and compiled graphs of previous calls with the same architecture, emergent property statistics and batch size, defaults to True.
+        :type cache_graphs: bool, optional
+        :param save_path: Directory of checkpoints and optimization data, defaults to :obj:`epi.models.Model.get_save_path`.
+        :type save_path: str, optional
+        :param eval_chunk_size: Maximum number of samples per chunk of the end of epoch evaluation sample bank, defaults to 10000.
+        :type eval_chunk_size: int, optional
+        :param probe_rate: Test convergence every so iterations on a fresh sample bank of 20 batches, and end the epoch once the test also passes on a fresh sample bank of 200 batches, which decides the convergence of the epoch, defaults to None for no online testing.
+        :type probe_rate: int, optional
+        :param remat: :math:`\\in` :obj:`[None, 'eps', 'all']`.  Recompute the activations of the emergent property statistics, and of the flow stages if :obj:`'all'`, during the backward pass rather than holding them, defaults to None.  For memory sublinear in the length of simulations, iterate their steps in eps with :obj:`epi.util.checkpointed_loop`.
+        :type remat: str, optional
+        :param resume: Continue an interrupted run in the save path from its last completed augmented Lagrangian iteration, restoring the flow and optimizer variables, :math:`\\eta`, :math:`c`, the optimization data and the numpy random state, defaults to False.  Runs without a saved state start from initialization.  The tensorflow random state of the flow samples is not restored, so a resumed run is statistically equivalent to, but does not reproduce the samples of, an uninterrupted run.
+        :type resume: bool, optional
+        :param warm_start: Distribution of a previous run with the same architecture to initialize the flow from, defaults to None.
+        :type warm_start: :obj:`epi.models.Distribution`, optional
+        :param eta0: Initial Lagrange multipliers :math:`\\eta`, defaults to zeros.
+        :type eta0: np.ndarray, optional
+        :param stl: Estimate the entropy gradient with the path derivative (sticking the landing) estimator of :obj:`epi.normalizing_flows.NormalizingFlow.stl_log_prob`, defaults to False.
+        :type stl: bool, optional
+        :param aug_estimator: :math:`\\in` :obj:`['split', 'symmetric']` estimator of the augmented term gradient of :obj:`epi.util.aug_lag_surrogate`, defaults to :obj:`'split'`.  :obj:`'symmetric'` requires single_pass_grad.
+        :type aug_estimator: str, optional
+        :param grad_var_samples: Log the total variance of this many independent gradient estimates in column :obj:`grad_var` of opt_df at each logged iteration, defaults to None.
+        :type grad_var_samples: int, optional
+        :param base_sampling: :math:`\\in` :obj:`['iid', 'halton', 'antithetic']` sampling of the flow base distribution in training, evaluation and the returned distribution (see :obj:`epi.normalizing_flows.NormalizingFlow`), defaults to :obj:`'iid'`.  Each batch of the evaluation sample bank is an independent set.
+        :type base_sampling: str, optional
+        :param adaptive_N: Batch size buckets including N, defaults to None for a fixed batch size.  Training starts with batch size N, and at each logged iteration moves to an adjacent bucket following the gradient signal-to-noise ratio estimated from the two halves of a batch (see :obj:`epi.util.adapt_batch_size`).  Each bucket has its own compiled training graphs.  The evaluation sample bank always uses batch size N.  Columns :obj:`N` and :obj:`grad_snr` of opt_df record the batch size up to each logged iteration and the ratio estimated there.
+        :type adaptive_N: list, optional
+        :param target_snr: Target gradient signal-to-noise ratio of adaptive_N, defaults to 1.
+        :type target_snr: float, optional
+        :param num_bins: Number of bins of spline stages, defaults to 8.
+        :type num_bins: int, optional
+        :param matrix_shape: Rows and columns (R, C) of :obj:`'kronecker_coupling'` stages, defaults to the shape of a single matrix parameter (see :obj:`epi.normalizing_flows.NormalizingFlow`).
+        :type matrix_shape: tuple, optional
+        :returns: q_theta, opt_df, save_path, failed.  Column :obj:`num_traces` of opt_df counts the traces of the compiled training and evaluation graphs during this call.
+        :rtype: epi.models.Distribution, pandas.DataFrame, str, bool
         """
-        if num_units is None:
-            num_units = max(2 * self.D, 15)
+        if single_pass_grad is None:
+            single_pass_grad = self.m >= SINGLE_PASS_GRAD_MIN_M
+        if probe_rate is not None:
+            if type(probe_rate) is not int:
+                raise TypeError(
+                    format_type_err_msg(self, "probe_rate", probe_rate, int)
+                )
+            if probe_rate < 1:
+                raise ValueError("probe_rate %d must be positive." % probe_rate)
+        remat_types = [None, "eps", "all"]
+        if remat not in remat_types:
+            raise ValueError("remat %s not in %s." % (str(remat), str(remat_types)))
+        if resume and save_movie_data:
+            raise ValueError("Cannot resume runs saving movie data.")
+        aug_estimators = ["split", "symmetric"]
+        if aug_estimator not in aug_estimators:
+            raise ValueError(
+                "aug_estimator %s not in %s."
+                % (str(aug_estimator), str(aug_estimators))
+            )
+        if aug_estimator == "symmetric" and not single_pass_grad:
+            raise ValueError("Symmetric aug_estimator requires single_pass_grad.")
+        if grad_var_samples is not None:
+            if type(grad_var_samples) is not int:
+                raise TypeError(
+                    format_type_err_msg(
+                        self, "grad_var_samples", grad_var_samples, int
+                    )
+                )
+            if grad_var_samples < 2:
+                raise ValueError("grad_var_samples must be at least 2.")
+        if adaptive_N is not None:
+            if type(adaptive_N) not in [list, tuple]:
+                raise TypeError(
+                    format_type_err_msg(self, "adaptive_N", adaptive_N, list)
+                )
+            for N_b in adaptive_N:
+                if type(N_b) is not int:
+                    raise TypeError(format_type_err_msg(self, "N_b", N_b, int))
+                if N_b < 2:
+                    raise ValueError("adaptive_N batch sizes must be at least 2.")
+            if N not in adaptive_N:
+                raise ValueError("N %d not in adaptive_N." % N)
+            if target_snr <= 0.0:
+                raise ValueError("target_snr must be positive.")
+            N_buckets = sorted(set(adaptive_N))
+        else:
+            N_buckets = [N]
+        if warm_start is not None and not isinstance(warm_start, Distribution):
+            raise TypeError(
+                format_type_err_msg(self, "warm_start", warm_start, Distribution)
+            )
+        if eta0 is not None:
+            eta0 = np.array(eta0, np.float32)
+            if eta0.shape != (self.m,):
+                raise ValueError("eta0 must have shape (%d,)." % self.m)
 
-        nf = NormalizingFlow(
+        nf = self._epi_nf(
             arch_type=arch_type,
-            D=self.D,
             num_stages=num_stages,
             num_layers=num_layers,
             num_units=num_units,
             batch_norm=batch_norm,
             bn_momentum=bn_momentum,
             post_affine=post_affine,
-            bounds=self._get_bounds(),
             random_seed=random_seed,
+            base_sampling=base_sampling,
+            num_bins=num_bins,
+            matrix_shape=matrix_shape,
+        )
+
+        # Reuse the flow, optimizer and compiled graphs of a previous call with
+        # the same architecture and emergent property.
+        # Models and emergent properties are keyed by identity rather than by
+        # name, since both may be redefined under the same name.
+        graph_key = (
+            tuple([(type(param).__name__, param.name) for param in self.parameters]),
+            id(self.eps),
+            _support_key(nf.support_mapping),
+            nf.to_string(),
+            N,
+            self.m,
+            nu,
+            nf.bn_momentum,
+            nf.lb.tobytes(),
+            nf.ub.tobytes(),
+            single_pass_grad,
+            jit_compile,
+            eval_chunk_size,
+            remat,
+            stl,
+            aug_estimator,
+            grad_var_samples,
+            tuple(N_buckets),
         )
+        model_graphs = _EPI_GRAPH_CACHE.setdefault(self, {})
+        if cache_graphs and graph_key in model_graphs:
+            graphs = model_graphs[graph_key]
+            nf, optimizer = graphs["nf"], graphs["optimizer"]
+            for var in optimizer.variables():
+                var.assign(tf.zeros_like(var))
+            optimizer.learning_rate = lr
+        else:
+            optimizer = tf.keras.optimizers.Adam(lr)
+            graphs = self._epi_graphs(
+                nf,
+                optimizer,
+                N,
+                nu,
+                single_pass_grad,
+                jit_compile,
+                eval_chunk_size,
+                remat,
+                stl,
+                aug_estimator,
+                grad_var_samples,
+            )
+            # Training graphs of each batch size bucket share the flow and
+            # optimizer, and are only traced once used.
+            graphs["buckets"] = {N: graphs}
+            for N_b in N_buckets:
+                if N_b != N:
+                    graphs["buckets"][N_b] = self._epi_graphs(
+                        nf,
+                        optimizer,
+                        N_b,
+                        nu,
+                        single_pass_grad,
+                        jit_compile,
+                        eval_chunk_size,
+                        remat,
+                        stl,
+                        aug_estimator,
+                        grad_var_samples,
+                    )
+            if cache_graphs:
+                model_graphs[graph_key] = graphs
+        buckets = graphs["buckets"]
+        for bucket in buckets.values():
+            bucket["mu"].assign(mu)
+        get_R_stats = graphs["get_R_stats"]
+
+        def _num_traces():
+            return sum(
+                [sum(bucket["trace_counts"].values()) for bucket in buckets.values()]
+            )
+
+        traces_0 = _num_traces()
 
         # Hyperparameter object
         aug_lag_hps = AugLagHPs(N, lr, c0, gamma, beta)
 
-        # Initialize architecture to gaussian.
-        print("Initializing %s architecture." % nf.to_string(), flush=True)
-        if init_type is None or init_params is None:
-            mu_init = np.zeros((self.D))
-            Sigma = np.zeros((self.D, self.D))
-            for i in range(self.D):
-                if (np.isneginf(nf.lb[i]) and np.isposinf(nf.ub[i])):
-                    mu_init[i] = 0.
-                    Sigma[i,i] = 1.
-                elif (np.isneginf(nf.lb[i])):
-                    mu_init[i] = self.ub[i]-2.
-                    Sigma[i,i] = 1.
-                elif (np.isposinf(nf.ub[i])):
-                    mu_init[i] = self.lb[i]+2.
-                    Sigma[i,i] = 1.
-                else:
-                    mu_init[i] = (nf.lb[i] + nf.ub[i]) / 2.
-                    Sigma[i,i] = (nf.ub[i]-nf.lb[i]) / 2.
-            init_type = "gaussian"
-            init_params = {'mu':mu_init, 'Sigma':Sigma}
-        nf.initialize(init_type, init_params)
-
-        # Checkpoint the initialization.
-        optimizer = tf.keras.optimizers.Adam(lr)
+        if save_path is None:
+            ckpt_dir = self.get_save_path(mu, nf, aug_lag_hps)
+        else:
+            ckpt_dir = save_path
         ckpt = tf.train.Checkpoint(optimizer=optimizer, model=nf)
-        ckpt_dir = self.get_save_path(mu, nf, aug_lag_hps)
         manager = tf.train.CheckpointManager(ckpt, directory=ckpt_dir, max_to_keep=None)
-        manager.save(checkpoint_number=0)
+        if init_type is None or init_params is None:
+            init_type, init_params = self._default_init(nf)
+
+        state_file = ckpt_dir + "resume_state.npz"
+        if resume and os.path.exists(state_file):
+            # Restore the state following the last completed iteration.
+            state = np.load(state_file)
+            k_resume = int(state["k"])
+            if k_resume >= K:
+                raise ValueError(
+                    "Run in %s completed %d >= K iterations." % (ckpt_dir, k_resume)
+                )
+            # The run directory is not specific to every hyperparameter.
+            if str(state["arch_string"]) != nf.to_string():
+                raise ValueError(
+                    "Run in %s has architecture %s, not %s."
+                    % (ckpt_dir, str(state["arch_string"]), nf.to_string())
+                )
+            if str(state["hp_string"]) != aug_lag_hps.to_string():
+                raise ValueError(
+                    "Run in %s has hyperparameters %s, not %s."
+                    % (ckpt_dir, str(state["hp_string"]), aug_lag_hps.to_string())
+                )
+            if state["mu"].shape != mu.shape or not np.allclose(state["mu"], mu):
+                raise ValueError(
+                    "Run in %s has mu %s, not %s."
+                    % (ckpt_dir, array_str(state["mu"]), array_str(mu))
+                )
+            # The numpy random state is restored below.  The flow samples are
+            # drawn by stateful tensorflow ops seeded at tracing, whose state
+            # is not checkpointed.
+            print("Resuming EPI optimization from k=%d." % k_resume, flush=True)
+            nf(1)
+            status = ckpt.restore(ckpt_dir + "ckpt-%d" % k_resume)
+            status.assert_existing_objects_matched()
+        else:
+            k_resume = 0
+            if os.path.exists(state_file):
+                os.remove(state_file)
+            if warm_start is not None:
+                # Copy the flow variables of the previous run.
+                if warm_start.nf.to_string() != nf.to_string():
+                    raise ValueError(
+                        "warm_start architecture %s is not %s."
+                        % (warm_start.nf.to_string(), nf.to_string())
+                    )
+                nf(1)
+                for var, var_warm in zip(nf.variables, warm_start.nf.variables):
+                    var.assign(var_warm)
+                init_type, init_params = "warm_start", None
+            else:
+                # Initialize architecture to gaussian.
+                print("Initializing %s architecture." % nf.to_string(), flush=True)
+                nf.initialize(
+                    init_type,
+                    init_params,
+                    jit_compile=jit_compile,
+                    method=init_method,
+                    tol=init_tol,
+                )
+            manager.save(checkpoint_number=0)
+        # The flow variables are built, so its stages may be recomputed.
+        nf.remat_stages = remat == "all"
         print("Saving EPI models to %s." % ckpt_dir, flush=True)
 
-        @tf.function
-        def train_step(eta, c):
-            with tf.GradientTape(persistent=True) as tape:
-                z, log_q_z = nf(N)
-                params = nf.trainable_variables
-                tape.watch(params)
-                H, R, R1s, R2 = aug_lag_vars(z, log_q_z, self.eps, mu, N)
-                neg_H = -H
-                lagrange_dot = tf.reduce_sum(tf.multiply(eta, R))
-            aug_l2 = c / 2.0 * tf.reduce_sum(tf.square(R))
-            cost = neg_H + lagrange_dot + aug_l2
-            H_grad = tape.gradient(neg_H, params)
-            lagrange_grad = tape.gradient(lagrange_dot, params)
-            aug_grad = unbiased_aug_grad(R1s, R2, params, tape)
-            gradients = [
-                g1 + g2 + c * g3 for g1, g2, g3 in zip(H_grad, lagrange_grad, aug_grad)
-            ]
-            optimizer.apply_gradients(zip(gradients, params))
-            return cost, H, R, z, log_q_z
-
-        @tf.function
-        def two_dim_T_x_batch(nf, eps, M, N, m):
-            z, _ = nf(M * N)
-            T_x = eps(z)
-            T_x = tf.reshape(T_x, (M, N, m))
-            return T_x
-
-        @tf.function
-        def get_R_norm_dist(nf, eps, mu, M, N):
-            m = mu.shape[1]
-            T_x = two_dim_T_x_batch(nf, eps, M, N, m)
-            return tf.reduce_sum(tf.square(tf.reduce_mean(T_x, axis=1) - mu), axis=1)
-
-        @tf.function
-        def get_R_mean_dist(nf, eps, mu, M, N):
-            m = mu.shape[1]
-            T_x = two_dim_T_x_batch(nf, eps, M, N, m)
-            return tf.reduce_mean(T_x, axis=1) - mu
+        # Number of batches in the evaluation sample bank of each epoch, and in
+        # the smaller sample bank of online convergence probes.
+        M_eval = 200
+        M_probe = 20
 
-        M_test = 200
-        N_test = int(nu * N)
-        M_norm = 200
         # Initialize augmented Lagrangian parameters eta and c.
-        eta, c = np.zeros((self.m,), np.float32), c0
+        if eta0 is None:
+            eta = np.zeros((self.m,), np.float32)
+        else:
+            eta = eta0
+        c = c0
         etas, cs = np.zeros((K, self.m)), np.zeros((K,))
+        N_k = N
 
         # Initialize optimization data frame.
         z, log_q_z = nf(N)
         H_0, R_0, _, _ = aug_lag_vars(z, log_q_z, self.eps, mu, N)
         cost_0 = -H_0 + np.dot(eta, R_0) + np.sum(np.square(R_0))
         R_keys = ["R%d" % (i + 1) for i in range(self.m)]
-        opt_it_dfs = [self._opt_it_df(0, 0, H_0.numpy(), R_0.numpy(), R_keys)]
+        opt_log = self._opt_log(R_keys, 1 + K * (num_iters // log_rate))
+        if k_resume > 0:
+            opt_df = pd.read_csv(ckpt_dir + "opt_data.csv", index_col=0)
+            opt_log.append_df(opt_df[opt_df["k"] <= k_resume])
+        else:
+            self._log_opt_it(
+                opt_log, R_keys, 0, 0, H_0.numpy(), R_0.numpy(), 0, np.nan, N=N
+            )
 
         # Record samples for movie.
         if save_movie_data:
@@ -384,49 +889,124 @@ class Model(object):
             zs = [z.numpy()[:N_save, :]]
             log_q_zs = [log_q_z.numpy()[:N_save]]
 
-        # Measure initial R norm distribution.
-        mu_colvec = np_column_vec(mu).astype(np.float32).T
-        norms = get_R_norm_dist(nf, self.eps, mu_colvec, M_norm, N)
+        if k_resume > 0:
+            eta, c = state["eta"], float(state["c"])
+            norms = tf.constant(state["norms"])
+            K_saved = min(K, state["etas"].shape[0])
+            etas[:K_saved] = state["etas"][:K_saved]
+            cs[:K_saved] = state["cs"][:K_saved]
+            if "N" in state.files and int(state["N"]) in N_buckets:
+                N_k = int(state["N"])
+            np.random.set_state(
+                (
+                    "MT19937",
+                    state["rng_keys"],
+                    int(state["rng_pos"]),
+                    int(state["rng_has_gauss"]),
+                    float(state["rng_cached_gaussian"]),
+                )
+            )
+        else:
+            # Measure initial R norm distribution.
+            _, norms = get_R_stats(M_eval)
 
         # EPI optimization
-        print(format_opt_msg(0, 0, cost_0, H_0, R_0), flush=True)
+        if k_resume == 0:
+            print(format_opt_msg(0, 0, cost_0, H_0, R_0), flush=True)
         failed = False
-        for k in range(1, K + 1):
-            etas[k - 1], cs[k - 1], eta, c
-            for i in range(1, num_iters + 1):
+        for k in range(k_resume + 1, K + 1):
+            etas[k - 1], cs[k - 1] = eta, c
+            probe_passed = False
+            i = 0
+            while i < num_iters:
+                train_step = buckets[N_k]["train_step"]
+                device_train_loop = buckets[N_k]["device_train_loop"]
                 time1 = time.time()
-                cost, H, R, z, log_q_z = train_step(eta, c)
+                if device_loop:
+                    # Run up to the next logged or probed iteration on device.
+                    num_steps = min(log_rate - (i % log_rate), num_iters - i)
+                    if probe_rate is not None:
+                        num_steps = min(num_steps, probe_rate - (i % probe_rate))
+                    cost, H, R, z, log_q_z, steps, is_nan = device_train_loop(
+                        eta, c, tf.constant(num_steps)
+                    )
+                    steps, is_nan = int(steps), bool(is_nan)
+                else:
+                    cost, H, R, z, log_q_z = train_step(eta, c)
+                    steps, is_nan = 1, np.isnan(cost)
                 time2 = time.time()
-                if i % log_rate == 0:
+                i += steps
+                if probe_rate is not None and not is_nan and i < num_iters:
+                    if i % probe_rate == 0:
+                        # Screen with a small i.i.d. sample bank of the current
+                        # flow, and confirm on a full sample bank, so that
+                        # repeated screens do not end epochs early by chance.
+                        R_probe, _ = get_R_stats(M_probe)
+                        if self.test_convergence(R_probe.numpy(), alpha):
+                            R_means, norms_k = get_R_stats(M_eval)
+                            probe_passed = self.test_convergence(
+                                R_means.numpy(), alpha
+                            )
+                if i % log_rate == 0 or probe_passed:
                     if verbose:
                         print(format_opt_msg(k, i, cost, H, R), flush=True)
                     iter = (k - 1) * num_iters + i
-                    opt_it_dfs.append(
-                        self._opt_it_df(k, iter, H.numpy(), R.numpy(), R_keys)
+                    time_per_it = (time2 - time1) / steps
+                    if grad_var_samples is None:
+                        grad_var = np.nan
+                    else:
+                        grad_var = buckets[N_k]["grad_var"](eta, c).numpy()
+                    if adaptive_N is None:
+                        snr = np.nan
+                    else:
+                        snr = buckets[N_k]["grad_snr"](eta, c).numpy()
+                    num_traces = _num_traces() - traces_0
+                    self._log_opt_it(
+                        opt_log,
+                        R_keys,
+                        k,
+                        iter,
+                        H.numpy(),
+                        R.numpy(),
+                        num_traces,
+                        time_per_it,
+                        grad_var,
+                        N_k,
+                        snr,
                     )
+                    if adaptive_N is not None:
+                        N_k = adapt_batch_size(N_buckets, N_k, snr, target_snr)
                     if save_movie_data:
                         zs.append(z.numpy()[:N_save, :])
                         log_q_zs.append(log_q_z.numpy()[:N_save])
-                if np.isnan(cost):
+                if is_nan:
                     failed = True
                     break
+                if probe_passed:
+                    print(
+                        "Online convergence probe passed at iteration %d." % i,
+                        flush=True,
+                    )
+                    break
             if not verbose:
                 print(format_opt_msg(k, i, cost, H, R), flush=True)
 
             # Save epi optimization data following aug lag iteration k.
-            opt_it_df = pd.concat(opt_it_dfs, ignore_index=True)
             manager.save(checkpoint_number=k)
 
             if failed:
                 converged = False
+            elif probe_passed:
+                # The confirming sample bank of the probe is of the final flow.
+                converged = True
             else:
-                R_means = get_R_mean_dist(nf, self.eps, mu_colvec, M_test, N_test)
+                # One sample bank for the convergence test and the c update.
+                R_means, norms_k = get_R_stats(M_eval)
                 converged = self.test_convergence(R_means.numpy(), alpha)
-            last_ind = opt_it_df["iteration"] == k * num_iters
+            last_ind = opt_log.column("iteration") == (k - 1) * num_iters + i
 
-            opt_it_df.loc[last_ind, "converged"] = converged
-            self._save_epi_opt(ckpt_dir, opt_it_df, cs, etas)
-            opt_it_dfs = [opt_it_df]
+            opt_log.column("converged")[last_ind] = converged
+            self._save_epi_opt(ckpt_dir, opt_log.to_df(), etas, cs)
 
             if k < K:
                 if np.isnan(cost):
@@ -437,7 +1017,6 @@ class Model(object):
 
                 # Update eta and c
                 eta = eta + c * R
-                norms_k = get_R_norm_dist(nf, self.eps, mu_colvec, M_norm, N)
                 t, p = ttest_ind(
                     norms_k.numpy(), gamma * norms.numpy(), equal_var=False
                 )
@@ -445,8 +1024,27 @@ class Model(object):
                 if u < 1 - p / 2.0 and t > 0.0:
                     c = beta * c
                 norms = norms_k
+                self._save_epi_state(
+                    ckpt_dir,
+                    k,
+                    eta,
+                    c,
+                    norms.numpy(),
+                    etas,
+                    cs,
+                    N_k,
+                    mu,
+                    nf.to_string(),
+                    aug_lag_hps.to_string(),
+                )
 
-        time_per_it = time2 - time1
+        # Average the logged iteration times over all epochs.
+        times = opt_log.column("time_per_it")
+        times = times[np.isfinite(times)]
+        if times.size > 0:
+            time_per_it = np.mean(times)
+        else:
+            time_per_it = (time2 - time1) / steps
         if save_movie_data:
             np.savez(
                 ckpt_dir + "movie_data.npz",
@@ -463,10 +1061,872 @@ class Model(object):
         # Save hyperparameters.
         self._save_hps(ckpt_dir, nf, aug_lag_hps, init_type, init_params)
 
-        # Return optimized distribution.
-        q_theta = Distribution(nf, self.parameters)
+        # Return optimized distribution.  A cached flow is trained again by
+        # the next call, so the distribution gets its own copy.
+        if cache_graphs:
+            q_theta = Distribution(nf.copy(), self.parameters)
+        else:
+            q_theta = Distribution(nf, self.parameters)
+
+        return q_theta, opt_log.to_df(), ckpt_dir, failed
+
+    def epi_sweep(self, mu, configs, n_workers=None):
+        """Runs :obj:`epi.models.Model.epi` for many configurations in parallel.
+
+        Each configuration is run in a process of a local pool of `n_workers`
+        processes.  Each worker is pinned to a disjoint set of the available
+        cores, and its tensorflow intra-op threads are set to the number of
+        cores it owns.  Configurations that would save to the same directory
+        are saved in subdirectories named by their augmented Lagrangian
+        hyperparameters.
+
+        The workers rebuild the model from its parameters and the function
+        passed to :obj:`epi.models.Model.set_eps`, which must therefore be
+        picklable (defined at the top level of a module).  Scripts calling
+        this method must be guarded by :obj:`if __name__ == "__main__":`.
+
+        :param mu: Mean parameter of the emergent property.
+        :type mu: np.ndarray
+        :param configs: Keyword arguments of :obj:`epi.models.Model.epi` for each run, e.g. from :obj:`epi.util.sample_aug_lag_hps`.
+        :type configs: list
+        :param n_workers: Number of worker processes, defaults to min(len(configs), number of cores).
+        :type n_workers: int, optional
+        :returns: q_thetas, opt_df, save_paths, failed.  Column :obj:`config` of opt_df indexes configs.
+        :rtype: list, pandas.DataFrame, list, list
+        """
+        if type(configs) is not list:
+            raise TypeError(format_type_err_msg(self, "configs", configs, list))
+        if self.eps is None:
+            raise AttributeError("Model.eps is not set.")
+        if hasattr(os, "sched_getaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count()))
+        if n_workers is None:
+            n_workers = min(len(configs), len(cores))
+        if type(n_workers) is not int:
+            raise TypeError(format_type_err_msg(self, "n_workers", n_workers, int))
+        if n_workers < 1 or n_workers > len(cores):
+            raise ValueError(
+                "n_workers must be from 1 to the %d available cores." % len(cores)
+            )
+
+        # Give each configuration its own save directory.
+        nf_arg_names = inspect.getfullargspec(self._epi_nf).args[1:]
+        configs = [dict(config) for config in configs]
+        save_paths = []
+        for config in configs:
+            if "save_path" not in config:
+                save_path, aug_lag_hps = self._epi_save_path(mu, config)
+                if save_path in save_paths:
+                    save_path += aug_lag_hps.to_string() + "/"
+                config["save_path"] = save_path
+            if config["save_path"] in save_paths:
+                raise ValueError(
+                    "Configurations save to the same path %s." % config["save_path"]
+                )
+            save_paths.append(config["save_path"])
+
+        ctx = multiprocessing.get_context("spawn")
+        core_sets = ctx.Queue()
+        for core_set in np.array_split(np.array(cores), n_workers):
+            core_sets.put([int(core) for core in core_set])
+        args = [
+            (self.name, self.parameters, self._eps_fn, mu, config)
+            for config in configs
+        ]
+        with ctx.Pool(n_workers, _epi_sweep_init, (core_sets,)) as pool:
+            results = pool.map(_epi_sweep_worker, args, chunksize=1)
+
+        q_thetas, opt_dfs, failed = [], [], []
+        for i, (config, (opt_df, save_path, failed_i)) in enumerate(
+            zip(configs, results)
+        ):
+            nf = self._epi_nf(
+                **{key: config[key] for key in nf_arg_names if key in config}
+            )
+            checkpoint = tf.train.Checkpoint(model=nf)
+            status = checkpoint.restore(tf.train.latest_checkpoint(save_path))
+            status.expect_partial()
+            q_thetas.append(Distribution(nf, self.parameters))
+            opt_df["config"] = i
+            opt_dfs.append(opt_df)
+            failed.append(failed_i)
+        opt_df = pd.concat(opt_dfs, ignore_index=True)
+        return q_thetas, opt_df, save_paths, failed
+
+    def epi_continuation(self, mus, **epi_kwargs):
+        """Runs emergent property inference along a sequence of mean parameters.
+
+        The first run starts from the initialization of
+        :obj:`epi.models.Model.epi`.  Each following run initializes its flow
+        from the distribution of the last run that did not fail, and its
+        Lagrange multipliers :math:`\\eta` from the final :math:`\\eta` of
+        that run, so that it only has to move the distribution by the change
+        in :math:`\\mu`.  Runs stop early once converged unless
+        :obj:`stop_early=False` is passed.  Each run is saved in a
+        subdirectory of its default save path named by its :math:`\\mu`.
+
+        :param mus: Mean parameters of the emergent property in order of the sweep.
+        :type mus: list
+        :param epi_kwargs: Keyword arguments of :obj:`epi.models.Model.epi` other than mu, warm_start, eta0 and save_path.
+        :type epi_kwargs: dict
+        :returns: q_thetas, opt_df, save_paths, failed.  Column :obj:`mu_ind` of opt_df indexes mus.
+        :rtype: list, pandas.DataFrame, list, list
+        """
+        for key in ["mu", "warm_start", "eta0", "save_path"]:
+            if key in epi_kwargs:
+                raise ValueError("epi_continuation sets the epi argument %s." % key)
+        epi_kwargs.setdefault("stop_early", True)
+
+        q_thetas, opt_dfs, save_paths, failed = [], [], [], []
+        q_theta_prev, eta_prev = None, None
+        for i, mu in enumerate(mus):
+            save_path, _ = self._epi_save_path(mu, epi_kwargs)
+            save_path += "mu=%s/" % array_str(mu)
+            q_theta, opt_df, save_path, failed_i = self.epi(
+                mu,
+                warm_start=q_theta_prev,
+                eta0=eta_prev,
+                save_path=save_path,
+                **epi_kwargs
+            )
+            if not failed_i:
+                # Lagrange multipliers of the last augmented Lagrangian iteration.
+                etas = np.load(save_path + "opt_data.npz")["etas"]
+                q_theta_prev, eta_prev = q_theta, etas[opt_df["k"].max() - 1]
+            q_thetas.append(q_theta)
+            opt_df["mu_ind"] = i
+            opt_dfs.append(opt_df)
+            save_paths.append(save_path)
+            failed.append(failed_i)
+        opt_df = pd.concat(opt_dfs, ignore_index=True)
+        return q_thetas, opt_df, save_paths, failed
+
+    def epi_amortized(
+        self,
+        mus,
+        num_mus=100,
+        num_stages=3,
+        num_layers=2,
+        num_units=None,
+        K=10,
+        num_iters=1000,
+        N=500,
+        mu_batch=10,
+        lr=1e-3,
+        c0=1.0,
+        gamma=0.25,
+        beta=4.0,
+        alpha=0.05,
+        nu=1.0,
+        stop_early=False,
+        log_rate=50,
+        verbose=False,
+        random_seed=1,
+        jit_compile=False,
+        eval_chunk_size=10000,
+    ):
+        """Runs amortized emergent property inference over a set of mean parameters.
+
+        One :obj:`epi.normalizing_flows.ConditionedNormFlow` conditioned on
+        :math:`\\mu` is trained on a set of targets.  Each iteration draws
+        :obj:`mu_batch` targets, and estimates their augmented Lagrangian
+        terms from N samples of the flow conditioned on each.  Each target
+        has its own :math:`\\eta` and :math:`c`, which are updated from its
+        own evaluation sample bank after each augmented Lagrangian iteration.
+        The flow is not initialized to a Gaussian.  Optimization stops when
+        the cost of a target is nan.
+
+        The remaining arguments are those of :obj:`epi.models.Model.epi`.
+
+        :param mus: Targets (num targets, m), or a box (mu_lb, mu_ub) from which num_mus targets are drawn uniformly.
+        :type mus: np.ndarray or tuple
+        :param num_mus: Number of targets drawn from a box, defaults to 100.
+        :type num_mus: int, optional
+        :param mu_batch: Number of targets per iteration, defaults to 10.
+        :type mu_batch: int, optional
+        :returns: q_theta, opt_df, save_path, failed.  The R columns of opt_df are means over the targets of each iteration, and :obj:`converged` is true when all targets converged.  The convergence of each target after each augmented Lagrangian iteration is saved to :obj:`converged.npy` of save_path.
+        :rtype: epi.models.AmortizedDistribution, pandas.DataFrame, str, bool
+        """
+        if type(mus) is tuple:
+            if len(mus) != 2:
+                raise ValueError("Box of mus must be (mu_lb, mu_ub).")
+            mu_lb, mu_ub = np.array(mus[0]), np.array(mus[1])
+            rng = np.random.RandomState(random_seed)
+            mus = rng.uniform(mu_lb, mu_ub, (num_mus, self.m))
+        elif type(mus) is not np.ndarray:
+            raise TypeError(format_type_err_msg(self, "mus", mus, np.ndarray))
+        mus = mus.astype(np.float32)
+        if len(mus.shape) != 2 or mus.shape[1] != self.m:
+            raise ValueError("mus must have shape (num targets, %d)." % self.m)
+        n_mu = mus.shape[0]
+        mu_batch = min(mu_batch, n_mu)
+        if num_units is None:
+            num_units = max(2 * self.D, 15)
+
+        tf.random.set_seed(random_seed)
+        cnf = ConditionedNormFlow(
+            self.D,
+            num_layers,
+            num_units,
+            bounds=self._get_bounds(),
+            support_mapping=self._support_mapping(),
+            num_stages=num_stages,
+            random_seed=random_seed,
+        )
+        # Build the variables of the coupling networks.
+        cnf.condition(x_data=tf.constant(mus[:1]))(1)
+        params = cnf.trainable_variables
+        optimizer = tf.keras.optimizers.Adam(lr)
+
+        def _train_step(mus_b, eta_b, c_b):
+            with tf.GradientTape() as tape:
+                losses, Hs, Rs = [], [], []
+                for b in range(mu_batch):
+                    z, log_q_z = cnf.condition(x_data=mus_b[b : b + 1])(N)
+                    H, R, R1s, R2 = aug_lag_vars(z, log_q_z, self.eps, mus_b[b], N)
+                    losses.append(aug_lag_surrogate(H, R, R1s, R2, eta_b[b], c_b[b]))
+                    Hs.append(H)
+                    Rs.append(R)
+                loss = tf.add_n(losses) / mu_batch
+            gradients = tape.gradient(loss, params)
+            optimizer.apply_gradients(zip(gradients, params))
+            H, R = tf.stack(Hs), tf.stack(Rs)
+            cost = -H + tf.reduce_sum(eta_b * R, axis=1)
+            cost += c_b / 2.0 * tf.reduce_sum(tf.square(R), axis=1)
+            return cost, H, R
+
+        N_test = int(nu * N)
+        chunk_M = max(1, eval_chunk_size // N)
+
+        def _get_R_stats(mu, M):
+            flow = cnf.condition(x_data=mu[tf.newaxis, :])
+
+            def _two_dim_T_x_batch(M):
+                z, _ = flow(M * N)
+                return tf.reshape(self.eps(z), (M, N, self.m))
+
+            return chunked_R_stats(_two_dim_T_x_batch, M, chunk_M, N_test, mu)
+
+        mus_spec = tf.TensorSpec(shape=(mu_batch, self.m), dtype=tf.float32)
+        c_spec = tf.TensorSpec(shape=(mu_batch,), dtype=tf.float32)
+        mu_spec = tf.TensorSpec(shape=(self.m,), dtype=tf.float32)
+        int_spec = tf.TensorSpec(shape=(), dtype=tf.int32)
+        train_step = tf_compile(
+            _train_step, jit_compile, [mus_spec, mus_spec, c_spec]
+        )
+        get_R_stats = tf_compile(_get_R_stats, jit_compile, [mu_spec, int_spec])
+
+        aug_lag_hps = AugLagHPs(N, lr, c0, gamma, beta)
+        ckpt_dir = self.get_epi_path(mus[0]) + "amortized/%s_%s/" % (
+            cnf.to_string(),
+            aug_lag_hps.to_string(),
+        )
+        ckpt = tf.train.Checkpoint(optimizer=optimizer, model=cnf)
+        manager = tf.train.CheckpointManager(ckpt, directory=ckpt_dir, max_to_keep=None)
+        manager.save(checkpoint_number=0)
+        print("Saving amortized EPI models to %s." % ckpt_dir, flush=True)
+
+        M_eval = 200
+        eta = np.zeros((n_mu, self.m), np.float32)
+        c = c0 * np.ones((n_mu,), np.float32)
+        etas, cs = np.zeros((K, n_mu, self.m)), np.zeros((K, n_mu))
+        norms = np.array([get_R_stats(mu, M_eval)[1].numpy() for mu in mus])
+        R_keys = ["R%d" % (i + 1) for i in range(self.m)]
+        opt_log = self._opt_log(R_keys, K * (num_iters // log_rate))
+        converged_k = np.zeros((K, n_mu), bool)
+        failed = False
+        np.random.seed(random_seed)
+        for k in range(1, K + 1):
+            etas[k - 1], cs[k - 1] = eta, c
+            for i in range(1, num_iters + 1):
+                time1 = time.time()
+                inds = np.random.choice(n_mu, mu_batch, replace=False)
+                cost, H, R = train_step(mus[inds], eta[inds], c[inds])
+                time2 = time.time()
+                if np.isnan(cost.numpy()).any():
+                    failed = True
+                    break
+                if i % log_rate == 0:
+                    H, R = np.mean(H.numpy()), np.mean(R.numpy(), axis=0)
+                    if verbose:
+                        print(format_opt_msg(k, i, np.mean(cost), H, R), flush=True)
+                    self._log_opt_it(
+                        opt_log,
+                        R_keys,
+                        k,
+                        (k - 1) * num_iters + i,
+                        H,
+                        R,
+                        0,
+                        time2 - time1,
+                    )
+            manager.save(checkpoint_number=k)
+            if failed:
+                print("Amortized EPI k=%d: cost is nan." % k, flush=True)
+                break
+
+            # Test convergence and update eta and c of each target.
+            converged = converged_k[k - 1]
+            for j in range(n_mu):
+                R_means, norms_j = get_R_stats(mus[j], M_eval)
+                R_means, norms_j = R_means.numpy(), norms_j.numpy()
+                converged[j] = self.test_convergence(R_means, alpha)
+                if k < K:
+                    eta[j] = eta[j] + c[j] * np.mean(R_means, axis=0)
+                    t, p = ttest_ind(norms_j, gamma * norms[j], equal_var=False)
+                    u = np.random.rand(1)
+                    if u < 1 - p / 2.0 and t > 0.0:
+                        c[j] = beta * c[j]
+                    norms[j] = norms_j
+            print(
+                "Amortized EPI k=%d: %d/%d targets converged."
+                % (k, np.sum(converged), n_mu),
+                flush=True,
+            )
+            last_ind = opt_log.column("iteration") == k * num_iters
+            opt_log.column("converged")[last_ind] = converged.all()
+            self._save_epi_opt(ckpt_dir, opt_log.to_df(), etas, cs)
+            np.save(ckpt_dir + "mus.npy", mus)
+            np.save(ckpt_dir + "converged.npy", converged_k[:k])
+            if stop_early and converged.all():
+                break
+
+        q_theta = AmortizedDistribution(cnf, self.parameters)
+        return q_theta, opt_log.to_df(), ckpt_dir, failed
+
+    def epi_population(
+        self,
+        mu,
+        random_seeds,
+        lrs=None,
+        c0s=None,
+        arch_type="coupling",
+        num_stages=3,
+        num_layers=2,
+        num_units=None,
+        batch_norm=True,
+        bn_momentum=0.99,
+        post_affine=False,
+        init_type=None,
+        init_params=None,
+        K=10,
+        num_iters=1000,
+        N=500,
+        gamma=0.25,
+        beta=4.0,
+        alpha=0.05,
+        nu=1.0,
+        stop_early=False,
+        log_rate=50,
+        verbose=False,
+        jit_compile=False,
+        eval_chunk_size=10000,
+    ):
+        """Runs emergent property inference for a population of flows at once.
+
+        The population has one flow of the same architecture per random seed,
+        and each member may have its own learning rate and initial
+        augmented Lagrangian coefficient :math:`c_0`.  All members are
+        trained in one compiled graph.  The members are coupling flows, whose
+        conditioner networks are evaluated together as batched matrix
+        multiplications of their stacked weights (see
+        :obj:`epi.normalizing_flows.population_call`).  The emergent property
+        statistics are evaluated once on the :math:`B \\times N` samples of the
+        population, and the gradients of all members are computed in one
+        backward pass of their summed :obj:`epi.util.aug_lag_surrogate`.  Each
+        member keeps its own :math:`\\eta` and :math:`c` updates, convergence
+        test and checkpoints.  Members whose cost is nan are failed, and take
+        no further optimization steps.
+
+        The remaining arguments are those of :obj:`epi.models.Model.epi`.
+
+        :param mu: Mean parameter of the emergent property.
+        :type mu: np.ndarray
+        :param random_seeds: Random seed of architecture parameters of each member.
+        :type random_seeds: list
+        :param lrs: Adam learning rate of each member, defaults to 1e-3.
+        :type lrs: list, optional
+        :param c0s: Initial augmented Lagrangian coefficient of each member, defaults to 1.0.
+        :type c0s: list, optional
+        :returns: q_thetas, opt_df, save_paths, failed.  Column :obj:`member` of opt_df indexes the population.
+        :rtype: list, pandas.DataFrame, list, list
+        """
+        if type(random_seeds) is not list:
+            raise TypeError(
+                format_type_err_msg(self, "random_seeds", random_seeds, list)
+            )
+        B = len(random_seeds)
+        if B < 1:
+            raise ValueError("Population must have at least one member.")
+        if lrs is None:
+            lrs = B * [1e-3]
+        if c0s is None:
+            c0s = B * [1.0]
+        if len(lrs) != B or len(c0s) != B:
+            raise ValueError("lrs and c0s must have one entry per random seed.")
+        if arch_type != "coupling":
+            raise ValueError("EPI populations must have coupling architectures.")
+
+        nfs = [
+            self._epi_nf(
+                arch_type=arch_type,
+                num_stages=num_stages,
+                num_layers=num_layers,
+                num_units=num_units,
+                batch_norm=batch_norm,
+                bn_momentum=bn_momentum,
+                post_affine=post_affine,
+                random_seed=random_seed,
+            )
+            for random_seed in random_seeds
+        ]
+        optimizers = [tf.keras.optimizers.Adam(lr) for lr in lrs]
+        graphs = self._epi_population_graphs(
+            nfs, optimizers, N, nu, jit_compile, eval_chunk_size
+        )
+        graphs["mu"].assign(mu)
+        train_step = graphs["train_step"]
+        get_R_stats = graphs["get_R_stats"]
+        trace_counts = graphs["trace_counts"]
 
-        return q_theta, opt_it_dfs[0], ckpt_dir, failed
+        # Initialize and checkpoint each member.
+        R_keys = ["R%d" % (i + 1) for i in range(self.m)]
+        managers, save_paths, opt_logs, hps = [], [], [], []
+        for b, (nf, optimizer) in enumerate(zip(nfs, optimizers)):
+            aug_lag_hps = AugLagHPs(N, lrs[b], c0s[b], gamma, beta)
+            if init_type is None or init_params is None:
+                init_type_b, init_params_b = self._default_init(nf)
+            else:
+                init_type_b, init_params_b = init_type, init_params
+            print("Initializing %s architecture." % nf.to_string(), flush=True)
+            nf.initialize(init_type_b, init_params_b, jit_compile=jit_compile)
+            ckpt = tf.train.Checkpoint(optimizer=optimizer, model=nf)
+            save_path = self.get_save_path(mu, nf, aug_lag_hps)
+            save_path += "%s/" % aug_lag_hps.to_string()
+            if save_path in save_paths:
+                raise ValueError("Members %d save to the same path." % b)
+            manager = tf.train.CheckpointManager(
+                ckpt, directory=save_path, max_to_keep=None
+            )
+            manager.save(checkpoint_number=0)
+            managers.append(manager)
+            save_paths.append(save_path)
+            hps.append((aug_lag_hps, init_type_b, init_params_b))
+            opt_logs.append(self._opt_log(R_keys, 1 + K * (num_iters // log_rate)))
+            z, log_q_z = nf(N)
+            H_0, R_0, _, _ = aug_lag_vars(z, log_q_z, self.eps, mu, N)
+            self._log_opt_it(
+                opt_logs[b], R_keys, 0, 0, H_0.numpy(), R_0.numpy(), 0, np.nan
+            )
+        print("Saving EPI population to %s." % self.get_epi_path(mu), flush=True)
+
+        M_eval = 200
+
+        # Initialize augmented Lagrangian parameters of each member.
+        eta, c = np.zeros((B, self.m), np.float32), np.array(c0s, np.float32)
+        etas, cs = np.zeros((K, B, self.m)), np.zeros((K, B))
+        _, norms = get_R_stats(M_eval)
+        norms = norms.numpy().T
+        failed = np.zeros((B,), bool)
+        for k in range(1, K + 1):
+            etas[k - 1], cs[k - 1] = eta, c
+            for i in range(1, num_iters + 1):
+                time1 = time.time()
+                cost, H, R = train_step(eta, c, ~failed)
+                time2 = time.time()
+                if i % log_rate == 0:
+                    iter = (k - 1) * num_iters + i
+                    num_traces = sum(trace_counts.values())
+                    for b in range(B):
+                        if verbose:
+                            print(
+                                "member %d " % b
+                                + format_opt_msg(k, i, cost[b], H[b], R[b]),
+                                flush=True,
+                            )
+                        self._log_opt_it(
+                            opt_logs[b],
+                            R_keys,
+                            k,
+                            iter,
+                            H[b].numpy(),
+                            R[b].numpy(),
+                            num_traces,
+                            time2 - time1,
+                        )
+                failed = np.logical_or(failed, np.isnan(cost.numpy()))
+                if failed.all():
+                    break
+
+            R_means, norms_k = get_R_stats(M_eval)
+            R_means = np.transpose(R_means.numpy(), [1, 0, 2])
+            norms_k = norms_k.numpy().T
+            converged = np.zeros((B,), bool)
+            for b in range(B):
+                managers[b].save(checkpoint_number=k)
+                if not failed[b]:
+                    converged[b] = self.test_convergence(R_means[b], alpha)
+                last_ind = opt_logs[b].column("iteration") == k * num_iters
+                opt_logs[b].column("converged")[last_ind] = converged[b]
+                self._save_epi_opt(
+                    save_paths[b], opt_logs[b].to_df(), etas[:, b], cs[:, b]
+                )
+            print(
+                "EPI population epoch %d: %d converged, %d failed."
+                % (k, np.sum(converged), np.sum(failed)),
+                flush=True,
+            )
+
+            if k < K:
+                if failed.all() or (stop_early and converged[~failed].all()):
+                    break
+
+                # Update eta and c of each member.
+                eta = eta + c[:, np.newaxis] * R.numpy()
+                for b in range(B):
+                    t, p = ttest_ind(norms_k[b], gamma * norms[b], equal_var=False)
+                    u = np.random.rand(1)
+                    if u < 1 - p / 2.0 and t > 0.0:
+                        c[b] = beta * c[b]
+                norms = norms_k
+
+        q_thetas, opt_dfs = [], []
+        for b, nf in enumerate(nfs):
+            aug_lag_hps, init_type_b, init_params_b = hps[b]
+            self._save_hps(save_paths[b], nf, aug_lag_hps, init_type_b, init_params_b)
+            q_thetas.append(Distribution(nf, self.parameters))
+            opt_df = opt_logs[b].to_df()
+            opt_df["member"] = b
+            opt_dfs.append(opt_df)
+        opt_df = pd.concat(opt_dfs, ignore_index=True)
+        return q_thetas, opt_df, save_paths, list(failed)
+
+    def _epi_population_graphs(
+        self, nfs, optimizers, N, nu, jit_compile, eval_chunk_size
+    ):
+        """Compiles the training and evaluation graphs of :obj:`Model.epi_population`.
+
+        :returns: Dictionary of the mu variable, compiled functions and their trace counts.  The training step takes eta, c and which members are active, and is compiled once per set of active members.
+        :rtype: dict
+        """
+        B, D = len(nfs), self.D
+        mu = tf.Variable(tf.zeros((self.m,)), trainable=False, name="mu")
+
+        def _population_batch(M):
+            z, log_q_z = population_call(nfs, M)
+            T_x = self.eps(tf.reshape(z, (B * M, D)))
+            return z, log_q_z, tf.reshape(T_x, (B, M, self.m))
+
+        def _make_train_step(active):
+            # Only active members take optimization steps.
+            active_inds = [b for b in range(B) if active[b]]
+
+            def _train_step(eta, c):
+                with tf.GradientTape() as tape:
+                    z, log_q_z, T_x = _population_batch(N)
+                    params = [nfs[b].trainable_variables for b in active_inds]
+                    tape.watch(params)
+                    losses, Hs, Rs = [], [], []
+                    for b in range(B):
+                        H, R, R1s, R2 = aug_lag_vars(
+                            z[b], log_q_z[b], self.eps, mu, N, T_x=T_x[b]
+                        )
+                        if active[b]:
+                            losses.append(
+                                aug_lag_surrogate(H, R, R1s, R2, eta[b], c[b])
+                            )
+                        Hs.append(H)
+                        Rs.append(R)
+                    loss = tf.add_n(losses)
+                gradients = tape.gradient(loss, params)
+                for j, b in enumerate(active_inds):
+                    optimizers[b].apply_gradients(zip(gradients[j], params[j]))
+                H, R = tf.stack(Hs), tf.stack(Rs)
+                cost = -H + tf.reduce_sum(eta * R, axis=1)
+                cost += c / 2.0 * tf.reduce_sum(tf.square(R), axis=1)
+                return cost, H, R
+
+            return _train_step
+
+        N_test = int(nu * N)
+        chunk_M = max(1, eval_chunk_size // (B * N))
+
+        def _two_dim_T_x_batch(M):
+            _, _, T_x = _population_batch(M * N)
+            T_x = tf.reshape(T_x, (B, M, N, self.m))
+            return tf.transpose(T_x, [1, 0, 2, 3])
+
+        def _get_R_stats(M):
+            return chunked_R_stats(_two_dim_T_x_batch, M, chunk_M, N_test, mu)
+
+        eta_spec = tf.TensorSpec(shape=(B, self.m), dtype=tf.float32)
+        c_spec = tf.TensorSpec(shape=(B,), dtype=tf.float32)
+        int_spec = tf.TensorSpec(shape=(), dtype=tf.int32)
+        trace_counts = {}
+        # Training graphs of each set of active members.
+        train_steps = {}
+
+        def train_step(eta, c, active):
+            active = tuple([bool(a) for a in active])
+            if active not in train_steps:
+                train_steps[active] = tf_compile(
+                    _make_train_step(active),
+                    jit_compile,
+                    [eta_spec, c_spec],
+                    trace_counts,
+                )
+            return train_steps[active](eta, c)
+
+        return {
+            "mu": mu,
+            "train_step": train_step,
+            "get_R_stats": tf_compile(
+                _get_R_stats, jit_compile, [int_spec], trace_counts
+            ),
+            "trace_counts": trace_counts,
+        }
+
+    def _default_init(self, nf):
+        """Gaussian initialization of nf centered within its bounds."""
+        mu_init = np.zeros((self.D))
+        Sigma = np.zeros((self.D, self.D))
+        for i in range(self.D):
+            if np.isneginf(nf.lb[i]) and np.isposinf(nf.ub[i]):
+                mu_init[i] = 0.0
+                Sigma[i, i] = 1.0
+            elif np.isneginf(nf.lb[i]):
+                mu_init[i] = nf.ub[i] - 2.0
+                Sigma[i, i] = 1.0
+            elif np.isposinf(nf.ub[i]):
+                mu_init[i] = nf.lb[i] + 2.0
+                Sigma[i, i] = 1.0
+            else:
+                mu_init[i] = (nf.lb[i] + nf.ub[i]) / 2.0
+                Sigma[i, i] = (nf.ub[i] - nf.lb[i]) / 2.0
+        return "gaussian", {"mu": mu_init, "Sigma": Sigma}
+
+    def _epi_save_path(self, mu, epi_kwargs):
+        """Default save path and hyperparameters of Model.epi with epi_kwargs."""
+        nf_arg_names = inspect.getfullargspec(self._epi_nf).args[1:]
+        epi_defaults = {
+            key: param.default
+            for key, param in inspect.signature(self.epi).parameters.items()
+        }
+        nf = self._epi_nf(
+            **{key: epi_kwargs[key] for key in nf_arg_names if key in epi_kwargs}
+        )
+        aug_lag_hps = AugLagHPs(
+            *[
+                epi_kwargs.get(key, epi_defaults[key])
+                for key in ["N", "lr", "c0", "gamma", "beta"]
+            ]
+        )
+        return self.get_save_path(mu, nf, aug_lag_hps), aug_lag_hps
+
+    def _epi_nf(
+        self,
+        arch_type="coupling",
+        num_stages=3,
+        num_layers=2,
+        num_units=None,
+        batch_norm=True,
+        bn_momentum=0.99,
+        post_affine=False,
+        random_seed=1,
+        base_sampling="iid",
+        num_bins=8,
+        matrix_shape=None,
+    ):
+        matrix_shape = self._matrix_shape(arch_type, matrix_shape)
+        if num_units is None:
+            if arch_type == "kronecker_coupling":
+                num_units = max(2 * matrix_shape[1], 15)
+            else:
+                num_units = max(2 * self.D, 15)
+
+        return NormalizingFlow(
+            arch_type=arch_type,
+            D=self.D,
+            num_stages=num_stages,
+            num_layers=num_layers,
+            num_units=num_units,
+            batch_norm=batch_norm,
+            bn_momentum=bn_momentum,
+            post_affine=post_affine,
+            bounds=self._get_bounds(),
+            random_seed=random_seed,
+            base_sampling=base_sampling,
+            num_bins=num_bins,
+            support_mapping=self._support_mapping(),
+            matrix_shape=matrix_shape,
+        )
+
+    def _epi_graphs(
+        self,
+        nf,
+        optimizer,
+        N,
+        nu,
+        single_pass_grad,
+        jit_compile,
+        eval_chunk_size,
+        remat=None,
+        stl=False,
+        aug_estimator="split",
+        grad_var_samples=None,
+    ):
+        """Compiles the training and evaluation graphs of :obj:`Model.epi`.
+
+        The emergent property value :math:`\\mu` is held in a variable, so the
+        graphs may be reused for any :math:`\\mu` via :obj:`graphs['mu'].assign`.
+
+        :returns: Dictionary of the flow, optimizer, mu variable, compiled functions and their trace counts.
+        :rtype: dict
+        """
+        # The graphs are cached per model, so they must not reference it.
+        m, eps_fn = self.m, self.eps
+        mu = tf.Variable(tf.zeros((m,)), trainable=False, name="mu")
+        if remat is None:
+            eps = eps_fn
+        else:
+            eps = tf.recompute_grad(eps_fn)
+        symmetric = aug_estimator == "symmetric"
+
+        def _samples(N):
+            z, log_q_z = nf(N)
+            if stl:
+                log_q_z = nf.stl_log_prob(z, log_q_z)
+            return z, log_q_z
+
+        def single_pass_train_step(eta, c):
+            with tf.GradientTape() as tape:
+                z, log_q_z = _samples(N)
+                params = nf.trainable_variables
+                tape.watch(params)
+                H, R, R1s, R2 = aug_lag_vars(z, log_q_z, eps, mu, N)
+                loss = aug_lag_surrogate(H, R, R1s, R2, eta, c, symmetric)
+            cost = -H + tf.reduce_sum(tf.multiply(eta, R))
+            cost += c / 2.0 * tf.reduce_sum(tf.square(R))
+            gradients = tape.gradient(loss, params)
+            optimizer.apply_gradients(zip(gradients, params))
+            return cost, H, R, z, log_q_z
+
+        def multi_pass_train_step(eta, c):
+            with tf.GradientTape(persistent=True) as tape:
+                z, log_q_z = _samples(N)
+                params = nf.trainable_variables
+                tape.watch(params)
+                H, R, R1s, R2 = aug_lag_vars(z, log_q_z, eps, mu, N)
+                neg_H = -H
+                lagrange_dot = tf.reduce_sum(tf.multiply(eta, R))
+            aug_l2 = c / 2.0 * tf.reduce_sum(tf.square(R))
+            cost = neg_H + lagrange_dot + aug_l2
+            H_grad = tape.gradient(neg_H, params)
+            lagrange_grad = tape.gradient(lagrange_dot, params)
+            aug_grad = unbiased_aug_grad(R1s, R2, params, tape)
+            gradients = [
+                g1 + g2 + c * g3 for g1, g2, g3 in zip(H_grad, lagrange_grad, aug_grad)
+            ]
+            optimizer.apply_gradients(zip(gradients, params))
+            return cost, H, R, z, log_q_z
+
+        if single_pass_grad:
+            _train_step = single_pass_train_step
+        else:
+            _train_step = multi_pass_train_step
+
+        def _grad_var(eta, c):
+            # Total variance of independent single batch gradient estimates.
+            gradients = []
+            for j in range(grad_var_samples):
+                with tf.GradientTape() as tape:
+                    z, log_q_z = _samples(N)
+                    params = nf.trainable_variables
+                    tape.watch(params)
+                    H, R, R1s, R2 = aug_lag_vars(z, log_q_z, eps, mu, N)
+                    loss = aug_lag_surrogate(H, R, R1s, R2, eta, c, symmetric)
+                gradient = tape.gradient(loss, params)
+                gradients.append(tf.concat([tf.reshape(g, [-1]) for g in gradient], 0))
+            return tf.reduce_sum(tf.math.reduce_variance(tf.stack(gradients), axis=0))
+
+        def _grad_snr(eta, c):
+            # Each half's surrogate is an unbiased gradient estimate, with the
+            # augmented term paired with the other half.
+            with tf.GradientTape(persistent=True) as tape:
+                z, log_q_z = _samples(N)
+                params = nf.trainable_variables
+                tape.watch(params)
+                T_x = eps(z)
+                halves = [slice(None, N // 2), slice(N // 2, None)]
+                H1, R1, _, _ = aug_lag_vars(
+                    z[halves[0]], log_q_z[halves[0]], eps, mu, N // 2, T_x[halves[0]]
+                )
+                H2, R2, _, _ = aug_lag_vars(
+                    z[halves[1]], log_q_z[halves[1]], eps, mu, N // 2, T_x[halves[1]]
+                )
+                loss1 = aug_lag_surrogate(H1, R1, tf.unstack(R1), R2, eta, c)
+                loss2 = aug_lag_surrogate(H2, R2, tf.unstack(R2), R1, eta, c)
+            gradients1 = tape.gradient(loss1, params)
+            gradients2 = tape.gradient(loss2, params)
+            del tape
+            return grad_snr(gradients1, gradients2)
+
+        def _device_train_loop(eta, c, num_steps):
+            cost, H, R, z, log_q_z = _train_step(eta, c)
+            i = tf.constant(1)
+            is_nan = tf.math.is_nan(cost)
+            while tf.logical_and(i < num_steps, tf.logical_not(is_nan)):
+                cost, H, R, z, log_q_z = _train_step(eta, c)
+                i += 1
+                is_nan = tf.math.is_nan(cost)
+            return cost, H, R, z, log_q_z, i, is_nan
+
+        N_test = int(nu * N)
+        chunk_M = max(1, eval_chunk_size // N)
+
+        def _two_dim_T_x_batch(M):
+            # Each batch is an independent set of base samples.
+            z, _ = nf(M * N, num_sets=M)
+            T_x = eps_fn(z)
+            T_x = tf.reshape(T_x, (M, N, m))
+            return T_x
+
+        def _get_R_stats(M):
+            return chunked_R_stats(_two_dim_T_x_batch, M, chunk_M, N_test, mu)
+
+        # Fixed input signatures, so that changing eta, c or M never retraces.
+        # Nested calls use the python functions, so that each compiled
+        # function falls back from XLA as a whole.
+        eta_spec = tf.TensorSpec(shape=(m,), dtype=tf.float32)
+        c_spec = tf.TensorSpec(shape=(), dtype=tf.float32)
+        int_spec = tf.TensorSpec(shape=(), dtype=tf.int32)
+        trace_counts = {}
+        return {
+            "nf": nf,
+            "optimizer": optimizer,
+            "mu": mu,
+            "train_step": tf_compile(
+                _train_step, jit_compile, [eta_spec, c_spec], trace_counts
+            ),
+            "device_train_loop": tf_compile(
+                _device_train_loop,
+                jit_compile,
+                [eta_spec, c_spec, int_spec],
+                trace_counts,
+            ),
+            "get_R_stats": tf_compile(
+                _get_R_stats, jit_compile, [int_spec], trace_counts
+            ),
+            "grad_var": tf_compile(
+                _grad_var, jit_compile, [eta_spec, c_spec], trace_counts
+            ),
+            "grad_snr": tf_compile(
+                _grad_snr, jit_compile, [eta_spec, c_spec], trace_counts
+            ),
+            "trace_counts": trace_counts,
+        }
 
     def plot_epi_hpsearch(self, mu, alpha=0.05, nu=0.1):
         epi_dir = self.get_epi_path(mu)
@@ -578,6 +2038,9 @@ class Model(object):
             "bn_momentum": nf.bn_momentum,
             "post_affine": nf.post_affine,
             "random_seed": nf.random_seed,
+            "base_sampling": nf.base_sampling,
+            "num_bins": nf.num_bins,
+            "matrix_shape": nf.matrix_shape,
             "init_type": init_type,
             "init_params": init_params,
             "aug_lag_hps": aug_lag_hps,
@@ -975,15 +2438,73 @@ class Model(object):
         p_vals = 2 * np.minimum(gt / M, lt / M)
         return np.prod(p_vals > (alpha / m))
 
-    def _opt_it_df(self, k, iter, H, R, R_keys):
-        d = {"k": k, "iteration": iter, "H": H, "converged": None}
+    def _opt_log(self, R_keys, capacity):
+        columns = ["k", "iteration", "H", "converged"] + R_keys
+        columns += ["num_traces", "time_per_it", "grad_var", "N", "grad_snr"]
+        return OptLog(
+            columns,
+            capacity,
+            int_columns=["k", "iteration", "num_traces"],
+            bool_columns=["converged"],
+        )
+
+    def _log_opt_it(
+        self,
+        opt_log,
+        R_keys,
+        k,
+        iter,
+        H,
+        R,
+        num_traces,
+        time_per_it,
+        grad_var=np.nan,
+        N=np.nan,
+        grad_snr=np.nan,
+    ):
+        d = {"k": k, "iteration": iter, "H": H}
         d.update(zip(R_keys, list(R)))
-        return pd.DataFrame(d, index=[0])
+        d["num_traces"] = num_traces
+        d["time_per_it"] = time_per_it
+        d["grad_var"] = grad_var
+        d["N"] = N
+        d["grad_snr"] = grad_snr
+        opt_log.append(**d)
 
     def _save_epi_opt(self, save_path, opt_df, etas, cs):
         np.savez(save_path + "opt_data.npz", etas=etas, cs=cs)
         opt_df.to_csv(save_path + "opt_data.csv")
 
+    def _save_epi_state(
+        self, save_path, k, eta, c, norms, etas, cs, N, mu, arch_string, hp_string
+    ):
+        """Save the state of :obj:`Model.epi` for resuming at iteration k+1.
+
+        The emergent property, architecture and augmented Lagrangian
+        hyperparameters are saved to check that a resumed run matches.
+        """
+        rng_state = np.random.get_state()
+        # Write then rename, so that an interrupted save keeps the last state.
+        tmp_file = save_path + "resume_state.tmp.npz"
+        np.savez(
+            tmp_file,
+            k=k,
+            eta=eta,
+            c=c,
+            norms=norms,
+            etas=etas,
+            cs=cs,
+            N=N,
+            mu=mu,
+            arch_string=arch_string,
+            hp_string=hp_string,
+            rng_keys=rng_state[1],
+            rng_pos=rng_state[2],
+            rng_has_gauss=rng_state[3],
+            rng_cached_gaussian=rng_state[4],
+        )
+        os.replace(tmp_file, save_path + "resume_state.npz")
+
     def get_save_path(self, mu, arch, AL_hps, eps_name=None):
         epi_path = self.get_epi_path(mu, eps_name=eps_name)
         arch_string = arch.to_string()
@@ -1031,6 +2552,8 @@ class Model(object):
         c0=1.0,
         gamma=0.25,
         beta=4.0,
+        num_bins=8,
+        matrix_shape=None,
     ):
 
         if k is not None:
@@ -1039,8 +2562,12 @@ class Model(object):
             if k < 0:
                 raise ValueError("k must be augmented Lagrangian iteration index.")
 
+        matrix_shape = self._matrix_shape(arch_type, matrix_shape)
         if num_units is None:
-            num_units = max(2 * self.D, 15)
+            if arch_type == "kronecker_coupling":
+                num_units = max(2 * matrix_shape[1], 15)
+            else:
+                num_units = max(2 * self.D, 15)
 
         nf = NormalizingFlow(
             arch_type=arch_type,
@@ -1053,6 +2580,9 @@ class Model(object):
             post_affine=post_affine,
             bounds=self._get_bounds(),
             random_seed=random_seed,
+            num_bins=num_bins,
+            support_mapping=self._support_mapping(),
+            matrix_shape=matrix_shape,
         )
 
         aug_lag_hps = AugLagHPs(N, lr, c0, gamma, beta)
@@ -1150,7 +2680,7 @@ class Distribution(object):
             raise TypeError(format_type_err_msg(self, "parameters", parameters, list))
         else:
             for parameter in parameters:
-                if not parameter.__class__.__name__ == "Parameter":
+                if not isinstance(parameter, Parameter):
                     raise TypeError(
                         format_type_err_msg(self, "parameter", parameter, Parameter)
                     )
@@ -1262,6 +2792,52 @@ class Distribution(object):
         return g
 
 
+class AmortizedDistribution(object):
+    """Distributions of an amortized EPI flow conditioned on :math:`\\mu`.
+
+    :param cnf: Conditioned normalizing flow trained by :obj:`epi.models.Model.epi_amortized`.
+    :type cnf: :obj:`epi.normalizing_flows.ConditionedNormFlow`
+    :param parameters: List of :obj:`epi.models.Parameter`. Defaults to z1, ..
+    :type parameters: list, optional
+    """
+
+    def __init__(self, cnf, parameters=None):
+        self.cnf = cnf
+        self.D = cnf.D
+        self.parameters = parameters
+
+    def __call__(self, mu):
+        return self.condition(mu)
+
+    def condition(self, mu):
+        """Distribution of the emergent property with mean parameter mu.
+
+        :param mu: Mean parameter of the emergent property.
+        :type mu: np.ndarray
+        :returns: Distribution conditioned on mu.
+        :rtype: :obj:`epi.models.Distribution`
+        """
+        mu = np.array(mu, np.float32).reshape((1, -1))
+        return Distribution(self.cnf.condition(x_data=mu), self.parameters)
+
+
+def _epi_sweep_init(core_sets):
+    """Pins an epi_sweep worker to its cores before tensorflow starts."""
+    cores = core_sets.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(min(2, len(cores)))
+
+
+def _epi_sweep_worker(args):
+    name, parameters, eps, mu, config = args
+    M = Model(name, parameters)
+    M.set_eps(eps)
+    _, opt_df, save_path, failed = M.epi(mu, **config)
+    return opt_df, save_path, failed
+
+
 def format_opt_msg(k, i, cost, H, R):
     s1 = "" if cost < 0.0 else " "
     s2 = "" if H < 0.0 else " "
@@ -7,10 +7,8 @@ import seaborn as sns
 import os
 import tensorflow as tf
 import tensorflow_probability as tfp
-from tensorflow_probability.python.internal import tensorshape_util
 tfb = tfp.bijectors
 tfd = tfp.distributions
-import tensorflow.compat.v1 as tf1
 import pandas as pd
 
 from epi.error_formatters import format_type_err_msg
@@ -18,7 +16,10 @@ from epi.util import (
     gaussian_backward_mapping,
     np_column_vec,
     init_path,
+    file_lock,
+    update_init_cache,
     array_str,
+    tf_compile,
 )
 
 DTYPE = tf.float32
@@ -35,6 +36,23 @@ class NormalizingFlow(tf.keras.Model):
     conditioned on the first half (see :obj:`tfp.bijectors.RealNVP`)). Similarly, 
     autoregressive transforms are masked autoregressive flow (MAF) bijectors. One stage
     is one full autoregressive factorization (see :obj:`tfp.bijectors.MAF`).
+    Inverse autoregressive flow (IAF) stages are inverted MAF bijectors, whose
+    shift and scale are conditioned on the stage input rather than its output.
+    Sampling a MAF stage takes D sequential network passes, while sampling an
+    IAF stage and evaluating the density of its own samples takes one.
+    Spline stages are couplings whose second half of elements are transformed
+    by monotonic rational quadratic splines on :math:`[-B, B]` with num_bins
+    bins (see :obj:`epi.normalizing_flows.SplineConditioner`), and are more
+    expressive per stage than affine couplings.
+
+    For a matrix parameter of matrix_shape :math:`R \\times C`, Kronecker
+    coupling stages transform the last :math:`R - \\lfloor R/2 \\rfloor` rows
+    conditioned on the first rows (in row major order of the D elements).  Each
+    layer of the conditioner maps a batch of matrices :math:`X` to
+    :math:`\\sigma(AXB + c)` (see :obj:`epi.normalizing_flows.KroneckerConditioner`),
+    so its cost grows with :math:`R^2C + RC^2` rather than :math:`D^2`.  Rows and
+    columns rather than elements are permuted between stages, which keeps the
+    matrix structure.
 
     After each stage, which is succeeded by another coupling or autoregressive 
     transform, the dimensions are permuted via a :obj:`tfp.bijectors.Permute` bijector 
@@ -65,8 +83,14 @@ class NormalizingFlow(tf.keras.Model):
     :math:`q_0` -> MAF -> permute -> batch norm -> MAF -> post affine -> interval flow
 
     The base distribution :math:`q_0` is chosen to be a standard isotoropic gaussian.
-
-    :param arch_type: :math:`\\in` `['autoregressive', 'coupling']`
+    Its samples are i.i.d., or randomized quasi-Monte Carlo points (Halton
+    points randomized by a Cranley-Patterson rotation, i.e. a uniform random
+    shift modulo 1, through the inverse normal CDF), or antithetic pairs
+    :math:`(x, -x)`.  Non-i.i.d. samples of
+    a batch are drawn in two independent sets, one per half of the batch,
+    so that the halves of :obj:`epi.util.aug_lag_vars` remain independent.
+
+    :param arch_type: :math:`\\in` `['autoregressive', 'inverse_autoregressive', 'coupling', 'spline', 'kronecker_coupling']`
     :type arch_type: str
     :param D: Dimensionality of the normalizing flow.
     :type D: int
@@ -86,6 +110,14 @@ class NormalizingFlow(tf.keras.Model):
     :type bounds: (np.ndarray, np.ndarray), optional
     :param random_seed: Random seed of architecture parameters, defaults to 1.
     :type random_seed: int, optional
+    :param base_sampling: :math:`\\in` :obj:`['iid', 'halton', 'antithetic']`, defaults to :obj:`'iid'`.
+    :type base_sampling: str, optional
+    :param num_bins: Number of bins of spline stages, defaults to 8.
+    :type num_bins: int, optional
+    :param support_mapping: Bijector to the support of the distribution in place of the interval flow of bounds, e.g. an :obj:`epi.normalizing_flows.BlockSupportFlow` of structured parameters, defaults to None.
+    :type support_mapping: tfp.bijectors.Bijector, optional
+    :param matrix_shape: Rows and columns (R, C) of Kronecker coupling stages with :math:`RC = D` and :math:`R \\geq 2`, defaults to None.
+    :type matrix_shape: tuple, optional
     """
 
     def __init__(
@@ -100,6 +132,10 @@ class NormalizingFlow(tf.keras.Model):
         post_affine=True,
         bounds=None,
         random_seed=1,
+        base_sampling="iid",
+        num_bins=8,
+        support_mapping=None,
+        matrix_shape=None,
     ):
         """Constructor method."""
         super(NormalizingFlow, self).__init__()
@@ -116,6 +152,17 @@ class NormalizingFlow(tf.keras.Model):
         self._set_post_affine(post_affine)
         self._set_bounds(bounds)
         self._set_random_seed(random_seed)
+        self._set_base_sampling(base_sampling)
+        self._set_num_bins(num_bins)
+        self._set_matrix_shape(matrix_shape)
+        # Elements conditioned on by coupling stages.
+        if self.arch_type == "kronecker_coupling":
+            self.num_masked = (self.matrix_shape[0] // 2) * self.matrix_shape[1]
+        else:
+            self.num_masked = self.D // 2
+        # Recompute stage activations during the backward pass.  Only set
+        # once the variables are built (see :obj:`epi.models.Model.epi`).
+        self.remat_stages = False
 
         self.stages = []
         self.shift_and_log_scale_fns = []
@@ -125,12 +172,14 @@ class NormalizingFlow(tf.keras.Model):
 
         self.q0 = tfd.MultivariateNormalDiag(loc=self.D * [0.0])
         bijectors = []
+        # Batch normalization uses its moving statistics in both directions.
+        inference_bijectors = []
 
         np.random.seed(self.random_seed)
         for i in range(num_stages):
             if arch_type == "coupling":
-                shift_and_log_scale_fn = tfb.real_nvp_default_template(
-                    hidden_layers=num_layers * [num_units]
+                shift_and_log_scale_fn = CouplingConditioner(
+                    self.D - self.D // 2, num_layers, num_units
                 )
 
                 stage = tfb.RealNVP(
@@ -144,20 +193,58 @@ class NormalizingFlow(tf.keras.Model):
                 stage = tfb.MaskedAutoregressiveFlow(
                     shift_and_log_scale_fn=shift_and_log_scale_fn
                 )
+            elif arch_type == "inverse_autoregressive":
+                shift_and_log_scale_fn = tfb.AutoregressiveNetwork(
+                    params=2, hidden_units=num_layers * [num_units]
+                )
+                stage = tfb.Invert(
+                    tfb.MaskedAutoregressiveFlow(
+                        shift_and_log_scale_fn=shift_and_log_scale_fn
+                    )
+                )
+            elif arch_type == "spline":
+                shift_and_log_scale_fn = SplineConditioner(
+                    self.D - self.D // 2, num_layers, num_units, num_bins
+                )
+                stage = tfb.RealNVP(
+                    num_masked=self.D // 2,
+                    bijector_fn=shift_and_log_scale_fn.bijector_fn,
+                )
+            elif arch_type == "kronecker_coupling":
+                shift_and_log_scale_fn = KroneckerConditioner(
+                    self.matrix_shape, num_layers, num_units
+                )
+                stage = tfb.RealNVP(
+                    num_masked=self.num_masked,
+                    shift_and_log_scale_fn=shift_and_log_scale_fn,
+                )
 
             self.stages.append(stage)
             bijectors.append(stage)
+            inference_bijectors.append(stage)
             self.shift_and_log_scale_fns.append(shift_and_log_scale_fn)
 
             if i < self.num_stages - 1:
-                perm_i = tfb.Permute(np.random.permutation(self.D))
+                if arch_type == "kronecker_coupling":
+                    # Permute rows and columns of the matrix.
+                    R, C = self.matrix_shape
+                    row_perm = np.random.permutation(R)
+                    col_perm = np.random.permutation(C)
+                    perm = (C * row_perm[:, np.newaxis] + col_perm).flatten()
+                else:
+                    perm = np.random.permutation(self.D)
+                perm_i = tfb.Permute(perm)
                 self.permutations.append(perm_i)
                 bijectors.append(perm_i)
+                inference_bijectors.append(perm_i)
                 if self.batch_norm:
                     bn = tf.keras.layers.BatchNormalization(momentum=self.bn_momentum)
                     batch_norm_i = tfb.BatchNormalization(batchnorm_layer=bn)
                     self.batch_norms.append(batch_norm_i)
                     bijectors.append(batch_norm_i)
+                    inference_bijectors.append(
+                        tfb.BatchNormalization(batchnorm_layer=bn, training=False)
+                    )
 
         if self.post_affine:
             self.a = tf.Variable(initial_value=tf.ones((D,)), name="a")
@@ -166,27 +253,47 @@ class NormalizingFlow(tf.keras.Model):
             self.shift = tfb.Shift(shift=self.b)
             self.PA = tfb.Chain([self.shift, self.scale])
             bijectors.append(self.PA)
+            inference_bijectors.append(self.PA)
 
-        if self.lb is not None and self.ub is not None:
-            self.support_mapping = IntervalFlow(self.lb, self.ub)
+        if support_mapping is not None:
+            if not isinstance(support_mapping, tfb.Bijector):
+                raise TypeError(
+                    format_type_err_msg(
+                        self, "support_mapping", support_mapping, tfb.Bijector
+                    )
+                )
+            self.support_mapping = support_mapping
+        elif self.lb is not None and self.ub is not None:
+            self.support_mapping = PartitionedIntervalFlow(self.lb, self.ub)
+        else:
+            self.support_mapping = None
+        if self.support_mapping is not None:
             bijectors.append(self.support_mapping)
+            inference_bijectors.append(self.support_mapping)
 
         bijectors.reverse()
         self.trans_dist = tfd.TransformedDistribution(
             distribution=self.q0, bijector=tfb.Chain(bijectors)
         )
+        inference_bijectors.reverse()
+        self._inference_dist = tfd.TransformedDistribution(
+            distribution=self.q0, bijector=tfb.Chain(inference_bijectors)
+        )
 
-    def __call__(self, N):
+    def __call__(self, N, num_sets=2):
         tf.random.set_seed(self.random_seed)
 
-        x = self.q0.sample(N)
+        x = self._base_sample(N, num_sets)
         log_q0 = self.q0.log_prob(x)
 
         sum_ldj = 0.0
         for i in range(self.num_stages):
-            stage_i = self.stages[i]
-            sum_ldj += stage_i.forward_log_det_jacobian(x, event_ndims=1)
-            x = stage_i(x)
+            stage_fn = self._stage_fn(i)
+            if self.remat_stages:
+                x, ldj = remat_stage(stage_fn, x)
+            else:
+                x, ldj = stage_fn(x)
+            sum_ldj += ldj
             if i < self.num_stages - 1:
                 permutation_i = self.permutations[i]
                 x = permutation_i(x)
@@ -199,13 +306,126 @@ class NormalizingFlow(tf.keras.Model):
             sum_ldj += self.PA.forward_log_det_jacobian(x, event_ndims=1)
             x = self.PA(x)
 
-        if self.lb is not None and self.ub is not None:
+        if self.support_mapping is not None:
             x, _ldj = self.support_mapping.forward_and_log_det_jacobian(x)
             sum_ldj += _ldj
 
         log_q_x = log_q0 - sum_ldj
         return x, log_q_x
 
+    def _stage_fn(self, i):
+        """Fused forward pass and log determinant of the jacobian of stage i.
+
+        The bijector methods :obj:`forward` and :obj:`forward_log_det_jacobian`
+        each evaluate the conditioner network of a stage.  Here the shift and
+        log scale of a coupling stage are computed once, and the forward pass
+        of an autoregressive stage reuses the log scale of its last iteration,
+        which holds for all dimensions at the fixed point.  An inverse
+        autoregressive stage takes a single network pass.  The spline
+        parameters of a spline stage are computed once.
+
+        :param i: Stage index.
+        :type i: int
+        :return: Function of the stage input returning its output and log determinant of the jacobian.
+        :rtype: function
+        """
+        stage = self.stages[i]
+        shift_and_log_scale_fn = self.shift_and_log_scale_fns[i]
+
+        if self.arch_type in ["coupling", "kronecker_coupling"]:
+            num_masked = self.num_masked
+
+            def stage_fn(x):
+                x0, x1 = x[:, :num_masked], x[:, num_masked:]
+                shift, log_scale = shift_and_log_scale_fn(x0, self.D - num_masked)
+                y1 = x1 * tf.exp(log_scale) + shift
+                return (
+                    tf.concat([x0, y1], axis=1),
+                    tf.reduce_sum(log_scale, axis=1),
+                )
+
+        elif self.arch_type == "autoregressive":
+
+            def stage_fn(x):
+                def body(j, y, log_scale):
+                    shift, log_scale = tf.unstack(
+                        shift_and_log_scale_fn(y), num=2, axis=-1
+                    )
+                    return j + 1, x * tf.exp(log_scale) + shift, log_scale
+
+                _, y, log_scale = tf.while_loop(
+                    lambda j, y, log_scale: j < self.D,
+                    body,
+                    (0, tf.zeros_like(x), tf.zeros_like(x)),
+                    maximum_iterations=self.D,
+                )
+                return y, tf.reduce_sum(log_scale, axis=1)
+
+        elif self.arch_type == "inverse_autoregressive":
+
+            def stage_fn(x):
+                shift, log_scale = tf.unstack(
+                    shift_and_log_scale_fn(x), num=2, axis=-1
+                )
+                y = (x - shift) * tf.exp(-log_scale)
+                return y, -tf.reduce_sum(log_scale, axis=1)
+
+        elif self.arch_type == "spline":
+            num_masked = self.D // 2
+
+            def stage_fn(x):
+                x0, x1 = x[:, :num_masked], x[:, num_masked:]
+                spline = shift_and_log_scale_fn.bijector_fn(x0)
+                return (
+                    tf.concat([x0, spline.forward(x1)], axis=1),
+                    spline.forward_log_det_jacobian(x1, event_ndims=1),
+                )
+
+        else:
+
+            def stage_fn(x):
+                return stage(x), stage.forward_log_det_jacobian(x, event_ndims=1)
+
+        return stage_fn
+
+    def _base_sample(self, N, num_sets=2):
+        """Samples N points of :math:`q_0` in num_sets independent sets."""
+        if self.base_sampling == "iid":
+            return self.q0.sample(N)
+
+        n = (N + num_sets - 1) // num_sets
+        if self.base_sampling == "antithetic":
+            x = tf.random.normal((num_sets, (n + 1) // 2, self.D))
+            x = tf.concat([x, -x], axis=1)[:, :n]
+        else:
+            u = tfp.mcmc.sample_halton_sequence(
+                self.D, num_results=n, randomized=False
+            )
+            # Cranley-Patterson rotation of each set.
+            shift = tf.random.uniform((num_sets, 1, self.D))
+            u = tf.math.floormod(u[tf.newaxis] + shift, 1.0)
+            x = tf.math.ndtri(tf.clip_by_value(u, EPS, 1.0 - EPS))
+        return tf.reshape(x, (-1, self.D))[:N]
+
+    def stl_log_prob(self, z, log_q_z):
+        """Log density of samples with the path derivative (sticking the landing) gradient.
+
+        The gradient of :math:`\\log q_\\theta(z)` with respect to :math:`\\theta`
+        through the sample path :math:`z = f_\\theta(x)` is kept, while its
+        score function term :math:`\\nabla_\\theta \\log q_\\theta(z) \\vert_z`,
+        which has zero expectation, is removed by an inverse pass.  The value
+        is unchanged.
+
+        :param z: Samples of the flow.
+        :type z: tf.Tensor
+        :param log_q_z: Log density of the samples from the forward pass.
+        :type log_q_z: tf.Tensor
+        :return: Log density of the samples.
+        :rtype: tf.Tensor
+        """
+        log_q_z_score = self._inference_dist.log_prob(tf.stop_gradient(z))
+        return log_q_z - log_q_z_score + tf.stop_gradient(log_q_z_score)
+
     @tf.function
     def sample(self, N):
         """Generate N samples from the network.
@@ -217,13 +437,48 @@ class NormalizingFlow(tf.keras.Model):
         """
         return self.__call__(N)[0]
 
+    def copy(self,):
+        """Copies the architecture and the values of its variables.
+
+        :return: A normalizing flow with the same architecture and variable values.
+        :rtype: :obj:`epi.normalizing_flows.NormalizingFlow`
+        """
+        bounds = None if self.lb is None else (self.lb, self.ub)
+        nf = NormalizingFlow(
+            self.arch_type,
+            self.D,
+            self.num_stages,
+            self.num_layers,
+            self.num_units,
+            batch_norm=self.batch_norm,
+            bn_momentum=self.bn_momentum,
+            post_affine=self.post_affine,
+            bounds=bounds,
+            random_seed=self.random_seed,
+            base_sampling=self.base_sampling,
+            num_bins=self.num_bins,
+            support_mapping=self.support_mapping,
+            matrix_shape=self.matrix_shape,
+        )
+        # Build the variables of the conditioner networks.
+        nf(1)
+        for var, var_copy in zip(self.variables, nf.variables):
+            var_copy.assign(var)
+        return nf
+
     def _set_arch_type(self, arch_type):  # Make this noninherited?
-        arch_types = ["coupling", "autoregressive"]
+        arch_types = [
+            "coupling",
+            "autoregressive",
+            "inverse_autoregressive",
+            "spline",
+            "kronecker_coupling",
+        ]
         if type(arch_type) is not str:
             raise TypeError(format_type_err_msg(self, "arch_type", arch_type, str))
         if arch_type not in arch_types:
             raise ValueError(
-                'NormalizingFlow arch_type must be "coupling" or "autoregressive"'
+                "NormalizingFlow arch_type must be in %s." % str(arch_types)
             )
         self.arch_type = arch_type
 
@@ -309,6 +564,48 @@ class NormalizingFlow(tf.keras.Model):
             raise TypeError(format_type_err_msg(self, "random_seed", random_seed, int))
         self.random_seed = random_seed
 
+    def _set_base_sampling(self, base_sampling):
+        base_samplings = ["iid", "halton", "antithetic"]
+        if type(base_sampling) is not str:
+            raise TypeError(
+                format_type_err_msg(self, "base_sampling", base_sampling, str)
+            )
+        if base_sampling not in base_samplings:
+            raise ValueError(
+                'NormalizingFlow base_sampling "%s" not in %s.'
+                % (base_sampling, str(base_samplings))
+            )
+        self.base_sampling = base_sampling
+
+    def _set_num_bins(self, num_bins):
+        if type(num_bins) is not int:
+            raise TypeError(format_type_err_msg(self, "num_bins", num_bins, int))
+        elif num_bins < 2:
+            raise ValueError(
+                "NormalizingFlow num_bins %d must be at least 2." % num_bins
+            )
+        self.num_bins = num_bins
+
+    def _set_matrix_shape(self, matrix_shape):
+        if matrix_shape is None:
+            if self.arch_type == "kronecker_coupling":
+                raise ValueError("Kronecker coupling requires a matrix_shape.")
+            self.matrix_shape = None
+            return None
+        if type(matrix_shape) not in [list, tuple]:
+            raise TypeError(
+                format_type_err_msg(self, "matrix_shape", matrix_shape, tuple)
+            )
+        if len(matrix_shape) != 2 or any([type(n) is not int for n in matrix_shape]):
+            raise ValueError("NormalizingFlow matrix_shape must be two ints.")
+        R, C = matrix_shape
+        if R < 2 or C < 1 or R * C != self.D:
+            raise ValueError(
+                "NormalizingFlow matrix_shape (%d, %d) must have at least 2 rows "
+                "and D = %d elements." % (R, C, self.D)
+            )
+        self.matrix_shape = (R, C)
+
     def initialize(
         self,
         init_type,
@@ -320,6 +617,9 @@ class NormalizingFlow(tf.keras.Model):
         load_if_cached=True,
         save=True,
         verbose=False,
+        jit_compile=False,
+        method="reverse_KL",
+        tol=None,
     ):
         """Initializes architecture to gaussian distribution via variational inference.
 
@@ -342,6 +642,16 @@ class NormalizingFlow(tf.keras.Model):
         * :obj:`init_params.mu` set to the mean.
         * :obj:`init_params.Sigma` set to the covariance.
 
+        With :obj:`method='forward_KL'`, the flow is instead fit by maximum
+        likelihood of samples of the gaussian (truncated to the bounds of the
+        flow), which does not differentiate through sampling of the flow.
+
+        Optimization stops early at a logged iteration once the KL divergence
+        to the gaussian is below :obj:`tol`.  For flows with bounds or a support
+        mapping, where the KL divergence is not computed, it stops once the
+        largest absolute error of the flow mean and covariance to those of the
+        (truncated) gaussian is below :obj:`tol`.
+
         :param init_type: :math:`\\in` `['iso_gauss', 'gaussian']`
         :type init_type: str
         :param init_params: Parameters according to :obj:`init_type`.
@@ -354,28 +664,105 @@ class NormalizingFlow(tf.keras.Model):
         :type lr: float, optional
         :param log_rate: Record optimization data every so iterations, defaults to 100.
         :type log_rate: int, optional
-        :param load_if_cached: If initialization has been optimized before, load it, defaults to True.
+        :param load_if_cached: If initialization has been optimized before, load it, defaults to True.  Concurrent calls for the same initialization wait for the one optimizing it (see :obj:`epi.util.file_lock`), and cached initializations are evicted by least recent use (see :obj:`epi.util.update_init_cache`).
         :type load_if_cached: bool, optional
-        :param save: Save initialization if true, defaults to True.
+        :param save: Save initialization to the cache if true, defaults to True.
         :type save: bool, optional
         :param verbose: Print verbose output, defaults to False.
         :type verbose: bool, optional
-
+        :param jit_compile: Compile the training step with XLA, defaults to False.
+        :type jit_compile: bool, optional
+        :param method: :math:`\\in` :obj:`['reverse_KL', 'forward_KL']`, defaults to :obj:`'reverse_KL'`.
+        :type method: str, optional
+        :param tol: Early stopping tolerance of the KL divergence or moment error, defaults to None for all num_iters iterations.
+        :type tol: float, optional
+        :return: Optimization data with columns :obj:`moment_err` and :obj:`converged`.
+        :rtype: pandas.DataFrame
         """
+        if method not in ["reverse_KL", "forward_KL"]:
+            raise ValueError(
+                "NormalizingFlow initialization method must be 'reverse_KL' or "
+                "'forward_KL'."
+            )
+        if tol is not None:
+            if type(tol) not in [float, int]:
+                raise TypeError(format_type_err_msg(self, "tol", tol, float))
+            if tol <= 0.0:
+                raise ValueError("Initialization tol must be positive.")
+        if method == "forward_KL" and not (
+            self.support_mapping is None
+            or isinstance(self.support_mapping, IntervalFlow)
+        ):
+            raise ValueError(
+                "Forward KL initialization requires bounds rather than a support "
+                "mapping."
+            )
         optimizer = tf.keras.optimizers.Adam(lr)
 
-        _init_path = init_path(self.to_string(), init_type, init_params)
+        arch_string = self.to_string()
+        _init_path = init_path(arch_string, init_type, init_params, method, tol)
         init_file = _init_path + "ckpt"
         checkpoint = tf.train.Checkpoint(optimizer=optimizer, model=self)
-        ckpt = tf.train.latest_checkpoint(_init_path)
-        if load_if_cached and (ckpt is not None):
-            print("Loading variables from cached initialization.")
-            status = checkpoint.restore(ckpt)
-            status.expect_partial()  # Won't use optimizer momentum parameters
-            opt_data_file = _init_path + "opt_data.csv"
-            if os.path.exists(opt_data_file):
-                return pd.read_csv(opt_data_file)
+        fit_args = (
+            init_type,
+            init_params,
+            optimizer,
+            N,
+            num_iters,
+            log_rate,
+            verbose,
+            jit_compile,
+            method,
+            tol,
+        )
+        # Only one process trains an initialization, others wait and load it.
+        with file_lock(_init_path):
+            # The initialization may have been evicted while waiting.
+            os.makedirs(_init_path, exist_ok=True)
+            ckpt = tf.train.latest_checkpoint(_init_path)
+            if load_if_cached and (ckpt is not None):
+                print("Loading variables from cached initialization.")
+                status = checkpoint.restore(ckpt)
+                status.expect_partial()  # Won't use optimizer momentum parameters
+                try:
+                    # Caches of other conditioner networks are trained again.
+                    status.assert_existing_objects_matched()
+                    matched = True
+                except AssertionError:
+                    print("Cached initialization does not match, training again.")
+                    matched = False
+                opt_data_file = _init_path + "opt_data.csv"
+                if matched and os.path.exists(opt_data_file):
+                    update_init_cache(_init_path, arch_string, init_type)
+                    return pd.read_csv(opt_data_file)
+
+            if save:
+                opt_df = self._fit_gaussian(*fit_args)
+                opt_df.to_csv(_init_path + "opt_data.csv")
+                checkpoint.save(file_prefix=init_file)
+        if not save:
+            return self._fit_gaussian(*fit_args)
+        update_init_cache(_init_path, arch_string, init_type)
+        return opt_df
 
+    def _fit_gaussian(
+        self,
+        init_type,
+        init_params,
+        optimizer,
+        N,
+        num_iters,
+        log_rate,
+        verbose,
+        jit_compile,
+        method,
+        tol,
+    ):
+        """Optimizes the flow to the gaussian of :obj:`initialize`.
+
+        :return: Optimization data.
+        :rtype: pandas.DataFrame
+        """
         if init_type == "iso_gauss":
             loc = init_params["loc"]
             scale = init_params["scale"]
@@ -386,6 +773,30 @@ class NormalizingFlow(tf.keras.Model):
             Sigma = init_params["Sigma"]
 
         eta = gaussian_backward_mapping(mu, Sigma)
+        rng = np.random.RandomState(self.random_seed)
+        # Pool of (truncated) gaussian samples from which batches are drawn.
+        if method == "forward_KL" or (
+            tol is not None and self.support_mapping is not None
+        ):
+            z_pool = self._gauss_samples(rng, mu, Sigma, max(100 * N, 10000))
+            z_pool = z_pool.astype(np.float32)
+        else:
+            z_pool = None
+        # Moments of the (truncated) gaussian.
+        if self.support_mapping is None:
+            mu_true, Sigma_true = mu, Sigma
+        elif z_pool is not None:
+            mu_true, Sigma_true = np.mean(z_pool, 0), np.cov(z_pool.T)
+        else:
+            mu_true, Sigma_true = None, None
+
+        def moment_err(z):
+            if mu_true is None:
+                return np.nan
+            z = z.numpy()
+            mean_err = np.max(np.abs(np.mean(z, 0) - mu_true))
+            cov_err = np.max(np.abs(np.cov(z.T) - Sigma_true))
+            return max(mean_err, cov_err)
 
         def gauss_init_loss(z, log_q_z, eta):
             zl = z[:, :, tf.newaxis]
@@ -399,8 +810,7 @@ class NormalizingFlow(tf.keras.Model):
             loss = E_log_q_z - tf.reduce_sum(eta * E_T_z)
             return loss
 
-        @tf.function
-        def train_step():
+        def _train_step():
             with tf.GradientTape() as tape:
                 z, log_q_z = self(N)
                 loss = gauss_init_loss(z, log_q_z, eta)
@@ -413,12 +823,59 @@ class NormalizingFlow(tf.keras.Model):
             optimizer.apply_gradients(zip(gradients, params))
             return loss
 
-        z, log_q_z = self(N)
-        loss0 = gauss_init_loss(z, log_q_z, eta).numpy()
-        H0 = -np.mean(log_q_z.numpy())
-        KL0 = self.gauss_KL(z, log_q_z, mu, Sigma)
-        d = {"iteration": 0, "loss": loss0, "H": H0, "KL": KL0}
-        opt_it_dfs = [pd.DataFrame(d, index=[0])]
+        def ml_loss(z_true):
+            return -tf.reduce_mean(self.trans_dist.log_prob(z_true))
+
+        def _ml_train_step():
+            inds = tf.random.uniform((N,), maxval=z_pool.shape[0], dtype=tf.int32)
+            with tf.GradientTape() as tape:
+                loss = ml_loss(tf.gather(z_pool_tf, inds))
+
+            params = self.trainable_variables
+            gradients = tape.gradient(loss, params)
+            ming, maxg = -1e5, 1e5
+            gradients = [tf.clip_by_value(grad, ming, maxg) for grad in gradients]
+
+            optimizer.apply_gradients(zip(gradients, params))
+            return loss
+
+        if method == "forward_KL":
+            z_pool_tf = tf.constant(z_pool)
+            train_step = tf_compile(_ml_train_step, jit_compile)
+
+            def log_loss(z, log_q_z):
+                inds = rng.randint(z_pool.shape[0], size=N)
+                return ml_loss(z_pool[inds]).numpy()
+
+        else:
+            train_step = tf_compile(_train_step, jit_compile)
+
+            def log_loss(z, log_q_z):
+                return gauss_init_loss(z, log_q_z, eta).numpy()
+
+        def opt_it_df(i):
+            z, log_q_z = self(N)
+            loss = log_loss(z, log_q_z)
+            H = -np.mean(log_q_z.numpy())
+            KL = self.gauss_KL(z, log_q_z, mu, Sigma)
+            err = moment_err(z)
+            if tol is None:
+                converged = False
+            elif not np.isnan(KL):
+                converged = KL < tol
+            else:
+                converged = err < tol
+            d = {
+                "iteration": i,
+                "loss": loss,
+                "H": H,
+                "KL": KL,
+                "moment_err": err,
+                "converged": converged,
+            }
+            return pd.DataFrame(d, index=[0])
+
+        opt_it_dfs = [opt_it_df(0)]
 
         for i in range(1, num_iters + 1):
             loss = train_step()
@@ -428,25 +885,23 @@ class NormalizingFlow(tf.keras.Model):
                 raise ValueError("Initialization loss is inf.")
 
             if i % log_rate == 0:
-                z, log_q_z = self(N)
-                loss = gauss_init_loss(z, log_q_z, eta).numpy()
-                H = -np.mean(log_q_z.numpy())
-                KL = self.gauss_KL(z, log_q_z, mu, Sigma)
-                d = {"iteration": i, "loss": loss, "H": H, "KL": KL}
-                opt_it_dfs.append(pd.DataFrame(d, index=[0]))
+                df = opt_it_df(i)
+                opt_it_dfs.append(df)
+                H, KL, loss = df["H"][0], df["KL"][0], df["loss"][0]
                 if verbose:
                     if not np.isnan(KL):
                         print(i, "H", H, "KL", KL, "loss", loss)
                     else:
                         print(i, "H", H, "loss", loss)
+                if df["converged"][0]:
+                    if verbose:
+                        print("Initialization converged at iteration %d." % i)
+                    break
 
-        opt_df = pd.concat(opt_it_dfs, ignore_index=True)
-        opt_df.to_csv(_init_path + "opt_data.csv")
-        checkpoint.save(file_prefix=init_file)
-        return opt_df
+        return pd.concat(opt_it_dfs, ignore_index=True)
 
-    def plot_init_opt(self, init_type, init_params):
-        _init_path = init_path(self.to_string(), init_type, init_params)
+    def plot_init_opt(self, init_type, init_params, method="reverse_KL", tol=None):
+        _init_path = init_path(self.to_string(), init_type, init_params, method, tol)
         opt_data_file = _init_path + "opt_data.csv"
         if os.path.exists(opt_data_file):
             df = pd.read_csv(opt_data_file)
@@ -461,8 +916,34 @@ class NormalizingFlow(tf.keras.Model):
             df.plot("iteration", ys[i], ax=axs[i])
         return df
 
+    def _gauss_samples(self, rng, mu, Sigma, N):
+        """Samples a gaussian truncated to the bounds of the flow.
+
+        :param rng: Random number generator.
+        :type rng: np.random.RandomState
+        :param mu: Mean of the gaussian.
+        :type mu: np.ndarray
+        :param Sigma: Covariance of the gaussian.
+        :type Sigma: np.ndarray
+        :param N: Number of samples.
+        :type N: int
+        :return: (N, D) samples.
+        :rtype: np.ndarray
+        """
+        if self.lb is None or self.ub is None:
+            return rng.multivariate_normal(mu, Sigma, N)
+        zs, num_samples = [], 0
+        for _ in range(100):
+            z = rng.multivariate_normal(mu, Sigma, max(N, 10000))
+            z = z[np.logical_and(z > self.lb, z < self.ub).all(axis=1)]
+            zs.append(z)
+            num_samples += z.shape[0]
+            if num_samples >= N:
+                return np.concatenate(zs, axis=0)[:N]
+        raise ValueError("Gaussian has too little mass within the flow bounds.")
+
     def gauss_KL(self, z, log_q_z, mu, Sigma):
-        if self.lb is not None or self.ub is not None:
+        if self.support_mapping is not None:
             return np.nan
         q_true = scipy.stats.multivariate_normal(mean=mu, cov=Sigma)
         return np.mean(log_q_z) - np.mean(q_true.logpdf(z))
@@ -477,6 +958,12 @@ class NormalizingFlow(tf.keras.Model):
             arch_type_str = "C"
         elif self.arch_type == "autoregressive":
             arch_type_str = "AR"
+        elif self.arch_type == "inverse_autoregressive":
+            arch_type_str = "IAF"
+        elif self.arch_type == "spline":
+            arch_type_str = "RQS"
+        elif self.arch_type == "kronecker_coupling":
+            arch_type_str = "KC"
 
         arch_string = "D%d_%s%d_L%d_U%d" % (
             self.D,
@@ -485,6 +972,10 @@ class NormalizingFlow(tf.keras.Model):
             self.num_layers,
             self.num_units,
         )
+        if self.arch_type == "spline":
+            arch_string += "_K%d" % self.num_bins
+        if self.arch_type == "kronecker_coupling":
+            arch_string += "_M%dx%d" % self.matrix_shape
 
         # if self.batch_norm:
         #    arch_string += "_bnmom=%.2E" % self.bn_momentum
@@ -495,10 +986,258 @@ class NormalizingFlow(tf.keras.Model):
         # if self.lb is not None and self.ub is not None:
         # arch_string += "_lb=%s_ub=%s" % (array_str(self.lb), array_str(self.ub))
 
+        if self.base_sampling != "iid":
+            arch_string += "_%s" % self.base_sampling
+
         arch_string += "_rs%d" % self.random_seed
         return arch_string
 
 
+def remat_stage(stage_fn, x):
+    """Applies a flow stage, recomputing its activations in the backward pass.
+
+    :param stage_fn: Fused stage function returning the stage output and forward log determinant of the jacobian (see :obj:`NormalizingFlow._stage_fn`).
+    :type stage_fn: function
+    :param x: Stage input (N, D).
+    :type x: tf.Tensor
+    :return: Stage output and forward log determinant of the jacobian.
+    :rtype: (tf.Tensor, tf.Tensor)
+    """
+
+    # tf.recompute_grad differentiates a single output tensor.
+    def concat_stage_fn(x):
+        y, ldj = stage_fn(x)
+        return tf.concat([y, ldj[:, tf.newaxis]], axis=1)
+
+    y = tf.recompute_grad(concat_stage_fn)(x)
+    return y[:, :-1], y[:, -1]
+
+
+def population_call(nfs, N):
+    """Samples a population of coupling flows with batched conditioner networks.
+
+    The B flows have the same coupling architecture, so the kernels and biases
+    of the conditioner networks of stage i of all flows are stacked with a
+    leading B axis, and each layer of the B networks is one batched matrix
+    multiplication.  Permutations, batch normalization and post affine
+    transforms are applied per flow, as in :obj:`NormalizingFlow.__call__`.
+
+    :param nfs: Coupling flows of the same architecture with built variables.
+    :type nfs: list
+    :param N: Number of samples of each flow.
+    :type N: int
+    :return: Samples (B, N, D) and their log densities (B, N).
+    :rtype: (tf.Tensor, tf.Tensor)
+    """
+    nf0 = nfs[0]
+    B, D, num_masked = len(nfs), nf0.D, nf0.num_masked
+    x = tf.stack([nf._base_sample(N) for nf in nfs])
+    log_q0 = nf0.q0.log_prob(x)
+
+    sum_ldj = 0.0
+    for i in range(nf0.num_stages):
+        # Dense layers of the conditioners of all flows.
+        layers = [
+            fn.hidden_layers + [fn.output_layer]
+            for fn in [nf.shift_and_log_scale_fns[i] for nf in nfs]
+        ]
+        num_dense = len(layers[0])
+        x0, x1 = x[:, :, :num_masked], x[:, :, num_masked:]
+        h = x0
+        for j in range(num_dense):
+            kernel = tf.stack([layers_b[j].kernel for layers_b in layers])
+            bias = tf.stack([layers_b[j].bias for layers_b in layers])
+            h = tf.einsum("bni,bio->bno", h, kernel) + bias[:, tf.newaxis, :]
+            if j < num_dense - 1:
+                h = tf.nn.relu(h)
+        shift, log_scale = tf.split(h, 2, axis=-1)
+        x = tf.concat([x0, x1 * tf.exp(log_scale) + shift], axis=2)
+        sum_ldj += tf.reduce_sum(log_scale, axis=2)
+        if i < nf0.num_stages - 1:
+            perms = tf.stack([nf.permutations[i].permutation for nf in nfs])
+            x = tf.gather(x, perms, axis=2, batch_dims=1)
+            if nf0.batch_norm:
+                xs, ldjs = [], []
+                for b in range(B):
+                    batch_norm_i = nfs[b].batch_norms[i]
+                    ldj = batch_norm_i.forward_log_det_jacobian(x[b], event_ndims=1)
+                    ldjs.append(ldj * tf.ones((N,)))
+                    xs.append(batch_norm_i(x[b]))
+                x = tf.stack(xs)
+                sum_ldj += tf.stack(ldjs)
+
+    if nf0.post_affine:
+        a = tf.stack([nf.a for nf in nfs])[:, tf.newaxis, :]
+        b = tf.stack([nf.b for nf in nfs])[:, tf.newaxis, :]
+        x = a * x + b
+        sum_ldj += tf.reduce_sum(tf.math.log(tf.abs(a)), axis=2)
+
+    if nf0.support_mapping is not None:
+        x, ldj = nf0.support_mapping.forward_and_log_det_jacobian(
+            tf.reshape(x, (B * N, D))
+        )
+        x = tf.reshape(x, (B, N, D))
+        sum_ldj += tf.reshape(ldj, (B, N))
+
+    return x, log_q0 - sum_ldj
+
+
+class CouplingConditioner(tf.keras.layers.Layer):
+    """Shift and log scale network of an affine coupling stage.
+
+    A multilayer perceptron with relu hidden layers, whose output layer is
+    split into the shift and log scale of the transformed elements, as in
+    :obj:`tfp.bijectors.real_nvp_default_template`.  Unlike the template, the
+    layer owns its variables, so it may be called outside of its
+    :obj:`tfp.bijectors.RealNVP` bijector (see
+    :obj:`NormalizingFlow._stage_fn`).
+
+    :param num_outputs: Number of transformed elements.
+    :type num_outputs: int
+    :param num_layers: Number of hidden layers.
+    :type num_layers: int
+    :param num_units: Number of units per hidden layer.
+    :type num_units: int
+    """
+
+    def __init__(self, num_outputs, num_layers, num_units):
+        super(CouplingConditioner, self).__init__()
+        self.num_outputs = num_outputs
+        self.hidden_layers = [
+            tf.keras.layers.Dense(num_units, activation="relu")
+            for _ in range(num_layers)
+        ]
+        self.output_layer = tf.keras.layers.Dense(2 * num_outputs)
+
+    def call(self, x0, output_units=None):
+        h = x0
+        for layer in self.hidden_layers:
+            h = layer(h)
+        shift, log_scale = tf.split(self.output_layer(h), 2, axis=-1)
+        return shift, log_scale
+
+
+class SplineConditioner(tf.keras.layers.Layer):
+    """Conditioner network of a rational quadratic spline coupling stage.
+
+    Maps the conditioning elements to the bin widths, bin heights and interior
+    knot slopes of a :obj:`tfp.bijectors.RationalQuadraticSpline` on
+    :math:`[-B, B]` for each of the transformed elements.  Outside of the
+    interval the spline is the identity.  The output layer is initialized to
+    zero, for which the spline is the identity.
+
+    :param num_outputs: Number of transformed elements.
+    :type num_outputs: int
+    :param num_layers: Number of hidden layers.
+    :type num_layers: int
+    :param num_units: Number of units per hidden layer.
+    :type num_units: int
+    :param num_bins: Number of spline bins.
+    :type num_bins: int
+    :param bound: Bound B of the spline interval, defaults to 4.
+    :type bound: float, optional
+    """
+
+    def __init__(self, num_outputs, num_layers, num_units, num_bins, bound=4.0):
+        super(SplineConditioner, self).__init__()
+        self.num_outputs = num_outputs
+        self.num_bins = num_bins
+        self.bound = bound
+        self.hidden_layers = [
+            tf.keras.layers.Dense(num_units, activation="relu")
+            for _ in range(num_layers)
+        ]
+        self.output_layer = tf.keras.layers.Dense(
+            num_outputs * (3 * num_bins - 1), kernel_initializer="zeros"
+        )
+
+    def call(self, x):
+        for layer in self.hidden_layers:
+            x = layer(x)
+        params = tf.reshape(
+            self.output_layer(x), (-1, self.num_outputs, 3 * self.num_bins - 1)
+        )
+        K = self.num_bins
+        min_size = 1e-3
+
+        def _bin_sizes(logits):
+            sizes = tf.nn.softmax(logits, axis=-1)
+            return sizes * (2.0 * self.bound - K * min_size) + min_size
+
+        bin_widths = _bin_sizes(params[:, :, :K])
+        bin_heights = _bin_sizes(params[:, :, K : 2 * K])
+        # Unit slopes at zero output, including the minimum slope.
+        slope_offset = np.log(np.expm1(1.0 - min_size))
+        knot_slopes = tf.math.softplus(params[:, :, 2 * K :] + slope_offset)
+        return bin_widths, bin_heights, knot_slopes + min_size
+
+    def bijector_fn(self, x0, input_depth=None, **condition_kwargs):
+        """Spline bijector of the transformed elements conditioned on x0.
+
+        Signature of the :obj:`bijector_fn` of :obj:`tfp.bijectors.RealNVP`.
+        """
+        bin_widths, bin_heights, knot_slopes = self(x0)
+        return tfb.RationalQuadraticSpline(
+            bin_widths, bin_heights, knot_slopes, range_min=-self.bound
+        )
+
+
+class KroneckerConditioner(tf.keras.layers.Layer):
+    """Conditioner network of a Kronecker coupling stage.
+
+    The first :math:`R_0 = \\lfloor R/2 \\rfloor` rows :math:`X_0` of an
+    :math:`R \\times C` matrix condition the shift and log scale of the other
+    :math:`R_1 = R - R_0` rows.  Each layer maps a batch of matrices to
+
+    :math:`\\sigma(A X B + c)`
+
+    with :math:`A` of shape :math:`(R_1, R_{in})`, :math:`B` of shape
+    :math:`(C_{in}, C_{out})` and :math:`c` of shape :math:`(R_1, C_{out})`,
+    which is a dense layer with the Kronecker-structured weight matrix
+    :math:`A \\otimes B^\\top`.  The hidden layers have :math:`R_1 \\times`
+    num_units outputs, and the output layer :math:`R_1 \\times 2C`.
+
+    :param matrix_shape: Rows and columns (R, C) of the matrix.
+    :type matrix_shape: tuple
+    :param num_layers: Number of hidden layers.
+    :type num_layers: int
+    :param num_units: Number of columns of the hidden layers.
+    :type num_units: int
+    """
+
+    def __init__(self, matrix_shape, num_layers, num_units):
+        super(KroneckerConditioner, self).__init__()
+        R, C = matrix_shape
+        self.R0, self.R1, self.C = R // 2, R - R // 2, C
+        shapes = [(self.R0, C)] + num_layers * [(self.R1, num_units)]
+        shapes += [(self.R1, 2 * C)]
+        self.As, self.Bs, self.cs = [], [], []
+        for i in range(num_layers + 1):
+            (rows_in, cols_in), (rows_out, cols_out) = shapes[i], shapes[i + 1]
+            A = self.add_weight(
+                "A%d" % i, (rows_out, rows_in), initializer="glorot_uniform"
+            )
+            B = self.add_weight(
+                "B%d" % i, (cols_in, cols_out), initializer="glorot_uniform"
+            )
+            c = self.add_weight("c%d" % i, (rows_out, cols_out), initializer="zeros")
+            self.As.append(A)
+            self.Bs.append(B)
+            self.cs.append(c)
+
+    def call(self, x0, output_units=None):
+        x = tf.reshape(x0, (-1, self.R0, self.C))
+        num_layers = len(self.As)
+        for i in range(num_layers):
+            x = tf.einsum("ij,njk->nik", self.As[i], x)
+            x = tf.einsum("nik,kl->nil", x, self.Bs[i]) + self.cs[i]
+            if i < num_layers - 1:
+                x = tf.nn.relu(x)
+        shift, log_scale = tf.split(x, 2, axis=2)
+        output_shape = (-1, self.R1 * self.C)
+        return tf.reshape(shift, output_shape), tf.reshape(log_scale, output_shape)
+
+
 class IntervalFlow(tfp.bijectors.Bijector):
     """Bijector maps from :math:`\\mathcal{R}^N` to an interval.
 
@@ -648,7 +1387,7 @@ class IntervalFlow(tfp.bijectors.Bijector):
         x = tf.multiply(self.tanh_flg, tanh_inv) + tf.multiply(1 - self.tanh_flg, x)
         return x
 
-    def forward_log_det_jacobian(self, x):
+    def forward_log_det_jacobian(self, x, event_ndims=1):
         """Calculates forward log det jac of the interval flow.
 
         :param x: Input tensor.
@@ -692,81 +1431,538 @@ class IntervalFlow(tfp.bijectors.Bijector):
         return -self.forward_log_det_jacobian(self.inverse(x))
 
 
+class PartitionedIntervalFlow(IntervalFlow):
+    """Interval flow transforming each dimension only by its bound type.
+
+    :obj:`epi.normalizing_flows.IntervalFlow` computes every transform for
+    every dimension and blends them with masks.  Here the dimensions are
+    partitioned into static index sets of unbounded, one-sided (softplus) and
+    two-sided (tanh) dimensions.  Each group is gathered and transformed, and
+    the results are scattered back with one gather of their concatenation.
+    Values match :obj:`epi.normalizing_flows.IntervalFlow`.
+
+    :param lb: Lower bound. N values are numeric including :obj:`float('-inf')`.
+    :type lb: np.ndarray
+    :param ub: Upper bound. N values are numeric including :obj:`float('inf')`.
+    :type ub: np.ndarray
+    """
+
+    def __init__(self, lb, ub):
+        """Constructor method."""
+        super().__init__(lb, ub)
+        has_lb = np.logical_not(np.isneginf(self.lb))
+        has_ub = np.logical_not(np.isposinf(self.ub))
+        id_inds = np.where(np.logical_not(has_lb | has_ub))[0]
+        softplus_inds = np.where(has_lb ^ has_ub)[0]
+        tanh_inds = np.where(has_lb & has_ub)[0]
+
+        self.id_inds = tf.constant(id_inds, tf.int32)
+        self.softplus_inds = tf.constant(softplus_inds, tf.int32)
+        self.tanh_inds = tf.constant(tanh_inds, tf.int32)
+        groups = [id_inds, softplus_inds, tanh_inds]
+        self.group_sizes = [inds.shape[0] for inds in groups]
+        # Position of each dimension in the concatenation of the groups.
+        perm = np.concatenate(groups)
+        self.scatter_inds = tf.constant(np.argsort(perm), tf.int32)
+
+        lb_sp, ub_sp = self.lb[softplus_inds], self.ub[softplus_inds]
+        only_ub = np.isneginf(lb_sp)
+        self.softplus_m_part = tf.constant(np.where(only_ub, -1.0, 1.0), DTYPE)
+        self.softplus_c_part = tf.constant(np.where(only_ub, ub_sp, lb_sp), DTYPE)
+        lb_tanh, ub_tanh = self.lb[tanh_inds], self.ub[tanh_inds]
+        self.tanh_m_part = tf.constant((ub_tanh - lb_tanh) / 2.0, DTYPE)
+        self.tanh_c_part = tf.constant((ub_tanh + lb_tanh) / 2.0, DTYPE)
+
+    def _transform(self, x, compute_ldj):
+        """Forward pass by group, and optionally the log det jacobian."""
+        num_id, num_softplus, num_tanh = self.group_sizes
+        ys = []
+        ldj = tf.zeros_like(x[:, 0])
+        if num_id > 0:
+            ys.append(tf.gather(x, self.id_inds, axis=1))
+        if num_softplus > 0:
+            x_sp = tf.gather(x, self.softplus_inds, axis=1)
+            y_sp = self.softplus_m_part * tf.math.softplus(x_sp) + self.softplus_c_part
+            ys.append(y_sp)
+            if compute_ldj:
+                ldj += tf.reduce_sum(tf.math.log_sigmoid(x_sp), 1)
+        if num_tanh > 0:
+            tanh_x = tf.tanh(tf.gather(x, self.tanh_inds, axis=1))
+            ys.append(self.tanh_m_part * tanh_x + self.tanh_c_part)
+            if compute_ldj:
+                ldj += tf.reduce_sum(
+                    tf.math.log(self.tanh_m_part + EPS)
+                    + tf.math.log(1.0 - tf.square(tanh_x) + EPS),
+                    1,
+                )
+        y = tf.gather(tf.concat(ys, axis=1), self.scatter_inds, axis=1)
+        return y, ldj
+
+    def forward_and_log_det_jacobian(self, x):
+        """Runs bijector forward and calculates log det jac of the function.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass and log determinant of the jacobian.
+        :rtype: (tf.Tensor, tf.Tensor)
+        """
+        return self._transform(x, True)
+
+    def forward(self, x):
+        """Runs bijector forward.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass of the interval flow
+        :rtype: tf.Tensor
+        """
+        return self._transform(x, False)[0]
+
+    def inverse(self, x):
+        """Inverts bijector at value x.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The backward pass of the interval flow
+        :rtype: tf.Tensor
+        """
+        num_id, num_softplus, num_tanh = self.group_sizes
+        xs = []
+        if num_id > 0:
+            xs.append(tf.gather(x, self.id_inds, axis=1))
+        if num_softplus > 0:
+            x_sp = tf.gather(x, self.softplus_inds, axis=1)
+            x_sp = tf.divide(x_sp - self.softplus_c_part, self.softplus_m_part)
+            xs.append(tf.math.log(tf.math.exp(x_sp) - 1 + EPS))
+        if num_tanh > 0:
+            x_tanh = tf.gather(x, self.tanh_inds, axis=1)
+            x_tanh = tf.divide(x_tanh - self.tanh_c_part, self.tanh_m_part)
+            xs.append(tf.math.atanh(x_tanh))
+        return tf.gather(tf.concat(xs, axis=1), self.scatter_inds, axis=1)
+
+    def forward_log_det_jacobian(self, x, event_ndims=1):
+        """Calculates forward log det jac of the interval flow.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: Log determinant of the jacobian of interval flow.
+        :rtype: tf.Tensor
+        """
+        return self._transform(x, True)[1]
+
+
+class SimplexFlow(tfp.bijectors.Bijector):
+    """Bijector maps from :math:`\\mathcal{R}^D` to the interior of the simplex.
+
+    :math:`y_i = \\frac{\\exp(x_i)}{1 + \\sum_{j=1}^D \\exp(x_j)}`
+
+    so that :math:`y_i > 0` and :math:`\\sum_{i=1}^D y_i < 1`, where the omitted
+    coordinate is :math:`y_{D+1} = 1 - \\sum_{i=1}^D y_i`.  The log determinant
+    of the jacobian is :math:`\\sum_{i=1}^{D+1} \\log(y_i)`.
+
+    :param D: Number of free coordinates of the simplex.
+    :type D: int
+    """
+
+    def __init__(self, D):
+        """Constructor method."""
+        super().__init__(forward_min_event_ndims=1, inverse_min_event_ndims=1)
+        if type(D) is not int:
+            raise TypeError(format_type_err_msg(self, "D", D, int))
+        if D < 1:
+            raise ValueError("SimplexFlow D %d must be positive." % D)
+        self.D = D
+
+    def forward_and_log_det_jacobian(self, x):
+        """Runs bijector forward and calculates log det jac of the function.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass and log determinant of the jacobian.
+        :rtype: (tf.Tensor, tf.Tensor)
+        """
+        log_y = tf.nn.log_softmax(tf.concat([x, tf.zeros_like(x[:, :1])], 1), 1)
+        return tf.exp(log_y[:, :-1]), tf.reduce_sum(log_y, 1)
+
+    def forward(self, x):
+        """Runs bijector forward.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass of the simplex flow.
+        :rtype: tf.Tensor
+        """
+        return self.forward_and_log_det_jacobian(x)[0]
+
+    def inverse(self, x):
+        """Inverts bijector at value x.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The backward pass of the simplex flow.
+        :rtype: tf.Tensor
+        """
+        x_last = 1.0 - tf.reduce_sum(x, 1, keepdims=True)
+        return tf.math.log(x) - tf.math.log(x_last)
+
+    def forward_log_det_jacobian(self, x, event_ndims=1):
+        """Calculates forward log det jac of the simplex flow.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: Log determinant of the jacobian of the simplex flow.
+        :rtype: tf.Tensor
+        """
+        return self.forward_and_log_det_jacobian(x)[1]
+
+    def inverse_log_det_jacobian(self, x, event_ndims=1):
+        """Log determinant jacobian of inverse pass.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The inverse log determinant jacobian.
+        :rtype: tf.Tensor
+        """
+        return -self.forward_log_det_jacobian(self.inverse(x))
+
+
+class BlockSupportFlow(tfp.bijectors.Bijector):
+    """Bijector applying a support bijector to each block of consecutive dimensions.
+
+    Maps each parameter of a model to its support, e.g. an
+    :obj:`epi.normalizing_flows.PartitionedIntervalFlow` for bounded
+    parameters and an :obj:`epi.normalizing_flows.SimplexFlow` for simplex
+    parameters.  Block bijectors have the methods of
+    :obj:`epi.normalizing_flows.IntervalFlow`.
+
+    :param bijectors: Support bijector of each block.
+    :type bijectors: list
+    :param Ds: Number of dimensions of each block.
+    :type Ds: list
+    """
+
+    def __init__(self, bijectors, Ds):
+        """Constructor method."""
+        super().__init__(forward_min_event_ndims=1, inverse_min_event_ndims=1)
+        if type(bijectors) is not list:
+            raise TypeError(format_type_err_msg(self, "bijectors", bijectors, list))
+        if type(Ds) is not list:
+            raise TypeError(format_type_err_msg(self, "Ds", Ds, list))
+        if len(bijectors) != len(Ds):
+            raise ValueError("BlockSupportFlow needs one dimension per bijector.")
+        self.bijectors = bijectors
+        self.Ds = Ds
+        self.D = sum(Ds)
+
+    def forward_and_log_det_jacobian(self, x):
+        """Runs bijector forward and calculates log det jac of the function.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass and log determinant of the jacobian.
+        :rtype: (tf.Tensor, tf.Tensor)
+        """
+        ys, ldj = [], 0.0
+        for bijector, x_b in zip(self.bijectors, tf.split(x, self.Ds, axis=1)):
+            y_b, ldj_b = bijector.forward_and_log_det_jacobian(x_b)
+            ys.append(y_b)
+            ldj += ldj_b
+        return tf.concat(ys, axis=1), ldj
+
+    def forward(self, x):
+        """Runs bijector forward.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The forward pass of the block support flow.
+        :rtype: tf.Tensor
+        """
+        xs = tf.split(x, self.Ds, axis=1)
+        ys = [bijector.forward(x_b) for bijector, x_b in zip(self.bijectors, xs)]
+        return tf.concat(ys, axis=1)
+
+    def inverse(self, x):
+        """Inverts bijector at value x.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The backward pass of the block support flow.
+        :rtype: tf.Tensor
+        """
+        xs = tf.split(x, self.Ds, axis=1)
+        ys = [bijector.inverse(x_b) for bijector, x_b in zip(self.bijectors, xs)]
+        return tf.concat(ys, axis=1)
+
+    def forward_log_det_jacobian(self, x, event_ndims=1):
+        """Calculates forward log det jac of the block support flow.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: Log determinant of the jacobian of the block support flow.
+        :rtype: tf.Tensor
+        """
+        return self.forward_and_log_det_jacobian(x)[1]
+
+    def inverse_log_det_jacobian(self, x, event_ndims=1):
+        """Log determinant jacobian of inverse pass.
+
+        :param x: Input tensor.
+        :type x: tf.Tensor
+
+        :returns: The inverse log determinant jacobian.
+        :rtype: tf.Tensor
+        """
+        return -self.forward_log_det_jacobian(self.inverse(x))
+
+
 """ The code below is used to implement SNL and SNPE. """
+class ConditionedBijector(tfp.bijectors.Bijector):
+    """Conditional bijector with its condition fixed.
+
+    :param bijector: Bijector taking condition keyword arguments.
+    :type bijector: tfp.bijectors.Bijector
+    :param condition_kwargs: Condition passed to each bijector method.
+    :type condition_kwargs: dict
+    """
+
+    def __init__(self, bijector, **condition_kwargs):
+        super().__init__(forward_min_event_ndims=1, inverse_min_event_ndims=1)
+        self.bijector = bijector
+        self.condition_kwargs = condition_kwargs
+
+    def _forward(self, x):
+        return self.bijector.forward(x, **self.condition_kwargs)
+
+    def _inverse(self, y):
+        return self.bijector.inverse(y, **self.condition_kwargs)
+
+    def _forward_log_det_jacobian(self, x):
+        return self.bijector.forward_log_det_jacobian(
+            x, event_ndims=1, **self.condition_kwargs
+        )
+
+    def _inverse_log_det_jacobian(self, y):
+        return self.bijector.inverse_log_det_jacobian(
+            y, event_ndims=1, **self.condition_kwargs
+        )
+
+
+class FixedConditionFlow(object):
+    """Distribution of a :obj:`ConditionedNormFlow` at a fixed condition.
+
+    Samples and log densities are returned as by :obj:`NormalizingFlow`, so
+    that it may be wrapped in an :obj:`epi.models.Distribution`.
+
+    :param cnf: Conditioned normalizing flow.
+    :type cnf: :obj:`epi.normalizing_flows.ConditionedNormFlow`
+    :param condition_kwargs: Condition, e.g. :obj:`x_data`.
+    :type condition_kwargs: dict
+    """
+
+    def __init__(self, cnf, **condition_kwargs):
+        self.cnf = cnf
+        self.D = cnf.D
+        self.condition_kwargs = condition_kwargs
+        bijectors = cnf.bijectors(**condition_kwargs)
+        if cnf.support_mapping is not None:
+            bijectors.append(cnf.support_mapping)
+        bijectors.reverse()
+        self.trans_dist = tfd.TransformedDistribution(
+            distribution=cnf.q0, bijector=tfb.Chain(bijectors)
+        )
+
+    def __call__(self, N):
+        x = self.cnf.q0.sample(N)
+        log_q0 = self.cnf.q0.log_prob(x)
+        z = self.trans_dist.bijector.forward(x)
+        ldj = self.trans_dist.bijector.forward_log_det_jacobian(x, event_ndims=1)
+        return z, log_q0 - ldj
+
+
+class ConditionalConditioner(tf.keras.layers.Layer):
+    """Shift and log scale network of a conditional coupling stage.
+
+    The masked elements of the stage input are concatenated with the condition
+    :obj:`x_data`, which is either shared by all samples (1, :math:`|x|`) or
+    given per sample (N, :math:`|x|`).
+
+    :param num_outputs: Number of transformed elements.
+    :type num_outputs: int
+    :param num_layers: Number of hidden layers.
+    :type num_layers: int
+    :param num_units: Number of units per hidden layer.
+    :type num_units: int
+    """
+
+    def __init__(self, num_outputs, num_layers, num_units):
+        super(ConditionalConditioner, self).__init__()
+        self.num_outputs = num_outputs
+        self.hidden_layers = [
+            tf.keras.layers.Dense(num_units, activation="relu")
+            for _ in range(num_layers)
+        ]
+        self.output_layer = tf.keras.layers.Dense(2 * num_outputs)
+
+    def call(self, x0, output_units=None, x_data=None):
+        # A rank 1 input is a single sample, and a rank 1 condition is shared.
+        single = len(x0.shape) == 1
+        if single:
+            x0 = x0[tf.newaxis, :]
+        x_data = tf.cast(x_data, x0.dtype)
+        if len(x_data.shape) == 1:
+            x_data = x_data[tf.newaxis, :]
+        multiples = [tf.shape(x0)[0] // tf.shape(x_data)[0], 1]
+        h = tf.concat([x0, tf.tile(x_data, multiples)], axis=1)
+        for layer in self.hidden_layers:
+            h = layer(h)
+        shift, log_scale = tf.split(self.output_layer(h), 2, axis=-1)
+        if single:
+            return shift[0], log_scale[0]
+        return shift, log_scale
+
+
 class ConditionedNormFlow(tf.keras.Model):
-    def __init__(self, D, num_layers=2, num_units=100):
+    """Real NVP flow whose coupling networks take a condition.
+
+    Like the coupling architecture of :obj:`NormalizingFlow`, each stage
+    transforms the last :math:`D - \\lfloor D/2 \\rfloor` elements conditioned
+    on the first ones, and elements are randomly permuted between stages.  The
+    coupling networks (see :obj:`ConditionalConditioner`) additionally take the
+    condition, which is passed as keyword argument :obj:`x_data`
+    (1, :math:`|x|`) to sampling and density evaluation, or fixed with
+    :obj:`epi.normalizing_flows.ConditionedNormFlow.condition`.
+
+    :param D: Dimensionality of the normalizing flow.
+    :type D: int
+    :param num_layers: Number of layers of the coupling network, defaults to 2.
+    :type num_layers: int, optional
+    :param num_units: Number of units per layer of the coupling network, defaults to 100.
+    :type num_units: int, optional
+    :param bounds: Bounds of distribution support, defaults to None.
+    :type bounds: (np.ndarray, np.ndarray), optional
+    :param support_mapping: Bijector to the support of the distribution in place of the interval flow of bounds, defaults to None.
+    :type support_mapping: tfp.bijectors.Bijector, optional
+    :param num_stages: Number of coupling stages, defaults to 3.
+    :type num_stages: int, optional
+    :param random_seed: Random seed of the permutations, defaults to 1.
+    :type random_seed: int, optional
+    """
+
+    def __init__(
+        self,
+        D,
+        num_layers=2,
+        num_units=100,
+        bounds=None,
+        support_mapping=None,
+        num_stages=3,
+        random_seed=1,
+    ):
         super(ConditionedNormFlow, self).__init__()
         self._set_D(D)
         self._set_num_layers(num_layers)
         self._set_num_units(num_units)
-        
+        self._set_num_stages(num_stages)
+        if type(random_seed) is not int:
+            raise TypeError(format_type_err_msg(self, "random_seed", random_seed, int))
+        self.random_seed = random_seed
+
         self.q0 = tfd.MultivariateNormalDiag(loc=self.D * [0.0])
-        
-        self.conditioner = self._real_nvp_conditioner_template(
-            output_units=D//2, 
-            hidden_layers=num_layers*[num_units],
-            conditioner_num_layers=2,
-        )
-        
-        self.NVP = tfb.RealNVP(
-            num_masked= D // 2,
-            shift_and_log_scale_fn=self.conditioner,
+
+        self.stages = []
+        self.conditioners = []
+        self.permutations = []
+        rng = np.random.RandomState(random_seed)
+        for i in range(num_stages):
+            conditioner = ConditionalConditioner(
+                self.D - self.D // 2, num_layers, num_units
+            )
+            stage = tfb.RealNVP(
+                num_masked=self.D // 2, shift_and_log_scale_fn=conditioner,
+            )
+            self.conditioners.append(conditioner)
+            self.stages.append(stage)
+            if i < num_stages - 1:
+                self.permutations.append(tfb.Permute(rng.permutation(self.D)))
+
+        if bounds is not None:
+            self.lb = np_column_vec(bounds[0])[:, 0]
+            self.ub = np_column_vec(bounds[1])[:, 0]
+            self.support_mapping = PartitionedIntervalFlow(self.lb, self.ub)
+        else:
+            self.lb, self.ub = None, None
+            self.support_mapping = None
+        if support_mapping is not None:
+            self.support_mapping = support_mapping
+
+    def bijectors(self, **condition_kwargs):
+        """Stages and permutations at a condition in order of the forward pass.
+
+        :param condition_kwargs: Condition, e.g. :obj:`x_data`.
+        :type condition_kwargs: dict
+        :return: Bijectors, excluding the support mapping.
+        :rtype: list
+        """
+        # Tensor conditions, since the bijector caches key on their values.
+        condition_kwargs = {
+            key: tf.cast(value, DTYPE) for key, value in condition_kwargs.items()
+        }
+        bijectors = []
+        for i in range(self.num_stages):
+            bijectors.append(ConditionedBijector(self.stages[i], **condition_kwargs))
+            if i < self.num_stages - 1:
+                bijectors.append(self.permutations[i])
+        return bijectors
+
+    def condition(self, **condition_kwargs):
+        """Flow at a fixed condition with the interface of :obj:`NormalizingFlow`.
+
+        :param condition_kwargs: Condition, e.g. :obj:`x_data`.
+        :type condition_kwargs: dict
+        :return: Flow of the conditional distribution, including the support mapping.
+        :rtype: :obj:`epi.normalizing_flows.FixedConditionFlow`
+        """
+        return FixedConditionFlow(self, **condition_kwargs)
+
+    def to_string(self,):
+        """Converts architecture to string for file saving.
+
+        :return: A unique string for the architecture parameterization.
+        :rtype: str
+        """
+        return "D%d_CNVP%d_L%d_U%d_rs%d" % (
+            self.D,
+            self.num_stages,
+            self.num_layers,
+            self.num_units,
+            self.random_seed,
         )
-        self.dist = tfd.TransformedDistribution(
-            distribution=self.q0, bijector=self.NVP,
-            kwargs_split_fn=(lambda y: ({}, y)),
+
+    def _dist(self, **condition_kwargs):
+        bijectors = self.bijectors(**condition_kwargs)
+        bijectors.reverse()
+        return tfd.TransformedDistribution(
+            distribution=self.q0, bijector=tfb.Chain(bijectors)
         )
-        
-    def _real_nvp_conditioner_template(
-        self, 
-        output_units, 
-        hidden_layers=[100,100],
-        conditioner_num_layers=2,
-    ):
-        def tf1_net(x, num_layers, units):
-            for i in range(num_layers):
-                x = tf1.layers.dense(inputs=x, units=units)
-            return x
-
-        def _fn(z, output_units, **condition_kwargs):
-            x_data = condition_kwargs['x_data']
-                            
-            if tensorshape_util.rank(z.shape) == 1:
-                z = z[tf.newaxis, ...]
-                reshape_output = lambda y: y[0]
-            else:
-                reshape_output = lambda y: y
-            
-            nlayers = len(hidden_layers)
-            units_1 = hidden_layers[0]
-            W = tf1_net(x_data, num_layers=conditioner_num_layers, units=(self.D//2*units_1))
-            b = tf1_net(x_data, num_layers=conditioner_num_layers, units=units_1)
-            W = tf.reshape(W, (units_1, self.D//2))    
-            z = tf.tanh(tf.linalg.matvec(W, z) + b)
-            
-            for i in range(1,nlayers):
-                W = tf1_net(x_data, num_layers=conditioner_num_layers, units=(hidden_layers[i-1]*hidden_layers[i]))
-                b = tf1_net(x_data, num_layers=conditioner_num_layers, units=hidden_layers[i])
-                W = tf.reshape(W, (hidden_layers[i], hidden_layers[i-1]))
-                z = tf.tanh(tf.linalg.matvec(W, z) + b)
-                
-            W = tf1_net(x_data, num_layers=conditioner_num_layers, units=(hidden_layers[-1]*self.D//2))
-            b = tf1_net(x_data, num_layers=conditioner_num_layers, units=self.D//2)
-            W = tf.reshape(W, (self.D//2, hidden_layers[-1]))
-            z_out = tf.tanh(tf.linalg.matvec(W, z) + b)
-            
-            shift, log_scale = tf.split(z_out, 2, axis=-1)
-            v1 = reshape_output(shift)
-            v2 = reshape_output(log_scale)
-            return v1, v2
-             
-        return tf1.make_template('real_nvp_template', _fn)
-        
+
     def __call__(self, N, **kwargs):
-        return self.dist.sample(N, **kwargs)
-    
+        return self._dist(**kwargs).sample(N)
+
     def log_prob(self, z, **kwargs):
-        return self.dist.log_prob(z, **kwargs)
+        return self._dist(**kwargs).log_prob(z)
 
     def plot_dist(self, N=100, **kwargs):
         z = self(N, **kwargs)
@@ -786,15 +1982,13 @@ class ConditionedNormFlow(tf.keras.Model):
         g = g.map_lower(sns.kdeplot)
         return g
 
-        
-        
     def _set_D(self, D):
         if type(D) is not int:
             raise TypeError(format_type_err_msg(self, "D", D, int))
         elif D < 2:
             raise ValueError("NormalizingFlow D %d must be greater than 0." % D)
         self.D = D
-        
+
     def _set_num_layers(self, num_layers):
         if type(num_layers) is not int:
             raise TypeError(format_type_err_msg(self, "num_layers", num_layers, int))
@@ -812,3 +2006,12 @@ class ConditionedNormFlow(tf.keras.Model):
                 "NormalizingFlow num_units %d must be greater than 0." % num_units
             )
         self.num_units = num_units
+
+    def _set_num_stages(self, num_stages):
+        if type(num_stages) is not int:
+            raise TypeError(format_type_err_msg(self, "num_stages", num_stages, int))
+        elif num_stages < 1:
+            raise ValueError(
+                "ConditionedNormFlow num_stages %d must be greater than 0." % num_stages
+            )
+        self.num_stages = num_stages
@@ -4,6 +4,12 @@ import numpy as np
 import tensorflow as tf
 import pickle
 import os
+import inspect
+import hashlib
+import json
+import shutil
+import time
+from contextlib import contextmanager
 import matplotlib
 from matplotlib import animation
 import matplotlib.pyplot as plt
@@ -12,6 +18,27 @@ import pandas as pd
 from sklearn.neighbors import KernelDensity
 from epi.error_formatters import format_type_err_msg
 
+try:
+    import fcntl
+except ImportError:  # Locks are not taken on platforms without fcntl.
+    fcntl = None
+
+# tf.function renamed experimental_compile to jit_compile in later versions.
+if "jit_compile" in inspect.signature(tf.function).parameters:
+    XLA_KWARG = "jit_compile"
+else:
+    XLA_KWARG = "experimental_compile"
+XLA_ERRORS = (
+    tf.errors.InvalidArgumentError,
+    tf.errors.UnimplementedError,
+    tf.errors.NotFoundError,
+    tf.errors.InternalError,
+)
+
+# Directory of cached initializations and the size cap of its contents.
+INIT_CACHE_DIR = "./data/inits/"
+INIT_CACHE_MAX_BYTES = 2 ** 30
+
 
 def gaussian_backward_mapping(mu, Sigma):
     """Calculates natural parameter of multivaraite gaussian from mean and cov.
@@ -130,15 +157,25 @@ def array_str(a):
     return array_str
 
 
-def init_path(arch_string, init_type, init_params):
+def init_path(arch_string, init_type, init_params, method="reverse_KL", tol=None):
     """Deduces initialization file path from initialization type and parameters.
 
+    The directory in :obj:`epi.util.INIT_CACHE_DIR` is named by a hash of the
+    architecture string, initialization type, parameters, objective and early
+    stopping tolerance, so its length does not grow with the dimensionality of
+    the parameters.  The cache index
+    (see :obj:`epi.util.update_init_cache`) maps it back to the architecture.
+
     :param arch_string: Architecture string of normalizing flow.
     :type arch_string: str
-    :param init_type: Initialization type \in ['iso_gauss']
+    :param init_type: Initialization type \in ['iso_gauss', 'gaussian']
     :type init_type: str
     :param init_param: init_type dependent parameters for initialization (more deets)
     :type dict: 
+    :param method: Initialization objective (see :obj:`epi.normalizing_flows.NormalizingFlow.initialize`), defaults to :obj:`'reverse_KL'`.
+    :type method: str, optional
+    :param tol: Early stopping tolerance of the initialization, defaults to None.
+    :type tol: float, optional
 
     :return: Initialization save path.
     :rtype: str
@@ -152,8 +189,9 @@ def init_path(arch_string, init_type, init_params):
             format_type_err_msg("epi.util.init_path", "init_type", init_type, str)
         )
 
-    path = "./data/" + arch_string + "/"
-
+    key = hashlib.sha1((arch_string + "_" + init_type + "_" + method).encode())
+    if tol is not None:
+        key.update(("_tol=%.8E" % tol).encode())
     if init_type == "iso_gauss":
         if "loc" in init_params:
             loc = init_params["loc"]
@@ -163,7 +201,7 @@ def init_path(arch_string, init_type, init_params):
             scale = init_params["scale"]
         else:
             raise ValueError("'scale' field not in init_param for %s." % init_type)
-        path += init_type + "_loc=%.2E_scale=%.2E/" % (loc, scale)
+        key.update(("_loc=%.8E_scale=%.8E" % (loc, scale)).encode())
     elif init_type == "gaussian":
         if "mu" in init_params:
             mu = np_column_vec(init_params["mu"])[:, 0]
@@ -174,17 +212,133 @@ def init_path(arch_string, init_type, init_params):
         else:
             raise ValueError("'Sigma' field not in init_param for %s." % init_type)
         D = mu.shape[0]
-        mu_str = array_str(mu)
-        Sigma_str = array_str(Sigma[np.triu_indices(D, 0)])
-        path += init_type + "_mu=%s_Sigma=%s/" % (mu_str, Sigma_str)
+        key.update(mu.astype(np.float64).tobytes())
+        Sigma_triu = np.asarray(Sigma)[np.triu_indices(D, 0)]
+        key.update(Sigma_triu.astype(np.float64).tobytes())
 
+    path = INIT_CACHE_DIR + key.hexdigest()[:16] + "/"
     if not os.path.exists(path):
         os.makedirs(path)
 
     return path
 
 
-def aug_lag_vars(z, log_q_z, eps, mu, N):
+@contextmanager
+def file_lock(path, blocking=True):
+    """Exclusive lock across processes on the lock file of a path.
+
+    A lock file removed by its holder (see :obj:`epi.util.update_init_cache`)
+    is created again by the processes waiting for it.
+
+    :param path: Path of the locked file or directory.
+    :type path: str
+    :param blocking: Wait for the lock, defaults to True.
+    :type blocking: bool, optional
+    :return: Context manager yielding whether the lock was acquired.
+    :rtype: contextlib.contextmanager
+    """
+    if fcntl is None:
+        yield True
+        return
+    lock_path = path.rstrip("/") + ".lock"
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    while True:
+        lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            lock_file.close()
+            yield False
+            return
+        # Retry if the lock file was removed while waiting for it.
+        try:
+            inode = os.stat(lock_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode == os.fstat(lock_file.fileno()).st_ino:
+            break
+        lock_file.close()
+    try:
+        yield True
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _dir_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+def update_init_cache(path, arch_string, init_type, max_bytes=None):
+    """Records use of a cached initialization and evicts the least recently used.
+
+    The index :obj:`index.json` of :obj:`epi.util.INIT_CACHE_DIR` holds the
+    architecture string, initialization type, size and time of last use of each
+    initialization.  Least recently used initializations other than path are
+    deleted with their lock files until the cache holds at most max_bytes,
+    skipping those locked by another process (e.g. while they are trained).
+
+    :param path: Initialization save path (see :obj:`epi.util.init_path`).
+    :type path: str
+    :param arch_string: Architecture string of normalizing flow.
+    :type arch_string: str
+    :param init_type: Initialization type.
+    :type init_type: str
+    :param max_bytes: Size cap of the cache, defaults to :obj:`epi.util.INIT_CACHE_MAX_BYTES`.
+    :type max_bytes: int, optional
+    :return: Keys of the evicted initializations.
+    :rtype: list
+    """
+    if max_bytes is None:
+        max_bytes = INIT_CACHE_MAX_BYTES
+    index_file = INIT_CACHE_DIR + "index.json"
+    key = os.path.basename(path.rstrip("/"))
+    evicted = []
+    if not os.path.exists(INIT_CACHE_DIR):
+        os.makedirs(INIT_CACHE_DIR)
+    with file_lock(index_file):
+        if os.path.exists(index_file):
+            with open(index_file, "r") as f:
+                index = json.load(f)
+        else:
+            index = {}
+        index = {k: v for k, v in index.items() if os.path.exists(INIT_CACHE_DIR + k)}
+        index[key] = {
+            "arch_string": arch_string,
+            "init_type": init_type,
+            "size": _dir_size(path),
+            "last_used": time.time(),
+        }
+
+        total_size = sum([entry["size"] for entry in index.values()])
+        lru_keys = sorted(index.keys(), key=lambda k: index[k]["last_used"])
+        for lru_key in lru_keys:
+            if total_size <= max_bytes:
+                break
+            if lru_key == key:
+                continue
+            lru_path = INIT_CACHE_DIR + lru_key + "/"
+            with file_lock(lru_path, blocking=False) as acquired:
+                if not acquired:
+                    continue
+                shutil.rmtree(lru_path, ignore_errors=True)
+                if os.path.exists(lru_path[:-1] + ".lock"):
+                    os.remove(lru_path[:-1] + ".lock")
+            total_size -= index.pop(lru_key)["size"]
+            evicted.append(lru_key)
+
+        # Replace the index atomically for readers without the lock.
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(index_file + ".tmp", index_file)
+    return evicted
+
+
+def aug_lag_vars(z, log_q_z, eps, mu, N, T_x=None):
     """Calculate augmented lagrangian variables requiring gradient tape.
 
     :math:`H(\\theta) = \\mathbb{E}_{z \\sim q_\\theta}[-\\log(q_\\theta(z)]`
@@ -208,16 +362,18 @@ def aug_lag_vars(z, log_q_z, eps, mu, N):
     :type mu: np.ndarray
     :param N: Number of batch samples.
     :type N: int
+    :param T_x: Emergent property statistics of z if already computed, defaults to eps(z).
+    :type T_x: tf.Tensor, optional
     :return: :math:`H(\\theta)`, :math:`R(\\theta)`, list :math:`R_1(\\theta)` by dimension, and :math:`R_2(\\theta)`.
     :rtype: list
 
     """
     H = -tf.reduce_mean(log_q_z)
-    T_x = eps(z)
+    if T_x is None:
+        T_x = eps(z)
     clip_lb = -1e10 * tf.ones_like(T_x, dtype=tf.float32)
     clip_ub = 1e10 * tf.ones_like(T_x, dtype=tf.float32)
     T_x = tf.clip_by_value(T_x, clip_lb, clip_ub)
-    print(T_x.shape, mu.shape)
     R = tf.reduce_mean(T_x, axis=0) - mu
     R1s = tf.unstack(tf.reduce_mean(T_x[: N // 2, :], 0) - mu, axis=0)
     R2 = tf.reduce_mean(T_x[N // 2 :, :], 0) - mu
@@ -265,6 +421,356 @@ def unbiased_aug_grad(R1s, R2, params, tape):
     return [tf.linalg.matvec(jacR1i, R2) for jacR1i in jacR1]
 
 
+def aug_lag_surrogate(H, R, R1s, R2, eta, c, symmetric=False):
+    """Scalar surrogate of the augmented Lagrangian for single-pass gradients.
+
+    :math:`\\tilde{L}(\\theta) = -H(\\theta) + \\eta^\\top R(\\theta) + c R_1(\\theta)^\\top \\bot(R_2(\\theta))`
+
+    where :math:`\\bot` stops the gradient.  The gradient of the surrogate is
+
+    :math:`\\nabla_\\theta \\tilde{L}(\\theta) = -\\nabla_\\theta H(\\theta) + \\nabla_\\theta R(\\theta)^\\top \\eta + c \\nabla_\\theta R_1(\\theta) \\cdot R_2(\\theta)`
+
+    which is the same unbiased estimator as :obj:`epi.util.unbiased_aug_grad`,
+    but requires only one backward pass through a non-persistent tape rather
+    than :math:`m+2`.  The value of the surrogate is not the augmented
+    Lagrangian cost.
+
+    The symmetric estimator averages the roles of the two halves,
+
+    :math:`\\frac{c}{2} \\left( R_1(\\theta)^\\top \\bot(R_2(\\theta)) + R_2(\\theta)^\\top \\bot(R_1(\\theta)) \\right)`
+
+    which is also unbiased, and has lower variance since each half of the
+    batch contributes to the gradient.
+
+    :param H: Entropy of :math:`q_\\theta`.
+    :type H: tf.Tensor
+    :param R: Mean constraint violation.
+    :type R: tf.Tensor
+    :param R1s: Mean constraint violation over first half of samples.
+    :type R1s: list
+    :param R2: Mean constraint violation over the second half of samples.
+    :type R2: tf.Tensor
+    :param eta: Lagrange multipliers.
+    :type eta: tf.Tensor
+    :param c: Augmented Lagrangian coefficient.
+    :type c: tf.Tensor
+    :param symmetric: Use the symmetric estimator of the augmented term, defaults to False.
+    :type symmetric: bool, optional
+    :return: Surrogate loss.
+    :rtype: tf.Tensor
+    """
+    R1 = tf.stack(R1s, axis=0)
+    lagrange_dot = tf.reduce_sum(tf.multiply(eta, R))
+    # As in unbiased_aug_grad, the factor of 2 cancels with c/2.
+    aug_dot = tf.reduce_sum(tf.multiply(R1, tf.stop_gradient(R2)))
+    if symmetric:
+        aug_dot += tf.reduce_sum(tf.multiply(tf.stop_gradient(R1), R2))
+        aug_dot = aug_dot / 2.0
+    return -H + lagrange_dot + c * aug_dot
+
+
+def grad_snr(gradients1, gradients2):
+    """Signal-to-noise ratio of a gradient estimate from two independent halves.
+
+    For independent gradient estimates :math:`g_1` and :math:`g_2` of the two
+    halves of a batch, the noise of their mean :math:`\\bar{g}` is estimated by
+
+    :math:`\\hat{\\sigma}^2 = \\frac{1}{4} ||g_1 - g_2||^2`
+
+    and the signal-to-noise ratio by
+
+    :math:`\\max\\left(\\frac{||\\bar{g}||^2}{\\hat{\\sigma}^2} - 1, 0\\right)`
+
+    where subtracting 1 removes the noise from the squared norm of the mean.
+    The ratio grows linearly with the batch size.
+
+    :param gradients1: Gradients of the first half of the batch.
+    :type gradients1: list
+    :param gradients2: Gradients of the second half of the batch.
+    :type gradients2: list
+    :return: Gradient signal-to-noise ratio.
+    :rtype: tf.Tensor
+    """
+    g1 = tf.concat([tf.reshape(g, [-1]) for g in gradients1], 0)
+    g2 = tf.concat([tf.reshape(g, [-1]) for g in gradients2], 0)
+    noise = tf.reduce_sum(tf.square(g1 - g2)) / 4.0
+    signal = tf.reduce_sum(tf.square((g1 + g2) / 2.0))
+    return tf.maximum(signal / noise - 1.0, 0.0)
+
+
+def adapt_batch_size(N_buckets, N, snr, target_snr):
+    """Batch size bucket following a gradient signal-to-noise ratio estimate.
+
+    Moves at most one bucket per call.  The batch size grows if the ratio is
+    below target_snr, and shrinks if the ratio predicted at the next smaller
+    bucket is at least twice target_snr, assuming it is proportional to the
+    batch size.  The margin keeps the batch size from oscillating.
+
+    :param N_buckets: Sorted batch sizes.
+    :type N_buckets: list
+    :param N: Current batch size in N_buckets.
+    :type N: int
+    :param snr: Gradient signal-to-noise ratio at batch size N (see :obj:`epi.util.grad_snr`).
+    :type snr: float
+    :param target_snr: Target gradient signal-to-noise ratio.
+    :type target_snr: float
+    :return: Next batch size.
+    :rtype: int
+    """
+    ind = N_buckets.index(N)
+    if snr < target_snr:
+        return N_buckets[min(ind + 1, len(N_buckets) - 1)]
+    if ind > 0 and snr * N_buckets[ind - 1] / N >= 2.0 * target_snr:
+        return N_buckets[ind - 1]
+    return N
+
+
+def chunked_R_stats(T_x_batch, M, chunk_M, N_test, mu):
+    """Constraint violation statistics of an evaluation sample bank.
+
+    The bank of :math:`M` batches of :math:`N` samples is drawn and reduced
+    :obj:`chunk_M` batches at a time, so that at most :obj:`chunk_M` batches
+    of emergent property statistics are in memory.  Each batch gives the mean
+    constraint violation of its first :obj:`N_test` samples, and the squared
+    norm of the mean constraint violation of all of its samples.
+
+    :param T_x_batch: Function of a number of batches returning statistics of shape (batches, ..., N, m).
+    :type T_x_batch: function
+    :param M: Number of batches.
+    :type M: tf.Tensor
+    :param chunk_M: Number of batches per chunk.
+    :type chunk_M: int
+    :param N_test: Number of samples per batch of the mean constraint violation.
+    :type N_test: int
+    :param mu: Mean parameter of the emergent property.
+    :type mu: tf.Tensor
+    :return: Mean constraint violations (M, ..., m) and squared norms (M, ...).
+    :rtype: tf.Tensor, tf.Tensor
+    """
+    num_chunks = (M + chunk_M - 1) // chunk_M
+    R_means = tf.TensorArray(tf.float32, size=num_chunks, infer_shape=False)
+    norms = tf.TensorArray(tf.float32, size=num_chunks, infer_shape=False)
+
+    def body(j, R_means, norms):
+        T_x = T_x_batch(tf.minimum(chunk_M, M - j * chunk_M))
+        R_mean = tf.reduce_mean(T_x[..., :N_test, :], axis=-2) - mu
+        norm = tf.reduce_sum(tf.square(tf.reduce_mean(T_x, axis=-2) - mu), axis=-1)
+        return j + 1, R_means.write(j, R_mean), norms.write(j, norm)
+
+    # Run the chunks one at a time to bound memory.
+    _, R_means, norms = tf.while_loop(
+        lambda j, R_means, norms: j < num_chunks,
+        body,
+        (tf.constant(0), R_means, norms),
+        parallel_iterations=1,
+    )
+    return R_means.concat(), norms.concat()
+
+
+def checkpointed_loop(step, x, T, params=(), num_segments=None, return_all=False):
+    """Iterates :obj:`x = step(x, *params)` T times with sublinear memory.
+
+    The T steps are split into segments whose activations are recomputed
+    during the backward pass with :obj:`tf.recompute_grad`, so that only
+    the segment boundaries are held between the forward and backward pass.
+    With the default :math:`\\sqrt{T}` segments, activation memory grows as
+    :math:`O(\\sqrt{T})` rather than :math:`O(T)`.  Tensors the step
+    depends on must be passed in params to receive gradients.
+
+    :param step: Function of the state and params returning the next state.
+    :type step: function
+    :param x: Initial state.
+    :type x: tf.Tensor
+    :param T: Number of steps.
+    :type T: int
+    :param params: Tensors passed to each step, defaults to ().
+    :type params: tuple, optional
+    :param num_segments: Number of recomputed segments, defaults to :math:`\\sqrt{T}`.
+    :type num_segments: int, optional
+    :param return_all: Return all T+1 states stacked on the first axis, defaults to False.
+    :type return_all: bool, optional
+    :return: Final state, or all states if return_all.
+    :rtype: tf.Tensor
+    """
+    if num_segments is None:
+        num_segments = max(1, int(np.round(np.sqrt(T))))
+    num_segments = min(num_segments, T)
+    bounds = np.linspace(0, T, num_segments + 1).astype(int)
+
+    def segment(num_steps):
+        def segment_fn(x, *params):
+            xs = []
+            for t in range(num_steps):
+                x = step(x, *params)
+                xs.append(x)
+            if return_all:
+                return tf.stack(xs, axis=0)
+            return x
+
+        return tf.recompute_grad(segment_fn)
+
+    xs = [x[tf.newaxis]]
+    for t1, t2 in zip(bounds[:-1], bounds[1:]):
+        x = segment(t2 - t1)(x, *params)
+        if return_all:
+            xs.append(x)
+            x = x[-1]
+    if return_all:
+        return tf.concat(xs, axis=0)
+    return x
+
+
+def tf_compile(fn, jit_compile=False, input_signature=None, trace_counts=None):
+    """Wraps a python function as a :obj:`tf.function`, optionally compiled with XLA.
+
+    If XLA compilation of the function fails (e.g. an op without an XLA
+    kernel such as a complex square root), a warning is printed and all
+    subsequent calls run the uncompiled :obj:`tf.function`.  Compilation
+    happens on the first call of each trace, so errors raised by later calls
+    of a trace that has already run compiled (e.g. failed numerical checks)
+    are re-raised.
+
+    :param fn: Python function to trace.
+    :type fn: function
+    :param jit_compile: Compile the function with XLA, defaults to False.
+    :type jit_compile: bool, optional
+    :param input_signature: Input signature of the :obj:`tf.function`, defaults to None.
+    :type input_signature: list, optional
+    :param trace_counts: Dictionary in which the number of traces of the function is counted by function name, defaults to None.
+    :type trace_counts: dict, optional
+    :return: Compiled function.
+    :rtype: function
+    """
+    if trace_counts is not None:
+        trace_counts[fn.__name__] = trace_counts.get(fn.__name__, 0)
+        _py_fn = fn
+
+        def fn(*args):
+            # Python side effects only run when the function is traced.
+            trace_counts[_py_fn.__name__] += 1
+            return _py_fn(*args)
+
+        fn.__name__ = _py_fn.__name__
+
+    graph_fn = tf.function(fn, input_signature=input_signature)
+    if not jit_compile:
+        return graph_fn
+
+    xla_fn = tf.function(fn, input_signature=input_signature, **{XLA_KWARG: True})
+    compiled = {"fn": xla_fn, "traces": set()}
+
+    def _trace_key(args):
+        # Without an input signature, each argument shape (and python value)
+        # is traced and compiled separately.
+        if input_signature is not None:
+            return None
+        return tuple(
+            [
+                (tuple(arg.shape), arg.dtype) if hasattr(arg, "shape") else arg
+                for arg in args
+            ]
+        )
+
+    def _fn(*args):
+        if compiled["fn"] is xla_fn:
+            trace_key = _trace_key(args)
+            try:
+                out = xla_fn(*args)
+            except XLA_ERRORS as e:
+                if trace_key in compiled["traces"]:
+                    raise
+                print(
+                    "XLA compilation of %s failed, running uncompiled: %s"
+                    % (fn.__name__, e.message.split("\n")[0]),
+                    flush=True,
+                )
+                compiled["fn"] = graph_fn
+            else:
+                compiled["traces"].add(trace_key)
+                return out
+        return graph_fn(*args)
+
+    _fn.__name__ = fn.__name__
+    return _fn
+
+
+class OptLog:
+    """Preallocated columnar log of optimization data.
+
+    Rows are written into a numpy buffer, which is converted to a
+    :obj:`pandas.DataFrame` only by :obj:`epi.util.OptLog.to_df`.  Missing
+    values are stored as nan.  The buffer doubles in size when full.
+
+    :param columns: Column names.
+    :type columns: list
+    :param capacity: Number of preallocated rows, defaults to 100.
+    :type capacity: int, optional
+    :param int_columns: Columns converted to int, defaults to [].
+    :type int_columns: list, optional
+    :param bool_columns: Columns converted to bool (None if missing), defaults to [].
+    :type bool_columns: list, optional
+    """
+
+    def __init__(self, columns, capacity=100, int_columns=[], bool_columns=[]):
+        self.columns = list(columns)
+        self.int_columns = int_columns
+        self.bool_columns = bool_columns
+        self._col_inds = {col: j for j, col in enumerate(self.columns)}
+        self._data = np.full((max(capacity, 1), len(self.columns)), np.nan)
+        self.size = 0
+
+    def append(self, **values):
+        """Appends a row.  Columns not given are missing.
+
+        :param values: Value by column name.
+        :type values: dict
+        """
+        if self.size == self._data.shape[0]:
+            self._data = np.concatenate((self._data, np.full_like(self._data, np.nan)))
+        row = self._data[self.size]
+        for col, value in values.items():
+            row[self._col_inds[col]] = value
+        self.size += 1
+
+    def append_df(self, df):
+        """Appends the rows of a data frame of logged optimization data.
+
+        Missing values and columns not in the data frame are stored as nan.
+
+        :param df: Optimization data, e.g. from :obj:`epi.util.OptLog.to_df`.
+        :type df: pandas.DataFrame
+        """
+        for _, df_row in df.iterrows():
+            values = {}
+            for col in self.columns:
+                if col in df_row and not pd.isnull(df_row[col]):
+                    values[col] = float(df_row[col])
+            self.append(**values)
+
+    def column(self, col):
+        """Logged values of a column.
+
+        :param col: Column name.
+        :type col: str
+        :return: View of the logged column values.
+        :rtype: np.ndarray
+        """
+        return self._data[: self.size, self._col_inds[col]]
+
+    def to_df(self,):
+        """Converts the log to a data frame.
+
+        :return: Logged optimization data.
+        :rtype: pandas.DataFrame
+        """
+        df = pd.DataFrame(self._data[: self.size].copy(), columns=self.columns)
+        for col in self.int_columns:
+            df[col] = df[col].astype(int)
+        for col in self.bool_columns:
+            df[col] = [None if np.isnan(x) else bool(x) for x in df[col]]
+        return df
+
+
 class AugLagHPs:
     """Augmented Lagrangian optimization hyperparamters.
 
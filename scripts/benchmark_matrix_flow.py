@@ -0,0 +1,52 @@
+"""Benchmark Kronecker coupling flows against dense coupling on matrix parameters. """
+
+from epi.models import Model, Parameter
+import numpy as np
+import tensorflow as tf
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--ns", type=int, nargs="+", default=[10, 20, 30])
+parser.add_argument("--num_stages", type=int, default=3)
+parser.add_argument("--num_iters", type=int, default=500)
+parser.add_argument("--N", type=int, default=500)
+args = parser.parse_args()
+
+print(
+    "%6s %20s %12s %12s %10s"
+    % ("n", "arch_type", "num_params", "s/it", "converged")
+)
+for n in args.ns:
+    # n x n matrix with i.i.d. standard normal element statistics.
+    W = Parameter("W", n * n, lb=-10.0, ub=10.0)
+    M = Model("matrix_%d" % n, [W])
+
+    def matrix_stats(W):
+        W = tf.reshape(W, (-1, n, n))
+        mean_diag = tf.linalg.trace(W) / n
+        mean_sq = tf.reduce_sum(tf.square(W), axis=[1, 2]) / (n * n)
+        return tf.stack([mean_diag, mean_sq, tf.square(mean_diag)], axis=1)
+
+    M.set_eps(matrix_stats)
+    mu = np.array([0.0, 1.0, 1.0 / n])
+
+    for arch_type in ["coupling", "kronecker_coupling"]:
+        q_theta, opt_df, save_path, _ = M.epi(
+            mu,
+            arch_type=arch_type,
+            num_stages=args.num_stages,
+            batch_norm=False,
+            K=1,
+            num_iters=args.num_iters,
+            N=args.N,
+            c0=1e-3,
+            matrix_shape=(n, n) if arch_type == "kronecker_coupling" else None,
+        )
+        num_params = sum(
+            [np.prod(v.shape) for v in q_theta.nf.trainable_variables]
+        )
+        time_per_it = np.load(save_path + "timing.npz")["time_per_it"]
+        print(
+            "%6d %20s %12d %12.2E %10s"
+            % (n, arch_type, num_params, time_per_it, str(opt_df["converged"].any()))
+        )
@@ -0,0 +1,67 @@
+"""Benchmark spline coupling flows against real NVP flows at matched entropy. """
+
+from epi.models import Model, Parameter
+from epi.example_eps import linear2D_freq
+import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num_stages", type=int, default=4)
+parser.add_argument("--num_bins", type=int, default=8)
+parser.add_argument("--K", type=int, default=4)
+parser.add_argument("--num_iters", type=int, default=1000)
+parser.add_argument("--N", type=int, default=500)
+parser.add_argument("--H_tol", type=float, default=0.05)
+args = parser.parse_args()
+
+# Define the 2D LDS model.
+lb = -10.0
+ub = 10.0
+a11 = Parameter("a11", 1, lb=lb, ub=ub)
+a12 = Parameter("a12", 1, lb=lb, ub=ub)
+a21 = Parameter("a21", 1, lb=lb, ub=ub)
+a22 = Parameter("a22", 1, lb=lb, ub=ub)
+params = [a11, a12, a21, a22]
+M = Model("lds_2D", params)
+M.set_eps(linear2D_freq)
+mu = np.array([0.0, 0.5 ** 2, 2 * np.pi, (0.1 * 2 * np.pi) ** 2])
+
+
+def run(arch_type, num_stages):
+    q_theta, opt_df, save_path, _ = M.epi(
+        mu,
+        arch_type=arch_type,
+        num_stages=num_stages,
+        num_bins=args.num_bins,
+        K=args.K,
+        num_iters=args.num_iters,
+        N=args.N,
+        c0=1e-3,
+    )
+    # Entropy of a large sample of the optimized distribution.
+    z, log_q_z = q_theta.nf(10000)
+    H = -np.mean(log_q_z.numpy())
+    time_per_it = np.load(save_path + "timing.npz")["time_per_it"]
+    return H, time_per_it, bool(opt_df["converged"].any())
+
+
+H_nvp, time_nvp, conv_nvp = run("coupling", args.num_stages)
+print("%8s %10s %10s %12s %10s" % ("arch", "stages", "H", "s/it", "converged"))
+print(
+    "%8s %10d %10.3f %12.2E %10s"
+    % ("C", args.num_stages, H_nvp, time_nvp, str(conv_nvp))
+)
+
+# Fewest spline stages matching the real NVP entropy.
+for num_stages in range(1, args.num_stages + 1):
+    H, time_per_it, conv = run("spline", num_stages)
+    print(
+        "%8s %10d %10.3f %12.2E %10s"
+        % ("RQS", num_stages, H, time_per_it, str(conv))
+    )
+    if conv and H >= H_nvp - args.H_tol:
+        print(
+            "%d spline stages match %d real NVP stages with %.2fx time per iteration."
+            % (num_stages, args.num_stages, time_per_it / time_nvp)
+        )
+        break
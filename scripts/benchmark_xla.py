@@ -0,0 +1,48 @@
+"""Benchmark XLA-compiled EPI training against uncompiled graphs. """
+
+from epi.models import Model, Parameter
+from epi.example_eps import linear2D_freq
+import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--num_iters", type=int, default=500)
+parser.add_argument("--N", type=int, default=500)
+args = parser.parse_args()
+
+# Define the 2D LDS model.
+lb = -10.0
+ub = 10.0
+a11 = Parameter("a11", 1, lb=lb, ub=ub)
+a12 = Parameter("a12", 1, lb=lb, ub=ub)
+a21 = Parameter("a21", 1, lb=lb, ub=ub)
+a22 = Parameter("a22", 1, lb=lb, ub=ub)
+params = [a11, a12, a21, a22]
+M = Model("lds_2D", params)
+M.set_eps(linear2D_freq)
+mu = np.array([0.0, 0.5 ** 2, 2 * np.pi, (0.1 * 2 * np.pi) ** 2])
+
+arch_types = ["coupling", "autoregressive", "inverse_autoregressive"]
+times = {}
+for arch_type in arch_types:
+    for jit_compile in [False, True]:
+        _, _, save_path, _ = M.epi(
+            mu,
+            arch_type=arch_type,
+            K=1,
+            num_iters=args.num_iters,
+            N=args.N,
+            c0=1e-3,
+            jit_compile=jit_compile,
+        )
+        time_per_it = np.load(save_path + "timing.npz")["time_per_it"]
+        times[(arch_type, jit_compile)] = time_per_it
+
+print("%22s %14s %14s %10s" % ("arch_type", "graph s/it", "XLA s/it", "speedup"))
+for arch_type in arch_types:
+    graph_time = times[(arch_type, False)]
+    xla_time = times[(arch_type, True)]
+    print(
+        "%22s %14.2E %14.2E %9.2fx"
+        % (arch_type, graph_time, xla_time, graph_time / xla_time)
+    )
@@ -2,7 +2,7 @@
 
 from epi.models import Model, Parameter
 from epi.example_eps import linear2D_freq
-from epi.util import sample_aug_lag_hps
+from epi.util import sample_aug_lag_hps, checkpointed_loop
 import numpy as np
 import tensorflow as tf
 import argparse
@@ -14,6 +14,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--n', type=int)
 parser.add_argument('--T', type=int)
 parser.add_argument('--traj', type=int)
+parser.add_argument('--remat', type=int, default=0)
 args = parser.parse_args()
 
 num_neurons = args.n
@@ -24,8 +25,14 @@ elif (args.traj==0):
     full_traj = False
 else:
     raise ValueError('--traj must be 0 or 1')
+if (args.remat==1):
+    remat = True
+elif (args.remat==0):
+    remat = False
+else:
+    raise ValueError('--remat must be 0 or 1')
 
-print(num_neurons, T, full_traj)
+print(num_neurons, T, full_traj, remat)
 # 1. Define model: dxd matrix
 D = num_neurons**2
 lb = -2.*np.ones((D,), np.float32)
@@ -39,6 +46,9 @@ M = Model('RNN_n=%d_T=%d' % (num_neurons, T), params)
 x0 = tf.constant(np.random.normal(0., 1., (1, num_neurons,1)), dtype=tf.float32)
 w = tf.constant(np.random.normal(0., 1., (num_neurons,)), tf.float32)
 
+def rnn_step(x, J):
+    return x + tf.tanh(tf.matmul(J, x))
+
 if (full_traj):
     targ = np.expand_dims(np.sin(4*np.pi*np.arange(T+1)/T), 0)
     def sim(J):
@@ -47,12 +57,17 @@ if (full_traj):
         J = tf.reshape(J, (N, num_neurons, num_neurons))
         
         x = tf.tile(x0, (N,1,1))
-        xs = [x]
-        for t in range(T):
-            x = x + tf.tanh(tf.matmul(J, x))
-            xs.append(x)
-        
-        x = tf.concat(xs, axis=2)
+        if (remat):
+            # (T+1, N, n, 1) -> (N, n, T+1)
+            xs = checkpointed_loop(rnn_step, x, T, (J,), return_all=True)
+            x = tf.transpose(xs[:, :, :, 0], [1, 2, 0])
+        else:
+            xs = [x]
+            for t in range(T):
+                x = rnn_step(x, J)
+                xs.append(x)
+            x = tf.concat(xs, axis=2)
+
         out = tf.reduce_sum(tf.square(tf.tensordot(x, w, [[1], [0]]) - targ), axis=1)
         T_x = tf.stack((out, tf.square(out)), axis=1)
         return T_x
@@ -66,9 +81,12 @@ else:
         N = J_shape[0]
         J = tf.reshape(J, (N, num_neurons, num_neurons))
 
-        x = x0
-        for t in range(T):
-            x = x + tf.tanh(tf.matmul(J, x))
+        x = tf.tile(x0, (N,1,1))
+        if (remat):
+            x = checkpointed_loop(rnn_step, x, T, (J,))
+        else:
+            for t in range(T):
+                x = rnn_step(x, J)
 
         out = tf.tensordot(x, w, [[1], [0]])
         T_x = tf.concat((out, tf.square(out)), axis=1)
@@ -84,4 +102,5 @@ q_theta, opt_data, save_path, flg = M.epi(
     num_iters=10,
     c0=1e-3,
     verbose=True,
+    remat="eps" if remat else None,
 )
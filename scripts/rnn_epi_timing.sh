@@ -6,4 +6,4 @@
 #SBATCH --mem-per-cpu=2gb
 
 source activate epi
-python3 rnn_epi_timing.py --n $1 --T $2 --traj $3
+python3 rnn_epi_timing.py --n $1 --T $2 --traj $3 --remat ${4:-0}
@@ -1,10 +1,11 @@
 """Run EPI on oscillating 2D LDS. """
 
-from epi.models import Model, Parameter
+from epi.models import Model, SymmetricParameter
 from epi.example_eps import linear2D_freq
 from epi.util import sample_aug_lag_hps
 import numpy as np
 import tensorflow as tf
+import tensorflow_probability as tfp
 import argparse
 
 DTYPE = np.float32
@@ -19,15 +20,15 @@ print('Running epi for matrix determinant with hyper parameter random seed %d.'
 d = args.d
 
 
-# 1. Define model: dxd matrix
+# 1. Define model: dxd symmetric matrix with d(d+1)/2 free elements.
+# Off-diagonal elements lie in [-2, 2] and diagonal elements in [-4, 4].
 D = int(d*(d+1)/2)
-
-# Set up the bound vectors.
+diag_inds = np.diag(tfp.math.fill_triangular(np.arange(D)).numpy())
 lb = -2.*np.ones((D,))
 ub = 2.*np.ones((D,))
-
-# Define the parameter A.
-A = Parameter("A", D, lb=lb, ub=ub)
+lb[diag_inds] = -4.
+ub[diag_inds] = 4.
+A = SymmetricParameter("A", d, lb=lb, ub=ub)
 parameters = [A]
 
 # Define the model matrix.
@@ -37,9 +38,6 @@ M = Model("matrix", parameters)
 mu = np.array([d, 0., 1., 1.], dtype=DTYPE)
 
 def trace_det(A):
-    diag_div = tf.expand_dims(tf.eye(d), 0) + 1.
-    A_lower = tfp.math.fill_triangular(A)
-    A = (A_lower + tf.transpose(A_lower, [0, 2, 1]))
     e, v = tf.linalg.eigh(A)
     trace = tf.reduce_sum(e, axis=1)
     det = tf.reduce_prod(e, axis=1)
@@ -54,7 +52,7 @@ num_layers = 2 #np.random.randint(1, 3)
 num_units = D #np.random.randint(15, max(30, D))
 
 init_params = {'loc':0., 'scale':1.}
-q_theta, opt_data, save_path = M.epi(
+q_theta, opt_data, save_path, failed = M.epi(
     mu, 
     arch_type='coupling', 
     num_stages=num_stages,
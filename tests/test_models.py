@@ -5,7 +5,21 @@ import tensorflow as tf
 import scipy.stats
 import pandas as pd
 import os
-from epi.models import Parameter, Model, Distribution
+import gc
+from epi.models import (
+    Parameter,
+    StructuredParameter,
+    SymmetricParameter,
+    PSDParameter,
+    DiagonalParameter,
+    SimplexParameter,
+    SparseMatrixParameter,
+    Model,
+    Distribution,
+    AmortizedDistribution,
+    clear_epi_graph_cache,
+    _EPI_GRAPH_CACHE,
+)
 from epi.normalizing_flows import NormalizingFlow
 from epi.util import AugLagHPs
 from epi.example_eps import linear2D_freq
@@ -51,6 +65,110 @@ def test_Parameter_init():
     return None
 
 
+def test_StructuredParameter():
+    N = 50
+    n = 3
+    x = StructuredParameter("x", n, lb=-1.0, ub=1.0)
+    z = x.support_bijector().forward(tf.random.normal((N, n)))
+    assert np.array_equal(x.unpack(z).numpy(), z.numpy())
+    assert (np.abs(z.numpy()) < 1.0).all()
+
+    A = SymmetricParameter("A", n, lb=-2.0, ub=2.0)
+    assert A.D == 6 and A.shape == (3, 3)
+    assert (A.lb == -2.0).all() and (A.ub == 2.0).all()
+    z = tf.random.normal((N, A.D))
+    A_z = A.unpack(z).numpy()
+    assert A_z.shape == (N, n, n)
+    assert np.isclose(A_z, np.transpose(A_z, [0, 2, 1])).all()
+    A_tril = np.sort(A_z[0][np.tril_indices(n)])
+    assert np.isclose(A_tril, np.sort(z[0])).all()
+
+    P = PSDParameter("P", n)
+    assert P.D == 6
+    assert np.sum(P.lb == 0.0) == n and np.sum(np.isneginf(P.lb)) == P.D - n
+    z = P.support_bijector().forward(tf.random.normal((N, P.D)))
+    assert (np.linalg.eigvalsh(P.unpack(z).numpy()) > 0.0).all()
+
+    B = DiagonalParameter("B", n, lb=0.0)
+    z = tf.random.normal((N, n))
+    assert np.isclose(B.unpack(z), np.stack([np.diag(z_i) for z_i in z])).all()
+
+    p = SimplexParameter("p", 4)
+    assert p.D == 3 and p.shape == (4,)
+    z = p.support_bijector().forward(tf.random.normal((N, p.D)))
+    p_z = p.unpack(z).numpy()
+    assert (p_z > 0.0).all()
+    assert np.isclose(np.sum(p_z, axis=1), 1.0).all()
+
+    mask = np.array([[1, 0, 1], [0, 1, 0]])
+    J = SparseMatrixParameter("J", mask, lb=-1.0, ub=1.0)
+    assert J.D == 3 and J.shape == (2, 3)
+    z = tf.random.normal((N, J.D))
+    J_z = J.unpack(z).numpy()
+    assert J_z.shape == (N, 2, 3)
+    assert (J_z[:, mask == 0] == 0.0).all()
+    assert np.isclose(J_z[:, mask == 1], z).all()
+
+    with raises(TypeError):
+        SymmetricParameter("A", 2.0)
+    with raises(ValueError):
+        SymmetricParameter("A", 0)
+    with raises(ValueError):
+        SimplexParameter("p", 1)
+    with raises(TypeError):
+        SparseMatrixParameter("J", [[1, 0]])
+    with raises(ValueError):
+        SparseMatrixParameter("J", np.ones((2,)))
+    return None
+
+
+def test_Model_structured_parameters():
+    n = 2
+    A = SymmetricParameter("A", n, lb=-2.0, ub=2.0)
+    P = PSDParameter("P", n)
+    p = SimplexParameter("p", 3)
+    b = Parameter("b", 1, lb=0.0)
+    M = Model("structured", [A, P, p, b])
+    assert M.D == 3 + 3 + 2 + 1
+
+    def stats(A, P, p, b):
+        assert A.shape[1:] == (n, n)
+        assert P.shape[1:] == (n, n)
+        assert p.shape[1:] == (3,)
+        assert b.shape[1:] == (1,)
+        trace_A = tf.linalg.trace(A)
+        logdet_P = tf.linalg.logdet(P)
+        return tf.stack([trace_A, logdet_P, p[:, 0], b[:, 0]], axis=1)
+
+    M.set_eps(stats)
+    assert M.m == 4
+
+    support_mapping = M._support_mapping()
+    assert support_mapping.Ds == [3, 3, 2, 1]
+    # Without batch normalization, whose inverse uses batch statistics.
+    nf = M._epi_nf(batch_norm=False)
+    assert nf.D == M.D
+    assert nf.support_mapping is not None
+    z, log_q_z = nf(100)
+    z = z.numpy()
+    assert (np.abs(z[:, :3]) <= 2.0).all()
+    assert (z[:, 6:8] > 0.0).all() and (np.sum(z[:, 6:8], axis=1) < 1.0).all()
+    assert (z[:, 8] >= 0.0).all()
+    assert np.isclose(nf.trans_dist.log_prob(z), log_q_z, rtol=1e-3, atol=1e-3).all()
+    T_x = M.eps(z)
+    assert T_x.shape == (100, 4)
+
+    mu = np.array([0.0, 0.0, 1.0 / 3.0, 1.0])
+    q_theta, opt_data, save_path, failed = M.epi(mu, num_iters=100, K=1)
+    assert not failed
+    assert np.isfinite(q_theta.sample(100)).all()
+
+    # Models of unstructured parameters have no block support flow.
+    M = Model("unstructured", [b])
+    assert M._support_mapping() is None
+    return None
+
+
 def test_Model_init():
     """Test Model initialization."""
     p1 = Parameter("a", 1, 0, 1)
@@ -207,6 +325,498 @@ def test_epi():
     return None
 
 
+def test_epi_device_loop():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_device_loop", params)
+    M.set_eps(linear2D_freq)
+    q_theta, opt_data, save_path, failed = M.epi(
+        mu, num_iters=120, K=3, log_rate=50, device_loop=True
+    )
+    assert not failed
+    iterations = opt_data["iteration"].to_numpy()
+    assert np.equal(iterations, np.array([0, 50, 100, 170, 220, 290, 340])).all()
+
+    # Updating eta and c must not retrace the compiled graphs.
+    num_traces = opt_data["num_traces"].to_numpy()
+    assert np.equal(num_traces[3:], num_traces[-1]).all()
+    z = q_theta(100)
+    assert np.sum(1 - np.isfinite(z)) == 0
+    return None
+
+
+def test_epi_probe():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_probe", params)
+    M.set_eps(linear2D_freq)
+    num_iters = 1000
+    probe_rate = 50
+    for device_loop in [False, True]:
+        _, opt_data, _, failed = M.epi(
+            mu,
+            num_iters=num_iters,
+            K=2,
+            log_rate=100,
+            probe_rate=probe_rate,
+            device_loop=device_loop,
+        )
+        assert not failed
+        for k in [1, 2]:
+            opt_data_k = opt_data[opt_data["k"] == k]
+            # Epochs end at num_iters or at a passed probe.
+            i = opt_data_k["iteration"].iloc[-1] - (k - 1) * num_iters
+            assert i == num_iters or i % probe_rate == 0
+            assert opt_data_k["converged"].iloc[-1] is not None
+
+    with raises(TypeError):
+        M.epi(mu, probe_rate=50.0)
+    with raises(ValueError):
+        M.epi(mu, probe_rate=0)
+    return None
+
+
+def test_epi_remat():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_remat", params)
+    M.set_eps(linear2D_freq)
+    for remat in ["eps", "all"]:
+        for single_pass_grad in [False, True]:
+            q_theta, opt_data, _, failed = M.epi(
+                mu,
+                num_iters=100,
+                K=1,
+                remat=remat,
+                single_pass_grad=single_pass_grad,
+            )
+            assert not failed
+            z = q_theta(100)
+            assert np.sum(1 - np.isfinite(z)) == 0
+
+    with raises(ValueError):
+        M.epi(mu, remat="foo")
+    return None
+
+
+def test_epi_resume(tmp_path):
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_resume", params)
+    M.set_eps(linear2D_freq)
+    save_path = str(tmp_path) + "/"
+    _, opt_data1, _, _ = M.epi(
+        mu, num_iters=100, K=2, c0=2.0, save_path=save_path, resume=True
+    )
+    assert os.path.exists(save_path + "resume_state.npz")
+    time_per_it = np.load(save_path + "timing.npz")["time_per_it"]
+    assert np.isclose(time_per_it, np.nanmean(opt_data1["time_per_it"]))
+    etas1 = np.load(save_path + "opt_data.npz")["etas"]
+    cs1 = np.load(save_path + "opt_data.npz")["cs"]
+    assert cs1[0] == 2.0
+
+    # Continue from the state following k=1.
+    q_theta, opt_data2, _, failed = M.epi(
+        mu, num_iters=100, K=2, c0=2.0, save_path=save_path, resume=True
+    )
+    assert not failed
+    opt_data1_k1 = opt_data1[opt_data1["k"] <= 1]
+    opt_data2_k1 = opt_data2[opt_data2["k"] <= 1]
+    assert np.isclose(opt_data1_k1["H"], opt_data2_k1["H"]).all()
+    assert np.equal(opt_data2["iteration"], opt_data1["iteration"]).all()
+    assert np.isclose(np.load(save_path + "opt_data.npz")["etas"], etas1).all()
+    assert np.isclose(np.load(save_path + "opt_data.npz")["cs"], cs1).all()
+    z = q_theta(100)
+    assert np.sum(1 - np.isfinite(z)) == 0
+
+    with raises(ValueError):
+        M.epi(mu, num_iters=100, K=1, save_path=save_path, resume=True)
+    # The saved state must match the current run.
+    with raises(ValueError):
+        M.epi(mu, num_iters=100, K=3, c0=4.0, save_path=save_path, resume=True)
+    with raises(ValueError):
+        M.epi(2.0 * mu, num_iters=100, K=3, c0=2.0, save_path=save_path, resume=True)
+    with raises(ValueError):
+        M.epi(
+            mu,
+            num_stages=2,
+            num_iters=100,
+            K=3,
+            c0=2.0,
+            save_path=save_path,
+            resume=True,
+        )
+    with raises(ValueError):
+        M.epi(mu, resume=True, save_movie_data=True)
+    return None
+
+
+def test_epi_continuation():
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_continuation", params)
+    M.set_eps(linear2D_freq)
+    mus = [
+        np.array([0.0, 0.1, 2 * np.pi * freq, (0.1 * 2 * np.pi * freq) ** 2])
+        for freq in [1.0, 1.1, 1.2]
+    ]
+    q_thetas, opt_data, save_paths, failed = M.epi_continuation(
+        mus, num_iters=100, K=2
+    )
+    assert len(q_thetas) == 3
+    assert len(set(save_paths)) == 3
+    assert not any(failed)
+    assert np.array_equal(np.unique(opt_data["mu_ind"]), np.arange(3))
+
+    # Each warm started run begins from the previous final distribution.
+    H_final = opt_data[opt_data["mu_ind"] == 0]["H"].iloc[-1]
+    H_init = opt_data[opt_data["mu_ind"] == 1]["H"].iloc[0]
+    assert np.isclose(H_final, H_init, atol=0.5)
+
+    with raises(ValueError):
+        M.epi_continuation(mus, save_path="foo/")
+    with raises(TypeError):
+        M.epi(mus[0], warm_start=q_thetas[0].nf)
+    with raises(ValueError):
+        M.epi(mus[0], eta0=np.zeros((2,)))
+    with raises(ValueError):
+        M.epi(mus[0], num_stages=1, warm_start=q_thetas[0])
+    return None
+
+
+def test_epi_amortized():
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_amortized", params)
+    M.set_eps(linear2D_freq)
+    mu_lb = np.array([0.0, 0.1, 2 * np.pi, (0.1 * 2 * np.pi) ** 2])
+    mu_ub = np.array([0.0, 0.1, 4 * np.pi, (0.1 * 4 * np.pi) ** 2])
+    q_theta, opt_data, save_path, failed = M.epi_amortized(
+        (mu_lb, mu_ub), num_mus=4, mu_batch=2, num_iters=50, K=2, log_rate=25
+    )
+    assert isinstance(q_theta, AmortizedDistribution)
+    assert not failed
+    assert np.load(save_path + "mus.npy").shape == (4, 4)
+    assert np.load(save_path + "converged.npy").shape == (2, 4)
+    assert opt_data.shape[0] == 4
+
+    # Distributions of new targets need no optimization.
+    mu = (mu_lb + mu_ub) / 2.0
+    q_theta_mu = q_theta(mu)
+    assert isinstance(q_theta_mu, Distribution)
+    z = q_theta_mu.sample(100)
+    assert z.shape == (100, 4)
+    assert np.sum(1 - np.isfinite(z)) == 0
+    assert (z[:, 0] >= 0.0).all() and (z[:, 3] <= 0.0).all()
+    log_q_z = q_theta_mu.log_prob(z)
+    assert np.sum(1 - np.isfinite(log_q_z)) == 0
+
+    with raises(TypeError):
+        M.epi_amortized([mu_lb, mu_ub])
+    with raises(ValueError):
+        M.epi_amortized(np.zeros((4, 2)))
+    return None
+
+
+def test_epi_amortized_constraints():
+    # Mean of each of two bounded parameters.
+    a = Parameter("a", 1, -1.0, 1.0)
+    b = Parameter("b", 1, -1.0, 1.0)
+    M = Model("mean_amortized", [a, b])
+
+    def mean_stats(a, b):
+        return tf.concat([a, b], axis=1)
+
+    M.set_eps(mean_stats)
+    mu_lb, mu_ub = np.array([-0.5, -0.5]), np.array([0.5, 0.5])
+    q_theta, opt_data, save_path, failed = M.epi_amortized(
+        (mu_lb, mu_ub), num_mus=4, mu_batch=4, num_iters=500, K=3, N=200
+    )
+    assert not failed
+
+    # The constraints of at least one target are met.
+    mus = np.load(save_path + "mus.npy")
+    met = []
+    for mu in mus:
+        z = q_theta(mu).sample(5000)
+        met.append(np.isclose(np.mean(z, axis=0), mu, atol=0.05).all())
+    assert np.any(met)
+    return None
+
+
+def test_epi_estimators():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_estimators", params)
+    M.set_eps(linear2D_freq)
+    for stl in [False, True]:
+        for aug_estimator in ["split", "symmetric"]:
+            q_theta, opt_data, _, failed = M.epi(
+                mu,
+                num_iters=100,
+                K=1,
+                single_pass_grad=True,
+                stl=stl,
+                aug_estimator=aug_estimator,
+                grad_var_samples=3,
+            )
+            assert not failed
+            grad_var = opt_data["grad_var"].to_numpy()
+            assert np.isnan(grad_var[0])
+            assert (grad_var[1:] > 0.0).all()
+
+    with raises(ValueError):
+        M.epi(mu, aug_estimator="foo")
+    with raises(ValueError):
+        M.epi(mu, aug_estimator="symmetric", single_pass_grad=False)
+    with raises(TypeError):
+        M.epi(mu, grad_var_samples=2.0)
+    with raises(ValueError):
+        M.epi(mu, grad_var_samples=1)
+    return None
+
+
+def test_epi_adaptive_N():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_adaptive_N", params)
+    M.set_eps(linear2D_freq)
+    N_buckets = [100, 200, 400]
+    for device_loop in [False, True]:
+        q_theta, opt_data, _, failed = M.epi(
+            mu,
+            num_iters=100,
+            K=2,
+            N=200,
+            log_rate=20,
+            adaptive_N=N_buckets,
+            device_loop=device_loop,
+        )
+        assert not failed
+        Ns = opt_data["N"].to_numpy()
+        assert Ns[0] == 200
+        assert np.isin(Ns, N_buckets).all()
+        # Moves at most one bucket per logged iteration.
+        inds = np.array([N_buckets.index(N) for N in Ns])
+        assert (np.abs(np.diff(inds)) <= 1).all()
+        snr = opt_data["grad_snr"].to_numpy()
+        assert np.isnan(snr[0])
+        assert (snr[1:] >= 0.0).all()
+
+    _, opt_data, _, _ = M.epi(mu, num_iters=100, K=1, N=200, log_rate=20)
+    assert (opt_data["N"].to_numpy() == 200).all()
+    assert np.isnan(opt_data["grad_snr"].to_numpy()).all()
+
+    with raises(TypeError):
+        M.epi(mu, N=200, adaptive_N=200)
+    with raises(TypeError):
+        M.epi(mu, N=200, adaptive_N=[100, 200.0])
+    with raises(ValueError):
+        M.epi(mu, N=200, adaptive_N=[100, 400])
+    with raises(ValueError):
+        M.epi(mu, N=200, adaptive_N=[1, 200])
+    with raises(ValueError):
+        M.epi(mu, N=200, adaptive_N=[100, 200], target_snr=0.0)
+    return None
+
+
+def test_epi_base_sampling():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_base_sampling", params)
+    M.set_eps(linear2D_freq)
+    for base_sampling in ["halton", "antithetic"]:
+        q_theta, opt_data, save_path, failed = M.epi(
+            mu, num_iters=100, K=2, base_sampling=base_sampling
+        )
+        assert not failed
+        assert base_sampling in save_path
+        assert q_theta.nf.base_sampling == base_sampling
+        z = q_theta.sample(100)
+        assert np.sum(1 - np.isfinite(z)) == 0
+    return None
+
+
+def test_epi_graph_cache():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_graph_cache", params)
+    M.set_eps(linear2D_freq)
+
+    clear_epi_graph_cache()
+    q_theta1, opt_data, _, _ = M.epi(mu, num_iters=100, K=2, c0=1.0)
+    assert opt_data["num_traces"].iloc[-1] > 0
+
+    # A c0 sweep with the same architecture skips tracing entirely.
+    q_theta2, opt_data, _, _ = M.epi(mu, num_iters=100, K=2, c0=10.0)
+    assert np.equal(opt_data["num_traces"], 0).all()
+    assert q_theta1.nf is not q_theta2.nf
+
+    q_theta3, opt_data, _, _ = M.epi(mu, num_iters=100, K=2, cache_graphs=False)
+    assert opt_data["num_traces"].iloc[-1] > 0
+
+    # Redefining the emergent property under the same name retraces.
+    def linear2D_freq_copy(a11, a12, a21, a22):
+        return linear2D_freq(a11, a12, a21, a22)
+
+    linear2D_freq_copy.__name__ = linear2D_freq.__name__
+    M.set_eps(linear2D_freq_copy)
+    _, opt_data, _, _ = M.epi(mu, num_iters=100, K=1)
+    assert opt_data["num_traces"].iloc[-1] > 0
+
+    # Models of the same name do not share graphs, which are released with
+    # their model.
+    M2 = Model("lds_graph_cache", params)
+    M2.set_eps(linear2D_freq)
+    _, opt_data, _, _ = M2.epi(mu, num_iters=100, K=1)
+    assert opt_data["num_traces"].iloc[-1] > 0
+    assert len(_EPI_GRAPH_CACHE) == 2
+    del M2
+    gc.collect()
+    assert len(_EPI_GRAPH_CACHE) == 1
+    clear_epi_graph_cache()
+    return None
+
+
+def test_epi_sweep():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_sweep", params)
+    M.set_eps(linear2D_freq)
+
+    configs = [
+        {"num_iters": 50, "K": 1, "c0": 1.0},
+        {"num_iters": 50, "K": 1, "c0": 10.0},
+        {"num_iters": 50, "K": 1, "c0": 10.0, "random_seed": 2},
+    ]
+    if hasattr(os, "sched_getaffinity"):
+        num_cores = len(os.sched_getaffinity(0))
+    else:
+        num_cores = os.cpu_count()
+    n_workers = min(2, num_cores)
+    q_thetas, opt_data, save_paths, failed = M.epi_sweep(
+        mu, configs, n_workers=n_workers
+    )
+    assert len(q_thetas) == 3
+    assert len(set(save_paths)) == 3
+    assert not any(failed)
+    assert np.array_equal(np.unique(opt_data["config"]), np.arange(3))
+    for q_theta in q_thetas:
+        z = q_theta.sample(10)
+        assert z.shape == (10, 4)
+
+    with raises(TypeError):
+        M.epi_sweep(mu, configs[0])
+    with raises(ValueError):
+        M.epi_sweep(mu, configs, n_workers=0)
+    with raises(ValueError):
+        M.epi_sweep(mu, [{"save_path": "data/foo/"}, {"save_path": "data/foo/"}])
+    return None
+
+
+def test_epi_population():
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi])
+    a11 = Parameter("a11", 1, 0.0)
+    a12 = Parameter("a12", 1, 0.0, 10.0)
+    a21 = Parameter("a21", 1, -10.0, 0.0)
+    a22 = Parameter("a22", 1, ub=0.0)
+    params = [a11, a12, a21, a22]
+    M = Model("lds_population", params)
+    M.set_eps(linear2D_freq)
+
+    random_seeds = [1, 2, 3]
+    q_thetas, opt_data, save_paths, failed = M.epi_population(
+        mu, random_seeds, c0s=[1.0, 10.0, 100.0], num_iters=100, K=2
+    )
+    assert len(q_thetas) == 3
+    assert len(set(save_paths)) == 3
+    assert not any(failed)
+    assert np.array_equal(np.unique(opt_data["member"]), np.arange(3))
+    for b, save_path in enumerate(save_paths):
+        assert os.path.exists(save_path + "opt_data.csv")
+        cs = np.load(save_path + "opt_data.npz")["cs"]
+        assert cs[0] == [1.0, 10.0, 100.0][b]
+    z = q_thetas[0].sample(10)
+    assert z.shape == (10, 4)
+    assert not np.array_equal(
+        q_thetas[0].nf.trainable_variables[0].numpy(),
+        q_thetas[1].nf.trainable_variables[0].numpy(),
+    )
+
+    with raises(TypeError):
+        M.epi_population(mu, 1)
+    with raises(ValueError):
+        M.epi_population(mu, [])
+    with raises(ValueError):
+        M.epi_population(mu, random_seeds, lrs=[1e-3])
+    with raises(ValueError):
+        M.epi_population(mu, [1, 1])
+    with raises(ValueError):
+        M.epi_population(mu, random_seeds, arch_type="autoregressive")
+
+    # Failed members take no optimization steps.
+    nfs = [M._epi_nf(random_seed=random_seed) for random_seed in [1, 2]]
+    for nf in nfs:
+        nf(1)
+    optimizers = [tf.keras.optimizers.Adam(1e-3) for nf in nfs]
+    graphs = M._epi_population_graphs(nfs, optimizers, 100, 1.0, False, 10000)
+    graphs["mu"].assign(mu)
+    vars_0 = [[v.numpy() for v in nf.trainable_variables] for nf in nfs]
+    eta, c = np.zeros((2, 4), np.float32), np.ones((2,), np.float32)
+    graphs["train_step"](eta, c, np.array([True, False]))
+    assert not all(
+        [
+            np.array_equal(v.numpy(), v_0)
+            for v, v_0 in zip(nfs[0].trainable_variables, vars_0[0])
+        ]
+    )
+    for v, v_0 in zip(nfs[1].trainable_variables, vars_0[1]):
+        assert np.array_equal(v.numpy(), v_0)
+    return None
+
+
 def test_Distribution():
     """ Test Distribution class."""
     tf.random.set_seed(1)
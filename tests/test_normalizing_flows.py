@@ -3,8 +3,22 @@
 import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
-from epi.normalizing_flows import NormalizingFlow, IntervalFlow
+from epi.normalizing_flows import (
+    NormalizingFlow,
+    IntervalFlow,
+    PartitionedIntervalFlow,
+    SimplexFlow,
+    BlockSupportFlow,
+    ConditionedNormFlow,
+    SplineConditioner,
+    KroneckerConditioner,
+    population_call,
+)
+from epi.util import init_path
+import epi.util
 from pytest import raises
+import shutil
+import os
 
 EPS = 1e-6
 
@@ -36,6 +50,13 @@ def test_NormalizingFlow_init():
     # Test autoregressive
     nf = NormalizingFlow("autoregressive", D, num_stages, num_layers, num_units)
     assert nf.arch_type == "autoregressive"
+    nf = NormalizingFlow(
+        "inverse_autoregressive", D, num_stages, num_layers, num_units
+    )
+    assert nf.arch_type == "inverse_autoregressive"
+    nf = NormalizingFlow("spline", D, num_stages, num_layers, num_units, num_bins=4)
+    assert nf.arch_type == "spline"
+    assert nf.num_bins == 4
 
     lb = -2.0 * np.ones((D,))
     ub = 2.0 * np.ones((D,))
@@ -123,6 +144,26 @@ def test_NormalizingFlow_init():
         nf = NormalizingFlow(
             arch_type, D, num_stages, num_layers, num_units, random_seed=1.0
         )
+    with raises(TypeError):
+        nf = NormalizingFlow(
+            "spline", D, num_stages, num_layers, num_units, num_bins=8.0
+        )
+    with raises(ValueError):
+        nf = NormalizingFlow("spline", D, num_stages, num_layers, num_units, num_bins=1)
+    with raises(ValueError):
+        nf = NormalizingFlow("kronecker_coupling", 6, num_stages, num_layers, num_units)
+    with raises(TypeError):
+        nf = NormalizingFlow(
+            "kronecker_coupling", 6, num_stages, num_layers, num_units, matrix_shape=6
+        )
+    with raises(ValueError):
+        nf = NormalizingFlow(
+            "kronecker_coupling", 6, 2, 2, 15, matrix_shape=(2, 2)
+        )
+    with raises(ValueError):
+        nf = NormalizingFlow(
+            "kronecker_coupling", 6, 2, 2, 15, matrix_shape=(1, 6)
+        )
 
     # Check that q0 has correct statistics
     nf = NormalizingFlow(arch_type, D, num_stages, num_layers, num_units)
@@ -178,6 +219,214 @@ def test_NormalizingFlow_call():
     return None
 
 
+def test_stage_fn():
+    D = 5
+    N = 100
+    arch_types = ["autoregressive", "inverse_autoregressive", "coupling", "spline"]
+    for arch_type in arch_types:
+        # Without batch normalization, whose inverse uses batch statistics.
+        nf = NormalizingFlow(arch_type, D, 2, 2, 15, batch_norm=False)
+        nf(N)
+        x = np.random.normal(0.0, 1.0, (N, D)).astype(np.float32)
+        for i in range(nf.num_stages):
+            stage = nf.stages[i]
+            y, ldj = nf._stage_fn(i)(x)
+            assert np.isclose(y, stage(x), rtol=1e-4, atol=1e-5).all()
+            ldj_true = stage.forward_log_det_jacobian(x, event_ndims=1)
+            assert np.isclose(ldj, ldj_true, rtol=1e-4, atol=1e-5).all()
+            x = y.numpy()
+
+        # Densities of the fused samples match the transformed distribution.
+        z, log_q_z = nf(N)
+        log_q_z_true = nf.trans_dist.log_prob(z)
+        assert np.isclose(log_q_z, log_q_z_true, rtol=1e-3, atol=1e-3).all()
+
+        # The conditioners are called outside of their bijectors in graphs.
+        z_graph, log_q_z_graph = tf.function(lambda: nf(N))()
+        assert z_graph.shape == (N, D)
+        assert np.isfinite(log_q_z_graph).all()
+
+    nf = NormalizingFlow("kronecker_coupling", 6, 2, 2, 15, matrix_shape=(3, 2))
+    assert nf.num_masked == 2
+    nf(N)
+    x = np.random.normal(0.0, 1.0, (N, 6)).astype(np.float32)
+    for i in range(nf.num_stages):
+        stage = nf.stages[i]
+        y, ldj = nf._stage_fn(i)(x)
+        assert np.isclose(y, stage(x), rtol=1e-4, atol=1e-5).all()
+        ldj_true = stage.forward_log_det_jacobian(x, event_ndims=1)
+        assert np.isclose(ldj, ldj_true, rtol=1e-4, atol=1e-5).all()
+        x = y.numpy()
+
+    # Permutations between stages permute rows and columns.
+    perm = nf.permutations[0].permutation.numpy().reshape((3, 2))
+    assert (perm // 2 == perm[:, :1] // 2).all()
+    assert (perm % 2 == perm[:1, :] % 2).all()
+    return None
+
+
+def test_SplineConditioner():
+    D = 5
+    N = 100
+    num_bins = 6
+    conditioner = SplineConditioner(D - 2, 2, 15, num_bins, bound=3.0)
+    x0 = np.random.normal(0.0, 1.0, (N, 2)).astype(np.float32)
+    bin_widths, bin_heights, knot_slopes = conditioner(x0)
+    assert bin_widths.shape == (N, D - 2, num_bins)
+    assert bin_heights.shape == (N, D - 2, num_bins)
+    assert knot_slopes.shape == (N, D - 2, num_bins - 1)
+    assert np.isclose(np.sum(bin_widths, axis=2), 6.0).all()
+    assert np.isclose(np.sum(bin_heights, axis=2), 6.0).all()
+    assert (knot_slopes.numpy() > 0.0).all()
+    assert np.isclose(knot_slopes, 1.0).all()
+
+    # The spline is the identity at initialization.
+    x1 = np.random.normal(0.0, 2.0, (N, D - 2)).astype(np.float32)
+    spline = conditioner.bijector_fn(x0)
+    assert np.isclose(spline.forward(x1), x1, atol=1e-4).all()
+    ldj = spline.forward_log_det_jacobian(x1, event_ndims=1)
+    assert np.isclose(ldj, 0.0, atol=1e-4).all()
+    return None
+
+
+def test_KroneckerConditioner():
+    R, C = 5, 3
+    N = 100
+    conditioner = KroneckerConditioner((R, C), 2, 10)
+    x0 = np.random.normal(0.0, 1.0, (N, 2 * C)).astype(np.float32)
+    shift, log_scale = conditioner(x0)
+    assert shift.shape == (N, 3 * C)
+    assert log_scale.shape == (N, 3 * C)
+    num_params = sum([np.prod(v.shape) for v in conditioner.trainable_variables])
+    A_params = 3 * 2 + 2 * (3 * 3)
+    B_params = C * 10 + 10 * 10 + 10 * 2 * C
+    c_params = 2 * (3 * 10) + 3 * 2 * C
+    assert num_params == A_params + B_params + c_params
+
+    # Each layer is a dense layer with a Kronecker-structured weight matrix.
+    conditioner = KroneckerConditioner((R, C), 0, 10)
+    shift, log_scale = conditioner(x0)
+    A, B, c = conditioner.As[0], conditioner.Bs[0], conditioner.cs[0]
+    W = np.kron(A.numpy(), B.numpy().T)
+    y = np.dot(x0, W.T) + c.numpy().flatten()
+    y = y.reshape((N, 3, 2 * C))
+    assert np.isclose(shift, y[:, :, :C].reshape((N, 3 * C)), atol=1e-5).all()
+    assert np.isclose(log_scale, y[:, :, C:].reshape((N, 3 * C)), atol=1e-5).all()
+    return None
+
+
+def test_population_call():
+    D = 5
+    N = 100
+    lb = np.array([0.0, -np.inf, -1.0, -np.inf, -np.inf])
+    ub = np.array([np.inf, 0.0, 1.0, np.inf, np.inf])
+    for post_affine in [False, True]:
+        nfs = [
+            NormalizingFlow(
+                "coupling",
+                D,
+                3,
+                2,
+                15,
+                batch_norm=False,
+                post_affine=post_affine,
+                bounds=(lb, ub),
+                random_seed=random_seed,
+            )
+            for random_seed in [1, 2, 3]
+        ]
+        for nf in nfs:
+            nf(1)
+        z, log_q_z = population_call(nfs, N)
+        assert z.shape == (3, N, D)
+        assert log_q_z.shape == (3, N)
+        # Each member's samples and densities are those of its own flow.
+        for b, nf in enumerate(nfs):
+            log_q_z_b = nf.trans_dist.log_prob(z[b])
+            assert np.isclose(log_q_z[b], log_q_z_b, rtol=1e-3, atol=1e-3).all()
+        assert not np.isclose(z[0], z[1]).all()
+    return None
+
+
+def test_remat_stages():
+    D = 4
+    N = 100
+    for arch_type in ["autoregressive", "coupling"]:
+        nf = NormalizingFlow(arch_type, D, 2, 2, 15, post_affine=True)
+        nf(N)
+        grads = []
+        for remat_stages in [False, True]:
+            nf.remat_stages = remat_stages
+            with tf.GradientTape() as tape:
+                z, log_q_z = nf(N)
+                loss = tf.reduce_mean(log_q_z) + tf.reduce_mean(tf.square(z))
+            grads.append(tape.gradient(loss, nf.trainable_variables))
+        for g1, g2 in zip(*grads):
+            assert np.isclose(g1, g2, rtol=1e-4, atol=1e-6).all()
+
+    return None
+
+
+def test_stl_log_prob():
+    D = 4
+    N = 100
+    lb = np.array([0.0, -np.inf, -1.0, -np.inf])
+    ub = np.array([np.inf, 0.0, 1.0, np.inf])
+    for arch_type in ["autoregressive", "coupling"]:
+        nf = NormalizingFlow(
+            arch_type, D, 2, 2, 15, post_affine=True, bounds=(lb, ub)
+        )
+        with tf.GradientTape(persistent=True) as tape:
+            z, log_q_z = nf(N)
+            log_q_z_stl = nf.stl_log_prob(z, log_q_z)
+            H = -tf.reduce_mean(log_q_z)
+            H_stl = -tf.reduce_mean(log_q_z_stl)
+        assert np.isclose(log_q_z_stl, log_q_z, atol=1e-3).all()
+        grads = tape.gradient(H, nf.trainable_variables)
+        grads_stl = tape.gradient(H_stl, nf.trainable_variables)
+        for g, g_stl in zip(grads, grads_stl):
+            assert np.isfinite(g_stl).all()
+        assert not all(
+            np.isclose(g, g_stl).all() for g, g_stl in zip(grads, grads_stl)
+        )
+
+    return None
+
+
+def test_base_sampling():
+    D = 4
+    N = 100
+    with raises(TypeError):
+        NormalizingFlow("coupling", D, 2, 2, 15, base_sampling=1)
+    with raises(ValueError):
+        NormalizingFlow("coupling", D, 2, 2, 15, base_sampling="foo")
+    with raises(ValueError):
+        NormalizingFlow("coupling", D, 2, 2, 15, base_sampling="sobol")
+
+    for base_sampling in ["iid", "halton", "antithetic"]:
+        nf = NormalizingFlow("coupling", D, 2, 2, 15, base_sampling=base_sampling)
+        z, log_q_z = nf(N)
+        assert z.shape == (N, D)
+        assert np.isfinite(z).all() and np.isfinite(log_q_z).all()
+        if base_sampling != "iid":
+            assert nf.to_string().endswith("_%s_rs1" % base_sampling)
+            assert nf.copy().base_sampling == base_sampling
+
+        # Batches of independent sets, e.g. for evaluation.
+        x = nf._base_sample(5 * 20, num_sets=5).numpy()
+        assert x.shape == (100, D)
+        assert np.isfinite(x).all()
+        x = x.reshape((5, 20, D))
+        if base_sampling == "antithetic":
+            assert np.isclose(x[:, :10], -x[:, 10:]).all()
+        if base_sampling == "halton":
+            # Stratified marginals have a nearly exact mean.
+            assert np.all(np.abs(np.mean(x, axis=1)) < 0.2)
+        assert not np.isclose(x[0], x[1]).all()
+
+    return None
+
+
 def test_to_string():
     nf = NormalizingFlow("coupling", 4, 1, 2, 15)
     assert nf.to_string() == "D4_C1_L2_U15_PA_rs1"
@@ -193,6 +442,12 @@ def test_to_string():
         "autoregressive", 4, 4, 2, 15, batch_norm=False, post_affine=False
     )
     assert nf.to_string() == "D4_AR4_L2_U15_rs1"
+    nf = NormalizingFlow(
+        "inverse_autoregressive", 4, 2, 2, 15, batch_norm=False, post_affine=False
+    )
+    assert nf.to_string() == "D4_IAF2_L2_U15_rs1"
+    nf = NormalizingFlow("spline", 4, 2, 2, 15, num_bins=6)
+    assert nf.to_string() == "D4_RQS2_L2_U15_K6_PA_rs1"
 
 
 def interval_flow_np(x, lb, ub):
@@ -337,7 +592,113 @@ def test_interval_flow():
     return None
 
 
-def test_initialization():
+def test_PartitionedIntervalFlow():
+    N = 100
+    D = 12
+    rtol = 1e-4
+    inf = float("inf")
+    lb = np.random.uniform(-10.0, -1.0, (D,))
+    ub = np.random.uniform(1.0, 10.0, (D,))
+    # Mixed bound types: none, lower, upper and both.
+    bound_types = np.arange(D) % 4
+    lb[bound_types == 0] = -inf
+    ub[bound_types == 0] = inf
+    ub[bound_types == 1] = inf
+    lb[bound_types == 2] = -inf
+    np.random.shuffle(bound_types)
+    bounds = [
+        (lb, ub),
+        (np.array(D * [-inf]), np.array(D * [inf])),
+        (np.zeros((D,)), np.ones((D,))),
+    ]
+    for lb, ub in bounds:
+        IF = IntervalFlow(lb, ub)
+        PIF = PartitionedIntervalFlow(lb, ub)
+        assert sum(PIF.group_sizes) == D
+        x = tf.constant(np.random.normal(0.0, 2.0, (N, D)).astype(np.float32))
+        with tf.GradientTape(persistent=True) as tape:
+            tape.watch(x)
+            y, ldj = IF.forward_and_log_det_jacobian(x)
+            y_p, ldj_p = PIF.forward_and_log_det_jacobian(x)
+            loss = tf.reduce_sum(y) + tf.reduce_sum(ldj)
+            loss_p = tf.reduce_sum(y_p) + tf.reduce_sum(ldj_p)
+        assert np.isclose(y_p, y, rtol=rtol).all()
+        assert np.isclose(ldj_p, ldj, rtol=rtol).all()
+        assert np.isclose(PIF.forward(x), y, rtol=rtol).all()
+        assert np.isclose(PIF.forward_log_det_jacobian(x), ldj, rtol=rtol).all()
+        grad = tape.gradient(loss, x)
+        grad_p = tape.gradient(loss_p, x)
+        assert np.isclose(grad_p, grad, rtol=rtol, atol=1e-5).all()
+
+        # Round trips away from where the bounded maps saturate in float32.
+        x = tf.constant(np.random.uniform(-1.5, 1.5, (N, D)).astype(np.float32))
+        y, ldj = IF.forward_and_log_det_jacobian(x)
+        y_p, ldj_p = PIF.forward_and_log_det_jacobian(x)
+        x_inv = PIF.inverse(y_p)
+        assert np.isclose(x_inv, IF.inverse(y), rtol=1e-3, atol=1e-3).all()
+        assert np.isclose(x_inv, x, rtol=1e-3, atol=1e-3).all()
+        ildj = PIF.inverse_log_det_jacobian(y_p, 1)
+        assert np.isclose(ildj, -ldj_p, rtol=1e-3, atol=1e-3).all()
+
+    nf = NormalizingFlow("coupling", D, 1, 2, 15, bounds=(lb, ub))
+    assert isinstance(nf.support_mapping, PartitionedIntervalFlow)
+    return None
+
+
+def test_SimplexFlow():
+    N = 20
+    D = 3
+    SF = SimplexFlow(D)
+    x = tf.constant(np.random.normal(0.0, 1.0, (N, D)).astype(np.float32))
+    with tf.GradientTape() as tape:
+        tape.watch(x)
+        y, ldj = SF.forward_and_log_det_jacobian(x)
+    J = tape.batch_jacobian(y, x).numpy()
+    assert (y.numpy() > 0.0).all() and (np.sum(y, axis=1) < 1.0).all()
+    assert np.isclose(ldj, np.linalg.slogdet(J)[1], rtol=1e-4, atol=1e-4).all()
+    assert np.isclose(SF.inverse(y), x, rtol=1e-3, atol=1e-3).all()
+    assert np.isclose(SF.inverse_log_det_jacobian(y), -ldj, rtol=1e-3).all()
+
+    with raises(TypeError):
+        SimplexFlow(2.0)
+    with raises(ValueError):
+        SimplexFlow(0)
+    return None
+
+
+def test_BlockSupportFlow():
+    N = 20
+    lb = np.array([0.0, -np.inf])
+    ub = np.array([1.0, np.inf])
+    bijectors = [PartitionedIntervalFlow(lb, ub), SimplexFlow(2)]
+    BSF = BlockSupportFlow(bijectors, [2, 2])
+    assert BSF.D == 4
+    x = tf.constant(np.random.normal(0.0, 1.0, (N, 4)).astype(np.float32))
+    y, ldj = BSF.forward_and_log_det_jacobian(x)
+    y1, ldj1 = bijectors[0].forward_and_log_det_jacobian(x[:, :2])
+    y2, ldj2 = bijectors[1].forward_and_log_det_jacobian(x[:, 2:])
+    assert np.isclose(y, np.concatenate([y1, y2], axis=1)).all()
+    assert np.isclose(ldj, ldj1 + ldj2).all()
+    assert np.isclose(BSF.forward(x), y).all()
+    assert np.isclose(BSF.inverse(y), x, rtol=1e-3, atol=1e-3).all()
+    assert np.isclose(BSF.inverse_log_det_jacobian(y), -ldj, rtol=1e-3).all()
+
+    nf = NormalizingFlow("coupling", 4, 2, 2, 15, batch_norm=False, support_mapping=BSF)
+    z, log_q_z = nf(N)
+    assert (z[:, 2:].numpy() > 0.0).all()
+    assert np.isclose(nf.trans_dist.log_prob(z), log_q_z, atol=1e-3).all()
+    assert nf.copy().support_mapping is BSF
+
+    with raises(TypeError):
+        NormalizingFlow("coupling", 4, 2, 2, 15, support_mapping="foo")
+    with raises(TypeError):
+        BlockSupportFlow(tuple(bijectors), [2, 2])
+    with raises(ValueError):
+        BlockSupportFlow(bijectors, [4])
+    return None
+
+
+def test_initialization(tmp_path, monkeypatch):
     D = 4
     nf = NormalizingFlow(
         "autoregressive", D, 2, 2, 15, batch_norm=True, post_affine=True
@@ -359,6 +720,19 @@ def test_initialization():
     # For init load
     nf.initialize(init_type, init_params)
 
+    # Unsaved initializations are not cached, and evicted ones are trained
+    # again.  The short runs are kept out of the shared cache.
+    monkeypatch.setattr(epi.util, "INIT_CACHE_DIR", str(tmp_path) + "/")
+    _init_path = init_path(nf.to_string(), init_type, init_params)
+    nf.initialize(init_type, init_params, num_iters=100, save=False)
+    assert not os.path.exists(_init_path + "opt_data.csv")
+    nf.initialize(init_type, init_params, num_iters=100)
+    assert os.path.exists(_init_path + "opt_data.csv")
+    shutil.rmtree(_init_path)
+    nf.initialize(init_type, init_params, num_iters=100)
+    assert os.path.exists(_init_path + "opt_data.csv")
+    monkeypatch.undo()
+
     # Bounds
     lb = np.zeros((D,))
     ub = np.ones((D,))
@@ -367,4 +741,102 @@ def test_initialization():
     )
     nf.initialize(init_type, init_params)
 
+    # Spline flows are initialized like the affine flows.
+    nf = NormalizingFlow("spline", D, 1, 2, 15, batch_norm=False, post_affine=True)
+    nf.initialize(init_type, init_params)
+    z = nf.sample(int(1e4)).numpy()
+    assert np.isclose(np.mean(z, 0), loc * np.ones((D,)), atol=1e-1).all()
+    assert np.isclose(np.cov(z.T), scale * np.eye(D), atol=1e-1).all()
+
+    # Inverse autoregressive flows have their own initialization path.
+    nf = NormalizingFlow(
+        "inverse_autoregressive", D, 2, 2, 15, batch_norm=True, post_affine=True
+    )
+    nf.initialize(init_type, init_params)
+    z = nf.sample(int(1e4)).numpy()
+    assert np.isclose(np.mean(z, 0), loc * np.ones((D,)), atol=1e-1).all()
+    assert np.isclose(np.cov(z.T), scale * np.eye(D), atol=1e-1).all()
+
+    # Maximum likelihood initialization stops early at the KL tolerance.
+    nf = NormalizingFlow("coupling", D, 2, 2, 15, batch_norm=False, random_seed=2)
+    opt_df = nf.initialize(
+        init_type, init_params, method="forward_KL", tol=0.05, load_if_cached=False
+    )
+    assert opt_df["converged"].iloc[-1]
+    assert opt_df["iteration"].iloc[-1] < int(1e4)
+    assert opt_df["KL"].iloc[-1] < 0.05
+    z = nf.sample(int(1e4)).numpy()
+    assert np.isclose(np.mean(z, 0), loc * np.ones((D,)), atol=2e-1).all()
+    assert np.isclose(np.cov(z.T), scale * np.eye(D), atol=2e-1).all()
+
+    # Bounded flows stop at the moment tolerance of the truncated gaussian.
+    nf = NormalizingFlow(
+        "coupling", D, 2, 2, 15, batch_norm=False, bounds=(lb, ub), random_seed=2
+    )
+    init_params_b = {"loc": 0.5, "scale": 0.25}
+    opt_df = nf.initialize(
+        init_type, init_params_b, method="forward_KL", tol=0.05, load_if_cached=False
+    )
+    assert np.isnan(opt_df["KL"]).all()
+    assert opt_df["converged"].iloc[-1]
+    assert opt_df["moment_err"].iloc[-1] < 0.05
+
+    with raises(ValueError):
+        nf.initialize(init_type, init_params, method="ML", load_if_cached=False)
+    with raises(TypeError):
+        nf.initialize(init_type, init_params, tol="0.1", load_if_cached=False)
+    with raises(ValueError):
+        nf.initialize(init_type, init_params, tol=-1.0, load_if_cached=False)
+
+    return None
+
+
+def test_ConditionedNormFlow_condition():
+    D = 4
+    N = 100
+    lb = np.array([0.0, -np.inf, -1.0, -np.inf])
+    ub = np.array([np.inf, 0.0, 1.0, np.inf])
+    cnf = ConditionedNormFlow(D, 2, 10, bounds=(lb, ub))
+    assert cnf.to_string() == "D4_CNVP3_L2_U10_rs1"
+    assert len(cnf.stages) == 3 and len(cnf.permutations) == 2
+    x_data = np.array([[1.0, 2.0]], np.float32)
+    flow = cnf.condition(x_data=x_data)
+    z, log_q_z = flow(N)
+    assert z.shape == (N, D)
+    assert log_q_z.shape == (N,)
+    assert (z[:, 0] >= 0.0).numpy().all() and (z[:, 1] <= 0.0).numpy().all()
+    assert (np.abs(z[:, 2]) <= 1.0).numpy().all()
+    assert np.isclose(flow.trans_dist.log_prob(z), log_q_z, atol=1e-3).all()
+
+    # The flow depends on the condition.
+    z2 = cnf.condition(x_data=2.0 * x_data).trans_dist.bijector.forward(
+        tf.zeros((1, D))
+    )
+    z1 = flow.trans_dist.bijector.forward(tf.zeros((1, D)))
+    assert not np.isclose(z1, z2).all()
+
+    # Coupling networks scale each transformed element for odd D.
+    D = 5
+    cnf = ConditionedNormFlow(D, 2, 10, num_stages=2)
+    shift, log_scale = cnf.conditioners[0](tf.zeros((N, 2)), x_data=x_data)
+    assert shift.shape == (N, 3) and log_scale.shape == (N, 3)
+    x = tf.random.normal((N, D))
+    bijector = cnf.condition(x_data=x_data).trans_dist.bijector
+    z = bijector.forward(x)
+    assert not np.isclose(z[:, 2:], x[:, 2:]).all()
+    assert np.isclose(bijector.inverse(z), x, atol=1e-4).all()
+    log_q_z = cnf.condition(x_data=x_data).trans_dist.log_prob(z)
+    assert np.isclose(cnf.log_prob(z, x_data=x_data), log_q_z, atol=1e-4).all()
+
+    # Single samples with rank 1 conditions, and conditions per sample.
+    log_q_z0 = cnf.log_prob(z[0], x_data=x_data[0])
+    assert log_q_z0.shape == ()
+    assert np.isclose(log_q_z0, log_q_z[0], atol=1e-4)
+    x_datas = np.tile(x_data, (N, 1))
+    assert np.isclose(cnf.log_prob(z, x_data=x_datas), log_q_z, atol=1e-4).all()
+
+    with raises(TypeError):
+        ConditionedNormFlow(D, 2, 10, num_stages=2.0)
+    with raises(ValueError):
+        ConditionedNormFlow(D, 2, 10, num_stages=0)
     return None
@@ -2,6 +2,9 @@
 
 import numpy as np
 import tensorflow as tf
+import pandas as pd
+import json
+import epi.util
 from epi.models import Parameter, Model
 from epi.normalizing_flows import NormalizingFlow
 from epi.util import (
@@ -9,8 +12,17 @@ from epi.util import (
     np_column_vec,
     array_str,
     init_path,
+    file_lock,
+    update_init_cache,
     aug_lag_vars,
     unbiased_aug_grad,
+    aug_lag_surrogate,
+    grad_snr,
+    adapt_batch_size,
+    chunked_R_stats,
+    checkpointed_loop,
+    tf_compile,
+    OptLog,
     AugLagHPs,
     sample_aug_lag_hps,
 )
@@ -122,8 +134,16 @@ def test_init_path():
     init_param = {"loc": 0.0, "scale": 1.0}
 
     s = init_path(arch_string, init_type, init_param)
-    s_true = "./data/foo/iso_gauss_loc=0.00E+00_scale=1.00E+00/"
-    assert s == s_true
+    assert s.startswith(epi.util.INIT_CACHE_DIR) and s.endswith("/")
+    assert len(os.path.basename(s[:-1])) == 16
+    assert os.path.exists(s)
+    assert init_path(arch_string, init_type, dict(init_param)) == s
+    assert init_path("bar", init_type, init_param) != s
+    assert init_path(arch_string, init_type, {"loc": 0.0, "scale": 2.0}) != s
+    s_ML = init_path(arch_string, init_type, init_param, "forward_KL")
+    assert s_ML != s
+    assert init_path(arch_string, init_type, init_param, "forward_KL", 0.05) != s_ML
+    assert init_path(arch_string, init_type, init_param, "reverse_KL", None) == s
 
     with raises(TypeError):
         init_path(1, init_type, init_param)
@@ -144,8 +164,10 @@ def test_init_path():
     Sigma = np.eye(2)
     init_param = {"mu": mu, "Sigma": Sigma}
     s = init_path(arch_string, init_type, init_param)
-    s_true = "./data/foo/gaussian_mu=2x0.00E+00_Sigma=1.00E+00_0.00E+00_1.00E+00/"
-    assert s == s_true
+    assert init_path(arch_string, init_type, {"mu": mu, "Sigma": 2.0 * Sigma}) != s
+    # Path length does not grow with dimensionality.
+    init_param = {"mu": np.zeros(100), "Sigma": np.eye(100)}
+    assert len(init_path(arch_string, init_type, init_param)) == len(s)
     init_param = {"mu": mu}
     with raises(ValueError):
         s = init_path(arch_string, init_type, init_param)
@@ -156,6 +178,51 @@ def test_init_path():
     return None
 
 
+def test_update_init_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(epi.util, "INIT_CACHE_DIR", str(tmp_path) + "/")
+    init_params = [{"loc": 0.0, "scale": float(i + 1)} for i in range(4)]
+    paths = []
+    for i, init_param in enumerate(init_params):
+        path = init_path("foo", "iso_gauss", init_param)
+        with open(path + "ckpt", "wb") as f:
+            f.write(b"0" * 100)
+        paths.append(path)
+        assert update_init_cache(path, "foo", "iso_gauss", max_bytes=1000) == []
+
+    with open(str(tmp_path) + "/index.json", "r") as f:
+        index = json.load(f)
+    keys = [os.path.basename(path[:-1]) for path in paths]
+    assert sorted(index.keys()) == sorted(keys)
+    assert index[keys[0]]["size"] == 100
+    assert index[keys[0]]["arch_string"] == "foo"
+
+    # Using the first initialization makes the second least recently used.
+    update_init_cache(paths[0], "foo", "iso_gauss", max_bytes=1000)
+    evicted = update_init_cache(paths[3], "foo", "iso_gauss", max_bytes=250)
+    assert evicted == [keys[1], keys[2]]
+    assert not os.path.exists(paths[1]) and not os.path.exists(paths[2])
+    assert not os.path.exists(paths[1][:-1] + ".lock")
+    assert os.path.exists(paths[0]) and os.path.exists(paths[3])
+
+    # Locked initializations are not evicted.
+    with file_lock(paths[0]) as acquired:
+        assert acquired
+        assert update_init_cache(paths[3], "foo", "iso_gauss", max_bytes=0) == []
+    assert os.path.exists(paths[0])
+    evicted = update_init_cache(paths[3], "foo", "iso_gauss", max_bytes=0)
+    assert evicted == [keys[0]]
+    assert os.path.exists(paths[3])
+
+    # A removed lock file is created again by the next holder.
+    with file_lock(paths[3]) as acquired:
+        assert acquired
+        os.remove(paths[3][:-1] + ".lock")
+    with file_lock(paths[3]) as acquired:
+        assert acquired
+        assert os.path.exists(paths[3][:-1] + ".lock")
+    return None
+
+
 @pytest.fixture
 def tf_image_classifier1():
     """ Basic model from the tf 2.0 tutorial. """
@@ -330,6 +397,244 @@ def test_unbiased_aug_grad():
     return None
 
 
+def test_aug_lag_surrogate():
+    N = 100
+    mu = np.array([0.0, 0.1, 2 * np.pi, 0.1 * np.pi]).astype(DTYPE)
+    eta = np.random.normal(0.0, 1.0, (4,)).astype(DTYPE)
+    c = 10.0
+
+    lb = np.NINF
+    ub = np.PINF
+    a11 = Parameter("a11", 1, lb, ub)
+    a12 = Parameter("a12", 1, lb, ub)
+    a21 = Parameter("a21", 1, lb, ub)
+    a22 = Parameter("a22", 1, lb, ub)
+    params = [a11, a12, a21, a22]
+    M = Model("lds", params)
+    M.set_eps(linear2D_freq)
+
+    nf = NormalizingFlow(
+        arch_type="coupling", D=4, num_stages=2, num_layers=2, num_units=15
+    )
+
+    # Gradient of the current m+2 backward pass path.
+    with tf.GradientTape(persistent=True) as tape:
+        z, log_q_z = nf(N)
+        params = nf.trainable_variables
+        tape.watch(params)
+        H, R, R1s, R2 = aug_lag_vars(z, log_q_z, M.eps, mu, N)
+        neg_H = -H
+        lagrange_dot = tf.reduce_sum(tf.multiply(eta, R))
+    # The entropy does not depend on the post affine shift.
+    zero = tf.UnconnectedGradients.ZERO
+    H_grad = tape.gradient(neg_H, params, unconnected_gradients=zero)
+    lagrange_grad = tape.gradient(lagrange_dot, params, unconnected_gradients=zero)
+    aug_grad = unbiased_aug_grad(R1s, R2, params, tape)
+    del tape
+    grads = [g1 + g2 + c * g3 for g1, g2, g3 in zip(H_grad, lagrange_grad, aug_grad)]
+
+    # Gradient of the single backward pass surrogate on the same samples.
+    with tf.GradientTape() as tape:
+        z, log_q_z = nf(N)
+        H, R, R1s, R2 = aug_lag_vars(z, log_q_z, M.eps, mu, N)
+        loss = aug_lag_surrogate(H, R, R1s, R2, eta, c)
+    surrogate_grads = tape.gradient(loss, params, unconnected_gradients=zero)
+
+    for g, sg in zip(grads, surrogate_grads):
+        assert np.isclose(g, sg, rtol=1e-3, atol=1e-5).all()
+
+    return None
+
+
+def test_aug_lag_surrogate_symmetric():
+    theta = tf.Variable(np.random.normal(0.0, 1.0, (3,)).astype(DTYPE))
+    eta = np.random.normal(0.0, 1.0, (3,)).astype(DTYPE)
+    c = 2.0
+    with tf.GradientTape(persistent=True) as tape:
+        R1 = tf.square(theta)
+        R2 = tf.sin(theta)
+        R = (R1 + R2) / 2.0
+        H = tf.reduce_sum(theta)
+        loss_split = aug_lag_surrogate(H, R, tf.unstack(R1), R2, eta, c)
+        loss_swap = aug_lag_surrogate(H, R, tf.unstack(R2), R1, eta, c)
+        loss_sym = aug_lag_surrogate(
+            H, R, tf.unstack(R1), R2, eta, c, symmetric=True
+        )
+    grad_split = tape.gradient(loss_split, theta)
+    grad_swap = tape.gradient(loss_swap, theta)
+    grad_sym = tape.gradient(loss_sym, theta)
+    assert np.isclose(grad_sym, (grad_split + grad_swap) / 2.0).all()
+    return None
+
+
+def test_grad_snr():
+    g = [np.ones((3, 2), DTYPE), np.ones((4,), DTYPE)]
+    # Identical halves have no noise.
+    noise = [np.zeros((3, 2), DTYPE), np.ones((4,), DTYPE)]
+    g1 = [x + 0.1 * y for x, y in zip(g, noise)]
+    g2 = [x - 0.1 * y for x, y in zip(g, noise)]
+    snr = grad_snr(g1, g2).numpy()
+    assert np.isclose(snr, 10.0 / (4 * 0.01) - 1.0)
+    # Pure noise clips at zero.
+    assert grad_snr(noise, [-x for x in noise]).numpy() == 0.0
+
+    # Estimate scales with the batch size for gaussian gradient noise.
+    D = 50
+    g = np.ones((D,), DTYPE)
+    snrs = []
+    for N in [100, 400]:
+        sigma = 2.0 / np.sqrt(N / 2)
+        g1 = [g + sigma * np.random.normal(0.0, 1.0, (D,)).astype(DTYPE)]
+        g2 = [g + sigma * np.random.normal(0.0, 1.0, (D,)).astype(DTYPE)]
+        snrs.append(grad_snr(g1, g2).numpy())
+    assert 1.5 < snrs[1] / snrs[0] < 12.0
+    return None
+
+
+def test_adapt_batch_size():
+    N_buckets = [100, 200, 400]
+    target_snr = 1.0
+    assert adapt_batch_size(N_buckets, 200, 0.5, target_snr) == 400
+    assert adapt_batch_size(N_buckets, 400, 0.5, target_snr) == 400
+    assert adapt_batch_size(N_buckets, 200, 3.0, target_snr) == 200
+    assert adapt_batch_size(N_buckets, 200, 4.0, target_snr) == 100
+    assert adapt_batch_size(N_buckets, 100, 100.0, target_snr) == 100
+    return None
+
+
+def test_chunked_R_stats():
+    N = 10
+    N_test = 4
+    m = 3
+    mu = np.array([0.0, 1.0, 2.0]).astype(DTYPE)
+    T_x = np.random.normal(0.0, 1.0, (7, 2, N, m)).astype(DTYPE)
+    calls = []
+
+    def T_x_batch(M):
+        start = sum(calls)
+        calls.append(int(M))
+        return T_x[start : start + M]
+
+    R_means, norms = chunked_R_stats(T_x_batch, 7, 3, N_test, mu)
+    assert calls == [3, 3, 1]
+    assert R_means.shape == (7, 2, m)
+    assert norms.shape == (7, 2)
+    R_means_true = np.mean(T_x[:, :, :N_test], axis=2) - mu
+    norms_true = np.sum(np.square(np.mean(T_x, axis=2) - mu), axis=2)
+    assert np.isclose(R_means, R_means_true, atol=1e-6).all()
+    assert np.isclose(norms, norms_true, atol=1e-5).all()
+
+    return None
+
+
+def test_checkpointed_loop():
+    N = 10
+    n = 3
+    T = 20
+    J = tf.constant(np.random.normal(0.0, 0.5, (N, n, n)).astype(DTYPE))
+    x0 = tf.constant(np.random.normal(0.0, 1.0, (N, n, 1)).astype(DTYPE))
+
+    def step(x, J):
+        return x + tf.tanh(tf.matmul(J, x))
+
+    with tf.GradientTape() as tape:
+        tape.watch(J)
+        x = x0
+        xs = [x]
+        for t in range(T):
+            x = step(x, J)
+            xs.append(x)
+        xs = tf.stack(xs, axis=0)
+        loss = tf.reduce_sum(tf.square(xs))
+    grad = tape.gradient(loss, J)
+
+    for num_segments in [None, 1, 3, T]:
+        with tf.GradientTape() as tape:
+            tape.watch(J)
+            xs_remat = checkpointed_loop(
+                step, x0, T, (J,), num_segments=num_segments, return_all=True
+            )
+            loss_remat = tf.reduce_sum(tf.square(xs_remat))
+        grad_remat = tape.gradient(loss_remat, J)
+        assert xs_remat.shape == (T + 1, N, n, 1)
+        assert np.isclose(xs_remat, xs, atol=1e-5).all()
+        assert np.isclose(grad_remat, grad, rtol=1e-4, atol=1e-5).all()
+
+    x = checkpointed_loop(step, x0, T, (J,))
+    assert np.isclose(x, xs[-1], atol=1e-5).all()
+
+    return None
+
+
+def test_tf_compile(capsys):
+    def f(x):
+        return tf.reduce_sum(tf.tanh(x) * tf.math.softplus(x), axis=1)
+
+    x = np.random.normal(0.0, 1.0, (10, 4)).astype(DTYPE)
+    for jit_compile in [False, True]:
+        f_compiled = tf_compile(f, jit_compile)
+        assert np.isclose(f_compiled(x), f(x), rtol=1e-4).all()
+
+    # The emergent property statistic contains a complex square root.
+    z = np.random.normal(0.0, 1.0, (10, 1)).astype(DTYPE)
+    lds_compiled = tf_compile(linear2D_freq, True)
+    assert np.isclose(lds_compiled(z, z, z, z), linear2D_freq(z, z, z, z)).all()
+
+    # Errors raised by a compiled trace after its first call are not mistaken
+    # for compilation failures.
+    def g(x):
+        return tf.debugging.check_numerics(tf.math.log(x), "log(x)")
+
+    g_compiled = tf_compile(g, True, [tf.TensorSpec((4,), tf.float32)])
+    g_compiled(np.ones((4,), DTYPE))
+    num_warnings = capsys.readouterr().out.count("XLA compilation")
+    try:
+        g_compiled(-np.ones((4,), DTYPE))
+    except tf.errors.InvalidArgumentError:
+        pass
+    assert capsys.readouterr().out.count("XLA compilation") == num_warnings
+
+    return None
+
+
+def test_OptLog():
+    columns = ["k", "iteration", "H", "converged", "R1", "R2"]
+    opt_log = OptLog(
+        columns, 2, int_columns=["k", "iteration"], bool_columns=["converged"]
+    )
+    opt_log.append(k=0, iteration=0, H=1.0, R1=0.5, R2=-0.5)
+    for i in range(1, 5):
+        opt_log.append(k=1, iteration=10 * i, H=1.0 + i, R1=0.5 / i, R2=-0.5 / i)
+    assert opt_log.size == 5
+    opt_log.column("converged")[opt_log.column("iteration") == 40] = True
+
+    df = opt_log.to_df()
+    for x, y in zip(df.columns, columns):
+        assert x == y
+    assert df.shape == (5, len(columns))
+    assert np.equal(df["iteration"], np.array([0, 10, 20, 30, 40])).all()
+    assert df["k"].dtype == int
+    assert df["converged"][4] is True
+    assert df["converged"][3] is None
+    assert np.isclose(df["R2"], -0.5 / np.array([1.0, 1.0, 2.0, 3.0, 4.0])).all()
+
+    # Reload the log written to csv.
+    df.to_csv("opt_log_test.csv")
+    df_csv = pd.read_csv("opt_log_test.csv", index_col=0)
+    os.remove("opt_log_test.csv")
+    opt_log2 = OptLog(
+        columns, 1, int_columns=["k", "iteration"], bool_columns=["converged"]
+    )
+    opt_log2.append_df(df_csv)
+    df2 = opt_log2.to_df()
+    assert df2.shape == df.shape
+    assert np.equal(df2["iteration"], df["iteration"]).all()
+    assert df2["converged"][4] is True
+    assert df2["converged"][3] is None
+    assert np.isclose(df2["R2"], df["R2"]).all()
+    return None
+
+
 def test_AugLagHPs():
     with raises(TypeError):
         AugLagHPs(N="foo")